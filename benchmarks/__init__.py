@@ -0,0 +1,5 @@
+"""
+Benchmarks for the Bikinghub API. The benchmarks run the app in-process with
+the Flask test client against a temporary SQLite database, run them from the
+repository root, e.g. python -m benchmarks.post_throughput
+"""
@@ -0,0 +1,97 @@
+"""
+Shared helpers for the benchmarks
+- benchmark_app: Creates an app with an empty temporary database
+- throughput: Calls a function repeatedly and reports calls per second
+- percentiles: Latency percentiles of a list of samples
+- load_fixture: Recorded FMI and MML responses for the stand-in upstream
+- shift_forecast: Moves a recorded forecast to start at the next hour
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bikinghub import create_app, db
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@contextmanager
+def benchmark_app(config=None):
+    """
+    Creates an app that uses a temporary database file and cache directory.
+    Both are removed when the context exits. Extra config is merged on top of
+    the defaults.
+    """
+    db_fd, db_fname = tempfile.mkstemp(suffix=".db")
+    cache_dir = tempfile.mkdtemp()
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}",
+            "CACHE_DIR": cache_dir,
+            **(config or {}),
+        }
+    )
+    with app.app_context():
+        db.create_all()
+
+    try:
+        yield app
+    finally:
+        with app.app_context():
+            db.engine.dispose()
+        os.close(db_fd)
+        os.unlink(db_fname)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def throughput(func, count):
+    """
+    Calls func(i) for i in range(count) and returns the elapsed time and the
+    number of calls per second.
+    """
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    elapsed = time.perf_counter() - start
+    return {"count": count, "seconds": elapsed, "per_second": count / elapsed}
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """
+    Returns the given percentiles of the samples, nearest-rank method
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        for p in points
+    }
+
+
+def load_fixture(name):
+    """
+    Returns the recorded JSON response of a fixture file
+    """
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def shift_forecast(forecast):
+    """
+    Moves the recorded forecast to start at the next full hour, the API
+    fetches new forecasts when the stored ones are in the past
+    """
+    values = forecast["forecastValues"]
+    recorded = datetime.fromisoformat(values[0]["isolocaltime"])
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    delta = start + timedelta(hours=1) - recorded
+    for value in values:
+        time_ = datetime.fromisoformat(value["isolocaltime"]) + delta
+        value["isolocaltime"] = time_.strftime("%Y-%m-%dT%H:%M:%S")
+    return forecast
@@ -0,0 +1,98 @@
+"""
+Reports the compression ratio and CPU cost of response compression for the
+location and weather collections, and the cost of serving a hot cached page
+with its precompressed variant.
+
+Usage: python -m benchmarks.compression [--locations 2000] [--repeat 20]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from bikinghub import db
+from bikinghub.compression import available_encodings, compress
+from bikinghub.models import Location, WeatherData
+from .common import benchmark_app
+
+
+def _populate(count):
+    db.session.execute(
+        insert(Location),
+        [
+            {
+                "name": f"bench-location{i}",
+                "latitude": 60.0 + (i // 100) * 0.01,
+                "longitude": 24.0 + (i % 100) * 0.02,
+            }
+            for i in range(count)
+        ],
+    )
+    now = datetime.now()
+    db.session.execute(
+        insert(WeatherData),
+        [
+            {
+                "location_id": i + 1,
+                "temperature": 10.5,
+                "temperature_feel": 9,
+                "rain": 0.2,
+                "wind_speed": 3.4,
+                "wind_direction": 180,
+                "weather_description": "Puolipilvistä",
+                "weather_time": now + timedelta(hours=1),
+            }
+            for i in range(count)
+        ],
+    )
+    db.session.commit()
+
+
+def _cpu_time(func, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--locations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with benchmark_app() as app:
+        with app.app_context():
+            _populate(args.locations)
+            client = app.test_client()
+
+            for url in ("/api/locations/", "/api/weather/"):
+                body = client.get(url).get_data()
+                print(f"{url}: {len(body)} bytes")
+                for encoding in available_encodings():
+                    with app.test_request_context(url):
+                        compressed = compress(body, encoding)
+                        cpu = _cpu_time(lambda: compress(body, encoding), args.repeat)
+                    print(
+                        f"  {encoding:5} {len(compressed):9d} bytes "
+                        f"ratio {len(body) / len(compressed):5.1f}x "
+                        f"cpu {cpu * 1000:7.2f} ms"
+                    )
+
+            # The location collection is cached, after the first request the
+            # compressed variant is served from the cache
+            for encoding in available_encodings():
+                headers = {"Accept-Encoding": encoding}
+                client.get("/api/locations/", headers=headers)
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    client.get("/api/locations/", headers=headers)
+                elapsed = (time.perf_counter() - start) / args.repeat
+                print(
+                    f"cached /api/locations/ {encoding:5} {elapsed * 1000:7.2f} ms"
+                    " per request"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Measures the latency percentiles and throughput of the API hot paths with the
+Flask test client against a synthetic database (see bikinghub/synthetic.py).
+FMI and MML are answered by the stand-in server in benchmarks/upstream.py,
+optionally with injected latency and errors.
+The results are written to JSON, and compared against an earlier result file
+with --compare.
+
+Usage: python -m benchmarks.hot_paths [--scale 2000] [--count 200]
+           [--upstream-latency 0] [--upstream-error-rate 0]
+           [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from bikinghub import db, cache
+from bikinghub.encoding import ENCODER
+from bikinghub.models import AuthenticationKey, Favourite, Location, User, WeatherData
+from bikinghub.synthetic import generate, PASSWORD
+from .common import benchmark_app, percentiles
+from .upstream import UpstreamServer
+
+# p50 ratio to the compared result that is reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+def _scenarios(client, args):
+    """
+    Returns (name, count, request) tuples. request(i) makes the i-th request
+    and returns the response, the warmup requests come first so every
+    favourite is deleted only once. A scenario without enough data for its
+    warmup has a count of 0 and is skipped.
+    """
+    locations = [id_ for (id_,) in db.session.query(Location.id).limit(500)]
+    # Users with the most favourites first, their pages are the largest
+    users = [
+        name
+        for (name,) in db.session.query(User.name)
+        .join(Favourite)
+        .group_by(User.id)
+        .order_by(db.func.count(Favourite.id).desc())
+        .limit(100)
+    ]
+    deletable = (
+        db.session.query(User.name, Favourite.id, AuthenticationKey.key)
+        .join(Favourite, Favourite.user_id == User.id)
+        .join(AuthenticationKey, AuthenticationKey.user_id == User.id)
+        .limit(args.count + args.warmup)
+        .all()
+    )
+    # The synthetic forecasts start at the current hour, which has begun, and
+    # WeatherItem.get fetches a new forecast from FMI when the one it finds
+    # is in the past. Without the past hour the scenario measures the lookup.
+    WeatherData.query.filter(
+        WeatherData.location_id.in_(locations),
+        WeatherData.weather_time <= datetime.now(),
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    def uncached_locations(i):
+        cache.clear()
+        return client.get("/api/locations/")
+
+    def fetched_weather(i):
+        # Without stored forecasts the forecast is fetched from the upstream,
+        # which is where --upstream-latency and --upstream-error-rate apply
+        location = locations[i % len(locations)]
+        WeatherData.query.filter_by(location_id=location).delete()
+        db.session.commit()
+        return client.get(f"/api/locations/{location}/weather/")
+
+    def add_favourite(i):
+        return client.post(
+            f"/api/users/{users[i % len(users)]}/favourites/",
+            json={
+                "title": f"bench{i}",
+                "description": "benchmark",
+                "location_id": locations[i % len(locations)],
+            },
+        )
+
+    def delete_favourite(i):
+        name, favourite, key = deletable[i % len(deletable)]
+        return client.delete(
+            f"/api/users/{name}/favourites/{favourite}/",
+            headers={"Bikinghub-Api-Key": key},
+        )
+
+    return [
+        ("entry point", args.count, lambda i: client.get("/api/")),
+        ("locations (cached)", args.count, lambda i: client.get("/api/locations/")),
+        ("locations (uncached)", max(1, args.count // 10), uncached_locations),
+        (
+            "weather item",
+            args.count,
+            lambda i: client.get(
+                f"/api/locations/{locations[i % len(locations)]}/weather/"
+            ),
+        ),
+        ("weather item (upstream fetch)", args.count, fetched_weather),
+        (
+            "favourites page",
+            args.count,
+            lambda i: client.get(f"/api/users/{users[i % len(users)]}/favourites/"),
+        ),
+        (
+            "login",
+            args.login_count,
+            lambda i: client.post(
+                "/api/login/",
+                json={"name": users[i % len(users)], "password": PASSWORD},
+            ),
+        ),
+        ("favourite add", args.count, add_favourite),
+        (
+            "favourite delete (authenticated)",
+            max(0, len(deletable) - args.warmup),
+            delete_favourite,
+        ),
+    ]
+
+
+def _measure(request, count, warmup):
+    for i in range(warmup):
+        request(i)
+    samples = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(warmup, warmup + count):
+        before = time.perf_counter()
+        resp = request(i)
+        samples.append((time.perf_counter() - before) * 1000)
+        if resp.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    result = {
+        "count": count,
+        "errors": errors,
+        "seconds": elapsed,
+        "per_second": count / elapsed,
+        "mean_ms": sum(samples) / len(samples),
+    }
+    result.update({f"{p}_ms": v for p, v in percentiles(samples).items()})
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _report(name, result, baseline=None):
+    line = (
+        f"{name:34} p50 {result['p50_ms']:8.2f} ms  p90 {result['p90_ms']:8.2f} ms  "
+        f"p99 {result['p99_ms']:8.2f} ms  {result['per_second']:8.1f} /s"
+    )
+    if result["errors"]:
+        line += f"  {result['errors']} errors"
+    if baseline:
+        ratio = result["p50_ms"] / baseline["p50_ms"]
+        line += f"  p50 x{ratio:.2f}"
+        if ratio > REGRESSION_THRESHOLD:
+            line += " REGRESSION"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=2000, help="Synthetic users")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=200, help="Requests per path")
+    parser.add_argument("--login-count", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--upstream-latency", type=float, default=0, help="ms")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp:
+            baseline = json.load(fp)["results"]
+
+    results = {}
+    upstream = UpstreamServer(
+        latency=args.upstream_latency,
+        error_rate=args.upstream_error_rate,
+        seed=args.seed,
+    )
+    # Failed requests are answered with 500 like in production instead of
+    # raising in the test client
+    config = dict(upstream.app_config(), PROPAGATE_EXCEPTIONS=False)
+    with upstream, benchmark_app(config) as app:
+        with app.app_context():
+            generate(args.scale, seed=args.seed)
+            client = app.test_client()
+            for name, count, request in _scenarios(client, args):
+                if count < 1:
+                    print(f"{name:34} skipped, not enough data for the warmup")
+                    continue
+                results[name] = _measure(request, count, args.warmup)
+                _report(name, results[name], baseline.get(name))
+
+    output = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "encoder": ENCODER,
+            "scale": args.scale,
+            "seed": args.seed,
+            "upstream_latency_ms": args.upstream_latency,
+            "upstream_error_rate": args.upstream_error_rate,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as fp:
+        json.dump(output, fp, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
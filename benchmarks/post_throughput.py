@@ -0,0 +1,82 @@
+"""
+Measures POST throughput for locations and favourites. Also compares schema
+validation with jsonschema.validate against the compiled validators that the
+resources use.
+
+Usage: python -m benchmarks.post_throughput [--count 500]
+"""
+
+import argparse
+from jsonschema import validate
+from bikinghub import db
+from bikinghub.models import User, Location, Favourite
+from bikinghub.utils import get_validator
+from .common import benchmark_app, throughput
+
+
+def _location_json(i):
+    # Spread the locations ~1 km apart so that none of them is a duplicate
+    return {
+        "name": f"bench-location{i}",
+        "latitude": 60.0 + (i // 100) * 0.01,
+        "longitude": 24.0 + (i % 100) * 0.02,
+    }
+
+
+def _favourite_json(i):
+    return {
+        "title": f"bench-favourite{i}",
+        "description": f"bench-description{i}",
+        "location_id": 1,
+    }
+
+
+def _report(name, result):
+    print(
+        f"{name:32} {result['count']:6d} in {result['seconds']:7.3f} s "
+        f"= {result['per_second']:9.1f} /s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=500)
+    args = parser.parse_args()
+
+    with benchmark_app() as app:
+        with app.app_context():
+            db.session.add(User(name="bench-user", password="bench-password"))
+            db.session.add(Location(name="bench-home", latitude=65.0, longitude=25.4))
+            db.session.commit()
+
+            client = app.test_client()
+
+            def post_location(i):
+                resp = client.post("/api/locations/", json=_location_json(i))
+                assert resp.status_code == 201, resp.status_code
+
+            def post_favourite(i):
+                resp = client.post(
+                    "/api/users/bench-user/favourites/", json=_favourite_json(i)
+                )
+                assert resp.status_code == 201, resp.status_code
+
+            _report("POST /api/locations/", throughput(post_location, args.count))
+            _report(
+                "POST /api/users/<user>/favourites/",
+                throughput(post_favourite, args.count),
+            )
+
+    doc = _favourite_json(0)
+    _report(
+        "jsonschema.validate",
+        throughput(lambda i: validate(doc, Favourite.json_schema()), args.count),
+    )
+    _report(
+        "compiled validator",
+        throughput(lambda i: get_validator(Favourite).validate(doc), args.count),
+    )
+
+
+if __name__ == "__main__":
+    main()
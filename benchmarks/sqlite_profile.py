@@ -0,0 +1,98 @@
+"""
+Compares the database profiles under concurrent reads and writes. Reader
+threads GET a location while a writer thread keeps updating locations, which
+is what happens when weather refreshes are written during GET traffic.
+
+Usage: python -m benchmarks.sqlite_profile [--readers 4] [--seconds 5]
+"""
+
+import argparse
+import threading
+import time
+from sqlalchemy import insert
+from bikinghub import db
+from bikinghub.models import Location
+from .common import benchmark_app, percentiles
+
+LOCATIONS = 100
+
+
+def _milliseconds(samples):
+    # percentiles returns None for a phase without samples, e.g. no readers
+    return {k: None if v is None else v * 1000 for k, v in percentiles(samples).items()}
+
+
+def _format(value, width):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.2f}"
+
+
+def _run(profile, readers, seconds):
+    config = {"DATABASE_PROFILE": profile, "CONVERTER_CACHE_TTL": 0}
+    with benchmark_app(config) as app:
+        with app.app_context():
+            db.session.execute(
+                insert(Location),
+                [
+                    {"name": f"bench{i}", "latitude": 60 + i * 0.01, "longitude": 25}
+                    for i in range(LOCATIONS)
+                ],
+            )
+            db.session.commit()
+
+        deadline = time.perf_counter() + seconds
+        read_latencies = []
+        write_latencies = []
+        errors = []
+
+        def reader(index):
+            client = app.test_client()
+            url = f"/api/locations/{index % LOCATIONS + 1}/"
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                resp = client.get(url)
+                read_latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+
+        def writer():
+            client = app.test_client()
+            i = 0
+            while time.perf_counter() < deadline:
+                i += 1
+                doc = {"name": f"bench{i}", "latitude": 60 + i * 1e-6, "longitude": 25}
+                start = time.perf_counter()
+                resp = client.put(f"/api/locations/{i % LOCATIONS + 1}/", json=doc)
+                write_latencies.append(time.perf_counter() - start)
+                if resp.status_code != 204:
+                    errors.append(resp.status_code)
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    reads = _milliseconds(read_latencies)
+    writes = _milliseconds(write_latencies)
+    print(
+        f"{profile:10} reads {len(read_latencies) / seconds:8.1f}/s "
+        f"p50 {_format(reads['p50'], 6)} ms p99 {_format(reads['p99'], 7)} ms | "
+        f"writes {len(write_latencies) / seconds:7.1f}/s "
+        f"p50 {_format(writes['p50'], 6)} ms p99 {_format(writes['p99'], 7)} ms | "
+        f"errors {len(errors)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    for profile in ("default", "production"):
+        _run(profile, args.readers, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
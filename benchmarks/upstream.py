@@ -0,0 +1,167 @@
+"""
+Stand-in server for the FMI forecast and MML geocoding APIs. It answers with
+the recorded responses in benchmarks/fixtures and can add latency and
+errors, so the weather path can be load tested offline and without an
+MML_API_KEY. The injected latency and errors are drawn from a seeded random
+generator, the same seed gives the same sequence of responses.
+
+Usage: python -m benchmarks.upstream [--port 5001] [--latency 50]
+           [--jitter 20] [--error-rate 0.1] [--error-status 503] [--seed 0]
+
+Then point the app at it, e.g. in instance/config.py:
+
+    FMI_FORECAST_URL = "http://localhost:5001/fmi/forecasts"
+    MML_URL = "http://localhost:5001/mml"
+
+GET /_stats returns the number of served requests and injected errors.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .common import load_fixture, shift_forecast
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    """
+    HTTP server answering FMI and MML requests from the recorded fixtures.
+    - latency, jitter: Milliseconds added to each response, the jitter is
+      uniformly distributed
+    - error_rate: Share of requests answered with error_status
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        latency=0,
+        jitter=0,
+        error_rate=0.0,
+        error_status=503,
+        seed=0,
+    ):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats = {"requests": 0, "errors": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.fixtures = {
+            "/fmi/": lambda: shift_forecast(load_fixture("fmi_forecast.json")),
+            "/mml/geocoding/": lambda: load_fixture("mml_reverse.json"),
+            "/mml/geographic-names/": lambda: load_fixture("mml_places.json"),
+        }
+
+    @property
+    def url(self):
+        """
+        Base URL of the server
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def app_config(self):
+        """
+        Returns the app config that sends the upstream requests to this server
+        """
+        return {
+            "FMI_FORECAST_URL": f"{self.url}/fmi/forecasts",
+            "MML_URL": f"{self.url}/mml",
+        }
+
+    def draw(self):
+        """
+        Returns the delay in seconds and whether the next response fails
+        """
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            failed = self._rng.random() < self.error_rate
+            self.stats["requests"] += 1
+            self.stats["errors"] += failed
+        return delay / 1000, failed
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self._send_json(200, self.server.stats)
+            return
+
+        fixture = next(
+            (
+                load
+                for prefix, load in self.server.fixtures.items()
+                if self.path.startswith(prefix)
+            ),
+            None,
+        )
+        if fixture is None:
+            self._send_json(404, {"error": f"No recorded response for {self.path}"})
+            return
+
+        delay, failed = self.server.draw()
+        time.sleep(delay)
+        if failed:
+            self._send_json(self.server.error_status, {"error": "Injected error"})
+        else:
+            self._send_json(200, fixture())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds")
+    parser.add_argument("--jitter", type=float, default=0, help="Milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = UpstreamServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    print(f"Serving FMI and MML fixtures on {server.url}")
+    for name, value in server.app_config().items():
+        print(f"    {name} = {value!r}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from flask_bcrypt import Bcrypt
 from flasgger import Swagger
+from .session import RoutingSession
 
 cache = Cache()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 bcrypt = Bcrypt()
 api_keys = {}
 
@@ -27,11 +28,26 @@ def create_app(test_config=None):
     - SQLALCHEMY_TRACK_MODIFICATIONS
     - CACHE_TYPE
     - CACHE_DIR
+    - COMPRESS_MIN_SIZE, COMPRESS_LEVEL, COMPRESS_BR_LEVEL (response compression)
+    - CONVERTER_CACHE_TTL (seconds URL converters cache objects for GET
+      requests, 0 disables, see converters.py for multiple processes)
+    - DATABASE_PROFILE ("default" or "production", see database.py)
+    - SQLALCHEMY_READ_URI (optional read-only database for GET requests)
+    - FMI_FORECAST_URL, MML_URL, UPSTREAM_TIMEOUT (weather and geocoding APIs)
+    - INSTRUMENTATION (Server-Timing headers and /metrics, see instrumentation.py)
+    - LOG_LEVEL, LOG_SAMPLE_RATE (see log.py)
+    - PROFILE_REQUESTS, PROFILE_KEEP, PROFILE_DIR (request profiler, see
+      profiling.py)
     """
 
     from . import models
     from . import api
-    from .constants import LINK_RELATIONS_URL
+    from .compression import init_compression
+    from .constants import LINK_RELATIONS_URL, FMI_FORECAST_URL, MML_URL
+    from .database import engine_options, init_database
+    from .instrumentation import init_instrumentation
+    from .log import configure_logging
+    from .migrations import init_schema, upgrade_db_command, db_version_command
 
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
@@ -41,6 +57,19 @@ def create_app(test_config=None):
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         CACHE_TYPE="FileSystemCache",
         CACHE_DIR=os.path.join(app.instance_path, "cache"),
+        COMPRESS_MIN_SIZE=1024,
+        COMPRESS_LEVEL=6,
+        COMPRESS_BR_LEVEL=5,
+        CONVERTER_CACHE_TTL=5,
+        DATABASE_PROFILE="default",
+        FMI_FORECAST_URL=FMI_FORECAST_URL,
+        MML_URL=MML_URL,
+        UPSTREAM_TIMEOUT=5,
+        INSTRUMENTATION=True,
+        LOG_LEVEL="WARNING",
+        LOG_SAMPLE_RATE=0.01,
+        PROFILE_REQUESTS=False,
+        PROFILE_KEEP=100,
     )
 
     if test_config is None:
@@ -48,6 +77,13 @@ def create_app(test_config=None):
     else:
         app.config.from_mapping(test_config)
 
+    configure_logging(app)
+
+    # Pool settings of the database profile, explicitly set engine options win
+    options = engine_options(app.config["DATABASE_PROFILE"])
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
     # merge swagger docs
     doc_dir = "./bikinghub/docs/"
     app.config["SWAGGER"] = {
@@ -68,10 +104,13 @@ def create_app(test_config=None):
 
     with app.app_context():
         db.init_app(app)
-        db.create_all()
+        init_database(app)
+        init_schema()
         cache.init_app(app)
         bcrypt.init_app(app)
 
+    from bikinghub.importer import import_locations_command
+    from bikinghub.profiling import init_profiling, profiles_command
     from bikinghub.converters import (
         UserConverter,
         FavouriteConverter,
@@ -79,6 +118,10 @@ def create_app(test_config=None):
     )
 
     app.cli.add_command(models.init_db_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(db_version_command)
+    app.cli.add_command(import_locations_command)
+    app.cli.add_command(profiles_command)
     app.cli.add_command(models.populate_db_command)
     app.cli.add_command(models.delete_object)
 
@@ -89,6 +132,10 @@ def create_app(test_config=None):
     app.url_map.converters["location"] = LocationConverter
 
     app.register_blueprint(api.api_bp)
+    # Before instrumentation, its hooks read the cache hit indication
+    init_compression(app)
+    init_instrumentation(app)
+    init_profiling(app)
 
     @app.route(LINK_RELATIONS_URL)
     def send_link_relations():
@@ -3,15 +3,17 @@ This module is used to define the API endpoints
 and the resources that are used to handle the requests.
 """
 
-import json
-from flask import Blueprint, Response, request
+from flask import Blueprint, request
 from flask_restful import Api
 from bikinghub.models import User
 from bikinghub.resources import location, user, weather, favourite
-from bikinghub.constants import LINK_RELATIONS_URL, MASON_CONTENT, NAMESPACE
+from bikinghub.constants import LINK_RELATIONS_URL, JSON_CONTENT, NAMESPACE
+from .compression import compress_response
+from .encoding import json_response
 from .utils import BodyBuilder, create_error_response
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
+api_bp.after_request(compress_response)
 
 api = Api(api_bp)
 
@@ -42,27 +44,28 @@ def login():
         if user is None or not user.check_password(password):
             return create_error_response(401, "Unauthorized", "Invalid credentials")
         else:
-            return Response(
-                json.dumps(
-                    {
-                        "message": "Login successful",
-                        "api_key": user.get_api_key(),
-                        "username": user.name,
-                        "@controls": {
-                            "self": {"href": f"/api/users/{name}/"},
-                        },
-                    }
-                ),
+            return json_response(
+                {
+                    "message": "Login successful",
+                    "api_key": user.get_api_key(),
+                    "username": user.name,
+                    "@controls": {
+                        "self": {"href": f"/api/users/{name}/"},
+                    },
+                },
                 200,
+                mimetype=JSON_CONTENT,
             )
 
 
 # Location
 api.add_resource(location.LocationCollection, "/locations/")
+api.add_resource(location.LocationBatch, "/locations/batch/")
 api.add_resource(location.LocationItem, "/locations/<location:location>/")
 
 # Favourites
 api.add_resource(favourite.FavouriteCollection, "/users/<user:user>/favourites/")
+api.add_resource(favourite.FavouriteBatch, "/users/<user:user>/favourites/batch/")
 api.add_resource(
     favourite.FavouriteItem, "/users/<user:user>/favourites/<favourite:favourite>/"
 )
@@ -89,4 +92,4 @@ def entry_point():
     body.add_control_locations_all()
     body.add_control_weather_all()
 
-    return Response(json.dumps(body), 200, mimetype=MASON_CONTENT)
+    return json_response(body, 200)
@@ -0,0 +1,123 @@
+"""
+This module compresses the JSON responses of the API blueprint.
+- negotiate_encoding: Picks the best content coding the client accepts
+- compress: Compresses bytes with gzip or brotli
+- compress_response: after_request hook of the API blueprint
+- page_cache_keys: Cache keys of a page and its compressed variants
+- init_compression: Registers the app hook that removes flask-caching's hit
+  indication
+
+Brotli is used when the brotli package is installed, gzip is always
+available. Responses smaller than COMPRESS_MIN_SIZE bytes are sent as they
+are. The compressed body of a cached page is cached next to it with a digest
+of the uncompressed body, so that a hot page is compressed only once. A
+variant whose digest doesn't match the page it's served for, e.g. because it
+outlived the page, is compressed and stored again.
+"""
+
+import gzip
+import hashlib
+from flask import current_app, g, request
+from bikinghub import cache
+from bikinghub.constants import CACHE_TIME, JSON_CONTENT, MASON_CONTENT
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (JSON_CONTENT, MASON_CONTENT)
+
+
+def available_encodings():
+    """
+    Returns the supported content codings in order of preference
+    """
+    if brotli is not None:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+def negotiate_encoding():
+    """
+    Returns the content coding to use for the current request based on its
+    Accept-Encoding header, or None if the client accepts none of ours.
+    """
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding):
+    """
+    Compresses data with the given content coding using the levels from the
+    app config.
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=current_app.config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(data, compresslevel=current_app.config["COMPRESS_LEVEL"])
+
+
+def page_cache_keys(cache_key):
+    """
+    Returns the cache key of a page together with the keys of its compressed
+    variants. All of them need to be deleted when the page is invalidated.
+    """
+    return [cache_key] + [f"{cache_key}[{enc}]" for enc in available_encodings()]
+
+
+def compress_response(response):
+    """
+    Compresses the response if it's a large enough JSON document and the
+    client accepts a supported content coding.
+    """
+    # page_key and page_key_location store the key of a cached page on g
+    cache_key = g.pop("page_cache_key", None)
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.mimetype not in COMPRESSIBLE_TYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    if cache_key is None:
+        compressed = compress(data, encoding)
+    else:
+        variant_key = f"{cache_key}[{encoding}]"
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        variant = cache.get(variant_key)
+        if variant is not None and variant[0] == digest:
+            compressed = variant[1]
+        else:
+            compressed = compress(data, encoding)
+            cache.set(variant_key, (digest, compressed), timeout=CACHE_TIME)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def _remove_hit_indication(response):
+    # Set by flask-caching on the requests of views cached with
+    # response_hit_indication. g may outlive the request in tests, and the
+    # header is internal.
+    g.pop("flask_caching_hit_cache", None)
+    response.headers.pop("hit_cache", None)
+    return response
+
+
+def init_compression(app):
+    """
+    Registers the hook that removes flask-caching's hit indication from the
+    responses. The hooks run in reverse order, so it has to be registered
+    before the hooks that read the indication, e.g. instrumentation's.
+    """
+    app.after_request(_remove_hit_indication)
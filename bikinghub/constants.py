@@ -35,5 +35,8 @@ MML_URL = "https://avoin-paikkatieto.maanmittauslaitos.fi"
 # Cache page size
 PAGE_SIZE = 50
 
+# Maximum number of items in a batch request
+BATCH_SIZE = 100
+
 # Timeout for cache
 CACHE_TIME = 60  # * 60 * 24 * 7  # One week
@@ -1,12 +1,168 @@
 """
 This file contains the converters for the URL routing.
 The converters basic structures are taken from the course material.
+
+The converters look objects up through two caches before querying the
+database: an identity map that lives for the duration of the request and a
+short lived object cache shared between requests. The object cache stores
+plain column values which are turned back into persistent instances without
+a query. Objects are evicted from it whenever they are updated or deleted.
+
+The object cache is per process and only sees the writes of its own
+process, so it assumes the app runs in a single process. With several
+worker processes a GET may see a row another worker changed or deleted for
+up to CONVERTER_CACHE_TTL seconds; set it to 0 to disable the cache there.
+Requests other than GET and HEAD always load their objects from the
+database, so a write never flushes against a row that no longer exists.
 """
 
+import logging
+import threading
+import time
+from flask import current_app, has_app_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from werkzeug.exceptions import NotFound
 from werkzeug.routing import BaseConverter
+from bikinghub import db
+from bikinghub.log import sampled
 from bikinghub.models import Location, User, Favourite
 
+logger = logging.getLogger(__name__)
+
+# Methods whose objects may come from the object cache
+CACHED_METHODS = ("GET", "HEAD")
+
+
+class ObjectCache:
+    """
+    Caches model rows by (model, column, value) for ttl seconds. Rows are
+    stored as dictionaries of column values, never as instances, because an
+    instance belongs to the session of the request that loaded it.
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._rows = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, column, value):
+        """
+        Returns the cached row or None if there is none or it has expired
+        """
+        entry = self._rows.get((model, column, value))
+        if entry is None:
+            return None
+        expires, row = entry
+        if expires < time.monotonic():
+            return None
+        return row
+
+    def put(self, obj, column, value):
+        """
+        Caches the column values of obj under the given lookup
+        """
+        mapper = inspect(type(obj))
+        row = {attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs}
+        key = (type(obj), column, value)
+        with self._lock:
+            if len(self._rows) >= self.max_size:
+                self._purge()
+            self._rows[key] = (time.monotonic() + self.ttl, row)
+            self._keys.setdefault((type(obj), obj.id), set()).add(key)
+
+    def evict(self, obj):
+        """
+        Removes every cached lookup of obj
+        """
+        with self._lock:
+            for key in self._keys.pop((type(obj), obj.id), ()):
+                self._rows.pop(key, None)
+
+    def _purge(self):
+        now = time.monotonic()
+        for key, (expires, _) in list(self._rows.items()):
+            if expires < now:
+                del self._rows[key]
+        if len(self._rows) >= self.max_size:
+            self._rows.clear()
+            self._keys.clear()
+
+
+def _object_cache():
+    """
+    Returns the object cache of the current app, or None if it's disabled by
+    setting CONVERTER_CACHE_TTL to 0.
+    """
+    extensions = current_app.extensions
+    if "bikinghub_object_cache" not in extensions:
+        ttl = current_app.config["CONVERTER_CACHE_TTL"]
+        extensions["bikinghub_object_cache"] = ObjectCache(ttl) if ttl else None
+    return extensions["bikinghub_object_cache"]
+
+
+def _instance_from_row(model, row):
+    """
+    Turns cached column values into an instance that is persistent in the
+    current session, without emitting SQL.
+    """
+    mapper = inspect(model)
+    identity = mapper.identity_key_from_primary_key([row["id"]])
+    obj = db.session.identity_map.get(identity)
+    if obj is None:
+        obj = mapper.class_manager.new_instance()
+        for key, value in row.items():
+            setattr(obj, key, value)
+        make_transient_to_detached(obj)
+        db.session.add(obj)
+    return obj
+
+
+def load_object(model, column, value):
+    """
+    Looks up an object by a column for the URL converters. The request's
+    identity map is checked first, then the object cache on GET and HEAD
+    requests, and the database only when neither has the object. Returns
+    None if the object doesn't exist.
+    """
+    # Kept in the WSGI environ rather than on g, since an app context and its g
+    # can outlive a single request
+    identity_map = request.environ.setdefault("bikinghub.identity_map", {})
+    key = (model, column, value)
+    if key in identity_map:
+        return identity_map[key]
+
+    object_cache = _object_cache()
+    row = None
+    if object_cache and request.method in CACHED_METHODS:
+        row = object_cache.get(*key)
+    if row is not None:
+        obj = _instance_from_row(model, row)
+    else:
+        obj = model.query.filter_by(**{column: value}).first()
+        if obj is not None and object_cache:
+            object_cache.put(obj, column, value)
+
+    identity_map[key] = obj
+    return obj
+
+
+@event.listens_for(Session, "after_flush")
+def _evict_flushed(session, flush_context):
+    """
+    Evicts updated and deleted objects from the object cache
+    """
+    if not has_app_context():
+        return
+    object_cache = current_app.extensions.get("bikinghub_object_cache")
+    if object_cache is None:
+        return
+    for obj in list(session.dirty) + list(session.deleted):
+        if getattr(obj, "id", None) is not None:
+            object_cache.evict(obj)
+
 
 class UserConverter(BaseConverter):
     """
@@ -14,13 +170,13 @@ class UserConverter(BaseConverter):
     """
 
     def to_python(self, value):
-        user = User.query.filter_by(name=value).first()
+        user = load_object(User, "name", value)
         if not user:
             raise NotFound
         return user
 
     def to_url(self, value):
-        print(f"UserConverter: {value}")
+        sampled(logger, "UserConverter.to_url: %s", value)
         return str(value.name)
 
 
@@ -30,13 +186,13 @@ class FavouriteConverter(BaseConverter):
     """
 
     def to_python(self, value):
-        favourite = Favourite.query.filter_by(id=value).first()
+        favourite = load_object(Favourite, "id", value)
         if not favourite:
             raise NotFound
         return favourite
 
     def to_url(self, value):
-        print(f"FavouriteConverter: {value}")
+        sampled(logger, "FavouriteConverter.to_url: %s", value)
         return str(value.id)
 
 
@@ -68,11 +224,11 @@ class LocationConverter(BaseConverter):
     """
 
     def to_python(self, value):
-        location = Location.query.filter_by(id=value).first()
+        location = load_object(Location, "id", value)
         if not location:
             raise NotFound
         return location
 
     def to_url(self, value):
-        print(f"LocationConverter: {value}")
+        sampled(logger, "LocationConverter.to_url: %s", value)
         return str(value.id)
@@ -0,0 +1,87 @@
+"""
+This module contains the performance profiles of the SQLite database.
+- SQLITE_PROFILES: The PRAGMA settings of each profile
+- engine_options: SQLAlchemy engine options of a profile
+- init_database: Applies the selected profile to the app's engine
+
+The profile is selected with the DATABASE_PROFILE config value. The
+"production" profile switches the database to WAL mode, so that readers no
+longer wait for writers, relaxes synchronous to NORMAL which is safe in WAL
+mode, and gives SQLite a larger page cache, memory mapped I/O and a busy
+timeout instead of failing immediately with "database is locked". Single
+PRAGMAs can be overridden with the SQLITE_PRAGMAS config value.
+"""
+
+from sqlalchemy import create_engine, event
+from bikinghub import db
+from bikinghub.session import READ_ENGINE
+
+SQLITE_PROFILES = {
+    "default": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,  # in KiB when negative, i.e. 64 MB
+        "mmap_size": 268435456,  # 256 MB
+        "busy_timeout": 5000,  # ms
+        "temp_store": "MEMORY",
+    },
+}
+
+POOL_OPTIONS = {
+    "default": {},
+    "production": {
+        "pool_size": 8,
+        "max_overflow": 8,
+        "pool_timeout": 10,
+    },
+}
+
+
+def engine_options(profile):
+    """
+    Returns the SQLAlchemy engine options of the profile
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown database profile: {profile}")
+    return dict(POOL_OPTIONS[profile])
+
+
+def _set_pragmas(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return set_pragmas
+
+
+def init_database(app):
+    """
+    Applies the database profile of the app to its engines and creates the
+    read engine if SQLALCHEMY_READ_URI is set. Has to be called in an app
+    context right after db.init_app, before any connection to the database
+    is opened.
+    """
+    replica = None
+    if app.config.get("SQLALCHEMY_READ_URI"):
+        replica = create_engine(
+            app.config["SQLALCHEMY_READ_URI"],
+            **app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+        )
+        app.extensions[READ_ENGINE] = replica
+
+    pragmas = dict(SQLITE_PROFILES[app.config["DATABASE_PROFILE"]])
+    pragmas.update(app.config.get("SQLITE_PRAGMAS") or {})
+    if not pragmas:
+        return
+
+    if db.engine.dialect.name == "sqlite":
+        event.listen(db.engine, "connect", _set_pragmas(pragmas))
+
+    # The journal mode is a property of the database file which a read-only
+    # connection can't change
+    if replica is not None and replica.dialect.name == "sqlite":
+        pragmas.pop("journal_mode", None)
+        event.listen(replica, "connect", _set_pragmas(pragmas))
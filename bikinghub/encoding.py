@@ -0,0 +1,57 @@
+"""
+This module encodes the response bodies of the API to JSON.
+- dumps: Encodes an object to compact JSON bytes
+- json_response: Creates a Flask Response with a JSON encoded body
+
+orjson is used when it is installed, otherwise the encoding falls back to the
+standard library json module. Both encoders produce the same compact output
+and serialize datetime objects as ISO 8601 strings.
+"""
+
+import json
+from datetime import date, datetime
+from flask import Response
+from bikinghub.constants import MASON_CONTENT
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """
+    Serializes the types the standard library encoder doesn't know about
+    """
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    ENCODER = "orjson"
+
+    def dumps(obj):
+        """
+        Encodes an object to JSON bytes with orjson
+        """
+        return orjson.dumps(obj)
+
+else:
+    ENCODER = "json"
+
+    def dumps(obj):
+        """
+        Encodes an object to JSON bytes with the standard library json module
+        """
+        return json.dumps(
+            obj, separators=(",", ":"), ensure_ascii=False, default=_default
+        ).encode("utf-8")
+
+
+def json_response(body, status=200, mimetype=MASON_CONTENT, headers=None):
+    """
+    Creates a response with the body encoded to JSON. Mason is the default
+    media type since almost every response of the API is a Mason document.
+    """
+    return Response(dumps(body), status, headers=headers, mimetype=mimetype)
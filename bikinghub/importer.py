@@ -0,0 +1,288 @@
+"""
+This module contains the bulk import of locations.
+- read_csv: Streams locations from a CSV file
+- read_geojson: Streams locations from a GeoJSON FeatureCollection
+- read_ndjson: Streams locations from newline delimited GeoJSON features
+- GridIndex: In-memory spatial index for finding nearby points
+- import_locations: Deduplicates and inserts locations in batches
+- import_locations_command: The import-locations CLI command
+
+Importing through LocationCollection.post costs one request and one duplicate
+search per location. The importer loads the coordinates of the existing
+locations once into a grid index, so each duplicate check only looks at the
+points in the neighbouring cells, and inserts the new locations with one
+executemany per batch.
+"""
+
+import csv
+import json
+import math
+import os
+import time
+import click
+from flask.cli import with_appcontext
+from jsonschema import ValidationError
+from sqlalchemy import insert, select
+from bikinghub import db, cache
+from bikinghub.models import Location
+from bikinghub.utils import get_validator, haversine
+
+EARTH_RADIUS = 6371  # km
+CHUNK_SIZE = 64 * 1024
+
+LATITUDE_COLUMNS = ("latitude", "lat", "y")
+LONGITUDE_COLUMNS = ("longitude", "lon", "lng", "x")
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _column(row, names):
+    for name in names:
+        if name in row:
+            return row[name]
+    return None
+
+
+def read_csv(path):
+    """
+    Yields a location document for each row of a CSV file. The file needs a
+    name column and latitude/lat/y and longitude/lon/lng/x columns.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as fp:
+        for row in csv.DictReader(fp):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            yield {
+                "name": row.get("name"),
+                "latitude": _to_float(_column(row, LATITUDE_COLUMNS)),
+                "longitude": _to_float(_column(row, LONGITUDE_COLUMNS)),
+            }
+
+
+def _feature_to_location(feature):
+    properties = feature.get("properties") or {}
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") != "Point":
+        return {"name": properties.get("name")}
+    # GeoJSON positions are longitude, latitude
+    lon, lat = geometry["coordinates"][:2]
+    return {"name": properties.get("name"), "latitude": lat, "longitude": lon}
+
+
+def _iter_array(fp, key):
+    """
+    Yields the items of the array under key of a JSON document one at a
+    time, reading the file in chunks instead of loading it whole
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = None
+    eof = False
+    while True:
+        if pos is None:
+            start = buffer.find(f'"{key}"')
+            bracket = buffer.find("[", start) if start != -1 else -1
+            if bracket != -1:
+                pos = bracket + 1
+        else:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            if pos < len(buffer):
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield item
+                    pos = end
+                    continue
+            # Keep only the unparsed part in memory
+            buffer = buffer[pos:]
+            pos = 0
+        if eof:
+            if pos is None:
+                raise ValueError(f"No {key} array in the file")
+            raise ValueError(f"Unterminated {key} array")
+        chunk = fp.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def read_geojson(path):
+    """
+    Yields a location document for each Point feature of a GeoJSON
+    FeatureCollection. The name is read from the name property.
+    """
+    with open(path, encoding="utf-8") as fp:
+        for feature in _iter_array(fp, "features"):
+            yield _feature_to_location(feature)
+
+
+def read_ndjson(path):
+    """
+    Yields a location document for each line of a file with one GeoJSON
+    feature per line
+    """
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            if line.strip():
+                yield _feature_to_location(json.loads(line))
+
+
+READERS = {
+    ".csv": read_csv,
+    ".geojson": read_geojson,
+    ".json": read_geojson,
+    ".ndjson": read_ndjson,
+    ".geojsonl": read_ndjson,
+}
+
+
+class GridIndex:
+    """
+    Spatial index of points in a grid of cells about distance kilometers
+    high. Points closer than distance to a point are always in its own or
+    the neighbouring cells.
+    """
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.cell = math.degrees(distance / EARTH_RADIUS)
+        self.cells = {}
+
+    def _cell_width(self, row):
+        # Longitude degrees get shorter towards the poles, the widest point
+        # of the row decides the width of its cells
+        lat = max(abs(row * self.cell), abs((row + 1) * self.cell))
+        return self.cell / max(math.cos(math.radians(min(lat, 90))), 1e-9)
+
+    def add(self, lat, lon):
+        """
+        Adds a point to the index
+        """
+        row = math.floor(lat / self.cell)
+        column = math.floor(lon / self._cell_width(row))
+        self.cells.setdefault((row, column), []).append((lat, lon))
+
+    def near(self, lat, lon):
+        """
+        Returns True if a point of the index is within distance of the point
+        """
+        row = math.floor(lat / self.cell)
+        dlon = self.cell / max(math.cos(math.radians(min(abs(lat), 90))), 1e-9)
+        for neighbour in (row - 1, row, row + 1):
+            width = self._cell_width(neighbour)
+            first = math.floor((lon - dlon) / width)
+            last = math.floor((lon + dlon) / width)
+            for column in range(first, last + 1):
+                for point in self.cells.get((neighbour, column), ()):
+                    if haversine(lat, lon, *point) <= self.distance:
+                        return True
+        return False
+
+    def __len__(self):
+        return sum(len(points) for points in self.cells.values())
+
+
+def import_locations(
+    documents, distance=0.05, batch_size=1000, dry_run=False, progress=None
+):
+    """
+    Validates the location documents, skips the ones within distance
+    kilometers of an existing or already imported location, and inserts the
+    rest in transactions of batch_size rows. progress is called with the
+    statistics after each batch. Returns the statistics.
+    """
+    validator = get_validator(Location)
+    index = GridIndex(distance)
+    for lat, lon in db.session.execute(select(Location.latitude, Location.longitude)):
+        index.add(lat, lon)
+
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    batch = []
+
+    def flush():
+        if not dry_run:
+            db.session.execute(insert(Location), batch)
+            db.session.commit()
+        stats["inserted"] += len(batch)
+        batch.clear()
+        if progress is not None:
+            progress(stats)
+
+    for document in documents:
+        stats["read"] += 1
+        try:
+            validator.validate(document)
+        except ValidationError:
+            stats["invalid"] += 1
+            continue
+        lat, lon = document["latitude"], document["longitude"]
+        if index.near(lat, lon):
+            stats["duplicates"] += 1
+            continue
+        index.add(lat, lon)
+        batch.append(document)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if stats["inserted"] and not dry_run:
+        cache.clear()
+    return stats
+
+
+@click.command("import-locations")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(sorted(ext.lstrip(".") for ext in READERS)),
+    help="File format, by default read from the file extension",
+)
+@click.option(
+    "--distance",
+    default=0.05,
+    show_default=True,
+    help="Kilometers within which a location is a duplicate",
+)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Check the file without inserting")
+@with_appcontext
+def import_locations_command(path, file_format, distance, batch_size, dry_run):
+    """
+    Imports locations from a CSV, GeoJSON or newline delimited GeoJSON file.
+    """
+    extension = f".{file_format}" if file_format else os.path.splitext(path)[1]
+    reader = READERS.get(extension.lower())
+    if reader is None:
+        raise click.UsageError(f"Unknown file format: {extension}")
+
+    start = time.perf_counter()
+
+    def report(stats):
+        rate = stats["read"] / max(time.perf_counter() - start, 1e-9)
+        click.echo(
+            f"{stats['read']} read, {stats['inserted']} inserted, "
+            f"{stats['duplicates']} duplicates, {stats['invalid']} invalid "
+            f"({rate:.0f} rows/s)"
+        )
+
+    stats = import_locations(
+        reader(path),
+        distance=distance,
+        batch_size=batch_size,
+        dry_run=dry_run,
+        progress=report,
+    )
+    report(stats)
+    if dry_run:
+        click.echo("Dry run, nothing was inserted")
@@ -0,0 +1,281 @@
+"""
+This module contains the request instrumentation of the app.
+- init_instrumentation: Registers the request hooks and the /metrics endpoint
+- upstream_get: requests.get that records the time spent on an upstream API
+- UpstreamError: Raised by upstream_get when an upstream API fails
+- Metrics: Counters of the app, rendered in the Prometheus text format
+
+Each request records its wall time, the number and time of its SQL queries,
+the time spent on upstream HTTP requests and whether the page cache was hit.
+The numbers are returned in a Server-Timing header, which browsers show in
+their developer tools, and added to the counters served at /metrics.
+Instrumentation is turned off with INSTRUMENTATION = False.
+"""
+
+import threading
+import time
+from collections import defaultdict
+import requests
+from flask import Response, current_app, g, has_app_context, has_request_context
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS = "bikinghub_metrics"
+TIMING = "bikinghub.timing"
+
+# Upper bounds of the request duration histogram in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestTiming:
+    """
+    Measurements of a single request
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.upstream_requests = 0
+        self.upstream_seconds = 0.0
+        self.cache_hit = None
+
+
+class Metrics:
+    """
+    Counters of all requests served by the app. The counters are updated from
+    several threads, so every update holds the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.durations = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.duration_sums = defaultdict(float)
+        self.db_queries = defaultdict(int)
+        self.db_seconds = defaultdict(float)
+        self.upstream_requests = defaultdict(int)
+        self.upstream_seconds = defaultdict(float)
+        self.cache = defaultdict(int)
+
+    def observe_request(self, endpoint, method, status, seconds, timing):
+        """
+        Adds a finished request to the counters
+        """
+        with self._lock:
+            self.requests[(endpoint, method, str(status))] += 1
+            counts = self.durations[(endpoint, method)]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.duration_sums[(endpoint, method)] += seconds
+            self.db_queries[(endpoint,)] += timing.db_queries
+            self.db_seconds[(endpoint,)] += timing.db_seconds
+            if timing.cache_hit is not None:
+                self.cache[(endpoint, "hit" if timing.cache_hit else "miss")] += 1
+
+    def observe_upstream(self, upstream, seconds):
+        """
+        Adds an upstream HTTP request to the counters
+        """
+        with self._lock:
+            self.upstream_requests[(upstream,)] += 1
+            self.upstream_seconds[(upstream,)] += seconds
+
+    def render(self):
+        """
+        Returns the counters in the Prometheus text exposition format
+        """
+        lines = []
+
+        def family(name, kind, help_text, values, labels):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(zip(labels, key))} {value}")
+
+        with self._lock:
+            family(
+                "bikinghub_requests_total",
+                "counter",
+                "Requests by endpoint, method and status.",
+                self.requests,
+                ("endpoint", "method", "status"),
+            )
+            name = "bikinghub_request_duration_seconds"
+            lines.append(f"# HELP {name} Request wall time.")
+            lines.append(f"# TYPE {name} histogram")
+            for key, counts in sorted(self.durations.items()):
+                labels = list(zip(("endpoint", "method"), key))
+                for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                    le = _labels(labels + [("le", str(bound))])
+                    lines.append(f"{name}_bucket{le} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {self.duration_sums[key]}")
+                lines.append(f"{name}_count{_labels(labels)} {counts[-1]}")
+            family(
+                "bikinghub_db_queries_total",
+                "counter",
+                "SQL queries by endpoint.",
+                self.db_queries,
+                ("endpoint",),
+            )
+            family(
+                "bikinghub_db_query_seconds_total",
+                "counter",
+                "Time spent on SQL queries by endpoint.",
+                self.db_seconds,
+                ("endpoint",),
+            )
+            family(
+                "bikinghub_upstream_requests_total",
+                "counter",
+                "Requests to upstream APIs.",
+                self.upstream_requests,
+                ("upstream",),
+            )
+            family(
+                "bikinghub_upstream_seconds_total",
+                "counter",
+                "Time spent on upstream API requests.",
+                self.upstream_seconds,
+                ("upstream",),
+            )
+            family(
+                "bikinghub_cache_requests_total",
+                "counter",
+                "Page cache lookups by endpoint and result.",
+                self.cache,
+                ("endpoint", "result"),
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    pairs = [
+        (name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def _current_timing():
+    if not has_request_context():
+        return None
+    return request.environ.get(TIMING)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("bikinghub_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    elapsed = time.perf_counter() - conn.info["bikinghub_query_start"].pop()
+    timing = _current_timing()
+    if timing is not None:
+        timing.db_queries += 1
+        timing.db_seconds += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get("bikinghub_query_start")
+        if starts:
+            starts.pop()
+
+
+class UpstreamError(Exception):
+    """
+    An upstream API couldn't be reached, timed out or answered with an error
+    status or a malformed body
+    """
+
+    def __init__(self, upstream, message):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+
+
+def upstream_get(upstream, url, **kwargs):
+    """
+    Makes a GET request with requests.get and records its time under the
+    upstream's name, e.g. "fmi" or "mml". Raises UpstreamError if the request
+    fails or the response has an error status.
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+    except requests.RequestException as e:
+        raise UpstreamError(upstream, str(e)) from e
+    finally:
+        elapsed = time.perf_counter() - start
+        timing = _current_timing()
+        if timing is not None:
+            timing.upstream_requests += 1
+            timing.upstream_seconds += elapsed
+        if has_app_context() and METRICS in current_app.extensions:
+            current_app.extensions[METRICS].observe_upstream(upstream, elapsed)
+
+
+def _start_request():
+    request.environ[TIMING] = RequestTiming()
+
+
+def _finish_request(response):
+    timing = request.environ.pop(TIMING, None)
+    # Set by flask-caching on the requests of views cached with
+    # response_hit_indication, removed by compression after this hook
+    cache_hit = g.get("flask_caching_hit_cache")
+    if timing is None:
+        return response
+
+    timing.cache_hit = cache_hit
+    seconds = time.perf_counter() - timing.start
+    current_app.extensions[METRICS].observe_request(
+        request.endpoint or "unmatched",
+        request.method,
+        response.status_code,
+        seconds,
+        timing,
+    )
+
+    server_timing = [
+        f'db;desc="{timing.db_queries} queries";dur={timing.db_seconds * 1000:.2f}'
+    ]
+    if timing.upstream_requests:
+        server_timing.append(
+            f'upstream;desc="{timing.upstream_requests} requests";'
+            f"dur={timing.upstream_seconds * 1000:.2f}"
+        )
+    if timing.cache_hit is not None:
+        server_timing.append(f"cache;desc={'hit' if timing.cache_hit else 'miss'}")
+    server_timing.append(f"app;dur={seconds * 1000:.2f}")
+    response.headers.add("Server-Timing", ", ".join(server_timing))
+    return response
+
+
+def metrics():
+    """
+    Serves the counters in the Prometheus text format
+    """
+    return Response(
+        current_app.extensions[METRICS].render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def init_instrumentation(app):
+    """
+    Registers the request hooks and the /metrics endpoint on the app unless
+    INSTRUMENTATION is False
+    """
+    if not app.config.get("INSTRUMENTATION", True):
+        return
+    app.extensions[METRICS] = Metrics()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
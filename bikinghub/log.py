@@ -0,0 +1,87 @@
+"""
+This module configures the logging of the app.
+- configure_logging: Sets the level of the bikinghub loggers and starts the
+  background thread that writes their records
+- sampled: Logs a per-item debug event for a share of the calls only
+- KeyValueFormatter: Formats a record as key=value pairs
+
+Modules log with logging.getLogger(__name__) and %-style arguments, so a
+message is only formatted if its level is enabled. The records are put on a
+queue and written to stderr by a QueueListener thread, so a request never
+waits for the stream. With the default LOG_LEVEL = "WARNING" the debug and
+info events on the hot paths are skipped after a cached level check.
+"""
+
+import atexit
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = "bikinghub"
+
+# Attributes of every LogRecord, the rest come from extra={...}
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_sample_rate = 0.0
+_random = random.Random()
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formats records as "time=... level=... logger=... msg=..." followed by
+    the fields passed with extra={...}
+    """
+
+    def format(self, record):
+        fields = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                fields[key] = value
+        line = " ".join(f"{key}={_quote(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _quote(value):
+    value = str(value)
+    if not value or any(char in value for char in ' "='):
+        return '"' + value.replace('"', '\\"') + '"'
+    return value
+
+
+def sampled(logger, msg, *args):
+    """
+    Logs a debug event for LOG_SAMPLE_RATE of the calls. Meant for events
+    that happen once per item of a page, which would flood the log otherwise.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and _random.random() < _sample_rate:
+        logger.debug(msg, *args)
+
+
+def configure_logging(app):
+    """
+    Applies LOG_LEVEL and LOG_SAMPLE_RATE of the app. The queue handler and
+    its listener thread are created on the first call only, later apps of
+    the same process share them.
+    """
+    global _listener, _sample_rate
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(app.config["LOG_LEVEL"])
+    _sample_rate = app.config["LOG_SAMPLE_RATE"]
+
+    if _listener is None:
+        records = queue.SimpleQueue()
+        stream = logging.StreamHandler()
+        stream.setFormatter(KeyValueFormatter())
+        _listener = QueueListener(records, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        logger.addHandler(QueueHandler(records))
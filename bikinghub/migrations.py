@@ -0,0 +1,205 @@
+"""
+This module contains the versioned schema migrations of the database.
+- MIGRATIONS: The migrations in the order they are applied
+- current_version: Returns the schema version recorded in the database
+- init_schema: Creates or stamps the schema when the app starts
+- upgrade: Applies the pending migrations
+- create_index_online: Builds an index without a long write lock
+- backfill: Updates rows in batches, committing after each batch
+
+The version is recorded in the schema_version table. Once a version is
+recorded, the migrations own the schema and startup no longer calls
+db.create_all(). New tables, columns and indexes are added to the models
+and rolled out with a new migration appended to MIGRATIONS:
+
+    flask --app bikinghub upgrade-db
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, Text, inspect
+from sqlalchemy import select, update
+from bikinghub import db
+
+Migration = namedtuple("Migration", ["version", "description", "upgrade"])
+
+# Not part of db.metadata, so that db.create_all() never touches it
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", Text, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# The schema created by db.create_all() before migrations were introduced
+BASELINE = 1
+
+
+def create_index_online(table_name, index_name):
+    """
+    Creates an index of the models if it doesn't exist yet. PostgreSQL builds
+    it concurrently so that writes continue during the build. SQLite can't
+    build indexes concurrently, so the index is built in its own short
+    transaction, readers aren't blocked in WAL mode.
+    """
+    table = db.metadata.tables[table_name]
+    index = next(index for index in table.indexes if index.name == index_name)
+    engine = db.engine
+    if engine.dialect.name == "postgresql":
+        index.dialect_options["postgresql"]["concurrently"] = True
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            index.create(bind=conn, checkfirst=True)
+    else:
+        with engine.begin() as conn:
+            index.create(bind=conn, checkfirst=True)
+
+
+def backfill(table, values, where, batch_size=1000):
+    """
+    Updates the rows of the table matching where with values in batches of
+    batch_size rows, committing after each batch so that other writers get
+    the database between batches. The where clause has to exclude the rows
+    that are already updated. Returns the number of updated rows.
+    """
+    primary_key = list(table.primary_key.columns)[0]
+    total = 0
+    while True:
+        with db.engine.begin() as conn:
+            ids = conn.scalars(select(primary_key).where(where).limit(batch_size))
+            ids = list(ids)
+            if not ids:
+                return total
+            conn.execute(update(table).where(primary_key.in_(ids)).values(values))
+        total += len(ids)
+
+
+def _baseline():
+    db.create_all()
+
+
+def _add_lookup_indexes():
+    for table_name, index_name in (
+        ("favourite", "ix_favourite_location_id"),
+        ("favourite", "ix_favourite_user_id_location_id"),
+        ("comment", "ix_comment_user_id"),
+        ("comment", "ix_comment_location_id"),
+        ("location", "ix_location_latitude_longitude"),
+        ("weather_data", "ix_weather_data_location_id_weather_time"),
+        ("traffic_data", "ix_traffic_data_location_id"),
+        ("authentication_key", "ix_authentication_key_user_id"),
+    ):
+        create_index_online(table_name, index_name)
+
+
+MIGRATIONS = [
+    Migration(BASELINE, "Initial schema", _baseline),
+    Migration(2, "Foreign key and lookup indexes", _add_lookup_indexes),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+def current_version():
+    """
+    Returns the latest schema version recorded in the database or None if
+    the database has no version yet
+    """
+    if not inspect(db.engine).has_table(schema_version.name):
+        return None
+    with db.engine.connect() as conn:
+        return conn.scalar(
+            select(schema_version.c.version)
+            .order_by(schema_version.c.version.desc())
+            .limit(1)
+        )
+
+
+def stamp(version):
+    """
+    Records the version and all versions before it as applied without
+    running their migrations
+    """
+    schema_version.create(bind=db.engine, checkfirst=True)
+    applied = current_version() or 0
+    with db.engine.begin() as conn:
+        for migration in MIGRATIONS:
+            if applied < migration.version <= version:
+                _record(conn, migration)
+
+
+def _record(conn, migration):
+    conn.execute(
+        schema_version.insert().values(
+            version=migration.version,
+            description=migration.description,
+            applied_at=datetime.now(),
+        )
+    )
+
+
+def _is_legacy():
+    tables = inspect(db.engine).get_table_names()
+    return any(name in tables for name in db.metadata.tables)
+
+
+def init_schema():
+    """
+    Called when the app starts. Does nothing once a version is recorded.
+    An empty database gets the schema of the models and is stamped with the
+    latest version. A database created before migrations were introduced is
+    stamped with the baseline, its pending migrations are applied with
+    upgrade-db.
+    """
+    if current_version() is not None:
+        return
+    legacy = _is_legacy()
+    db.create_all()
+    stamp(BASELINE if legacy else HEAD)
+
+
+def upgrade(target=None):
+    """
+    Applies the migrations after the current version up to target, or all of
+    them. Each migration is recorded right after it succeeds so that a
+    failed upgrade continues from the failed migration. Returns the applied
+    migrations.
+    """
+    if current_version() is None and _is_legacy():
+        stamp(BASELINE)
+    version = current_version() or 0
+    target = HEAD if target is None else target
+    schema_version.create(bind=db.engine, checkfirst=True)
+    applied = []
+    for migration in MIGRATIONS:
+        if version < migration.version <= target:
+            migration.upgrade()
+            with db.engine.begin() as conn:
+                _record(conn, migration)
+            applied.append(migration)
+    return applied
+
+
+@click.command("upgrade-db")
+@click.option("--to", "target", type=int, help="Version to upgrade to")
+@with_appcontext
+def upgrade_db_command(target):
+    """
+    Applies the pending schema migrations.
+    """
+    for migration in upgrade(target):
+        click.echo(f"Applied {migration.version}: {migration.description}")
+    click.echo(f"Schema version {current_version()}")
+
+
+@click.command("db-version")
+@with_appcontext
+def db_version_command():
+    """
+    Prints the schema version of the database.
+    """
+    version = current_version()
+    pending = [m for m in MIGRATIONS if m.version > (version or 0)]
+    click.echo(f"Schema version {version}, {len(pending)} pending migrations")
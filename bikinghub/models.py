@@ -12,12 +12,14 @@ The AuthenticationKey class represents an authentication key in the database.
 
 import hashlib
 import uuid
+from functools import lru_cache
 
 # from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
 from flask.cli import with_appcontext
 import click
 from bikinghub import db, bcrypt
+from bikinghub.migrations import upgrade
 from flask import request
 
 
@@ -78,8 +80,6 @@ class User(db.Model):
         """
         if not self.api_key:
             return None
-        print(self.api_key[0])
-        print(f"api_key: {self.api_key[0].key}")
         return str(self.api_key[0].key)
 
     def hash_password(self, pw):
@@ -89,6 +89,7 @@ class User(db.Model):
         return bcrypt.generate_password_hash(pw).decode("utf-8")
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def json_schema():
         """
         Returns the json schema for the User model.
@@ -123,7 +124,14 @@ class Favourite(db.Model):
     user_id = db.Column(
         db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
-    location_id = db.Column(db.Integer, db.ForeignKey("location.id"), nullable=False)
+    location_id = db.Column(
+        db.Integer, db.ForeignKey("location.id"), nullable=False, index=True
+    )
+
+    # Favourites are listed per user ordered by location
+    __table_args__ = (
+        db.Index("ix_favourite_user_id_location_id", user_id, location_id),
+    )
 
     user = db.relationship("User", back_populates="favourites")
     location = db.relationship("Location", back_populates="favourites")
@@ -151,6 +159,7 @@ class Favourite(db.Model):
         self.location_id = doc["location_id"]
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def json_schema():
         """
         Returns the json schema for the Favourite model.
@@ -186,10 +195,16 @@ class Comment(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
-        db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     location_id = db.Column(
-        db.Integer, db.ForeignKey("location.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("location.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     title = db.Column(db.Text, nullable=False)
     information = db.Column(db.Text, nullable=False)
@@ -224,6 +239,7 @@ class Comment(db.Model):
         self.time = doc["time"]
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def json_schema():
         """
         Returns the json schema for the Comment model.
@@ -258,6 +274,9 @@ class Location(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
 
+    # Nearby locations are searched with a bounding box
+    __table_args__ = (db.Index("ix_location_latitude_longitude", latitude, longitude),)
+
     favourites = db.relationship(
         "Favourite", back_populates="location", cascade="all, delete-orphan"
     )
@@ -293,6 +312,7 @@ class Location(db.Model):
         self.longitude = doc["longitude"]
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def json_schema():
         """
         Returns the json schema for the Location model.
@@ -345,6 +365,11 @@ class WeatherData(db.Model):
         db.Integer, db.ForeignKey("location.id", ondelete="CASCADE"), nullable=False
     )
 
+    # The forecast closest to the current time is searched per location
+    __table_args__ = (
+        db.Index("ix_weather_data_location_id_weather_time", location_id, weather_time),
+    )
+
     location = db.relationship("Location", back_populates="weatherData")
 
     def serialize(self):
@@ -362,7 +387,7 @@ class WeatherData(db.Model):
             "cloud_cover": self.cloud_cover,
             "weather_description": self.weather_description,
             "location_id": self.location_id,
-            "weather_time": str(self.weather_time),
+            "weather_time": self.weather_time,
         }
 
     def deserialize(self, doc):
@@ -382,6 +407,7 @@ class WeatherData(db.Model):
         self.weather_time = datetime.fromisoformat(doc["weather_time"])
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def json_schema():
         """
         Returns the json schema for the WeatherData model.
@@ -450,7 +476,10 @@ class TrafficData(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     location_id = db.Column(
-        db.Integer, db.ForeignKey("location.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("location.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
 
     location = db.relationship("Location", back_populates="trafficData")
@@ -489,7 +518,10 @@ class AuthenticationKey(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.Text, nullable=False, unique=True)
     user_id = db.Column(
-        db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     admin = db.Column(db.Boolean, nullable=False, default=False)
 
@@ -509,18 +541,42 @@ class AuthenticationKey(db.Model):
 @with_appcontext
 def init_db_command():
     """
-    Creates the database tables.
+    Creates the database tables and applies the pending schema migrations.
     """
-    db.create_all()
+    upgrade()
 
 
 # Populate the database with some dummy data
 @click.command("populate-db")
+@click.option(
+    "--scale",
+    type=int,
+    help="Generate N users and production-like volumes of data instead",
+)
+@click.option("--seed", default=0, show_default=True, help="Random seed for --scale")
+@click.option(
+    "--reuse-hash/--hash-each",
+    default=True,
+    show_default=True,
+    help="Give every synthetic user the same precomputed password hash",
+)
 @with_appcontext
-def populate_db_command():
+def populate_db_command(scale, seed, reuse_hash):
     """
     Populates the database with some dummy data.
     """
+    if scale:
+        from bikinghub.synthetic import generate, PASSWORD
+
+        counts = generate(scale, seed=seed, reuse_hash=reuse_hash)
+        for table, count in counts.items():
+            click.echo(f"{table}: {count}")
+        if reuse_hash:
+            click.echo(f"Synthetic users have the password {PASSWORD}")
+        else:
+            click.echo(f"Synthetic users have the password {PASSWORD}<user id>")
+        return
+
     # Create some users
     user1 = User(name="user1", password="password1")
     user2 = User(name="user2", password="password2")
@@ -0,0 +1,139 @@
+"""
+This module contains the opt-in request profiler.
+- init_profiling: Registers the request hooks that profile requests
+- profile_path: Directory of the stored profiles
+- profiles_command: The profiles CLI command
+
+A request is profiled with cProfile when PROFILE_REQUESTS is True, or when
+it has the Bikinghub-Profile header and an admin api key (checked with
+require_admin). The stats are dumped to instance/profiles/ and the name of
+the file is returned in the Bikinghub-Profile response header. Only the
+newest PROFILE_KEEP profiles are kept. The profiles are summarized with
+
+    flask --app bikinghub profiles --limit 5 --top 15
+
+or opened with any pstats compatible tool, e.g. snakeviz.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+from datetime import datetime
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from werkzeug.exceptions import Forbidden
+from bikinghub.utils import require_admin
+
+PROFILE_HEADER = "Bikinghub-Profile"
+PROFILER = "bikinghub.profiler"
+
+logger = logging.getLogger(__name__)
+
+
+def profile_path(app):
+    """
+    Returns the directory of the stored profiles
+    """
+    return app.config.get("PROFILE_DIR") or os.path.join(app.instance_path, "profiles")
+
+
+def _admin():
+    try:
+        return bool(require_admin(lambda: True)())
+    except Forbidden:
+        return False
+
+
+def _start_profile():
+    if not current_app.config["PROFILE_REQUESTS"]:
+        if PROFILE_HEADER not in request.headers or not _admin():
+            return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this thread
+        logger.warning(
+            "Profiler busy, %s %s not profiled", request.method, request.path
+        )
+        return
+    request.environ[PROFILER] = profiler
+
+
+def _finish_profile(response):
+    profiler = request.environ.get(PROFILER)
+    if profiler is None:
+        return response
+
+    # dump_stats disables the profiler, _stop_profile pops it
+    directory = profile_path(current_app)
+    os.makedirs(directory, exist_ok=True)
+    endpoint = (request.endpoint or "unmatched").replace(".", "_")
+    name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.method}-{endpoint}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+    _prune(directory, current_app.config["PROFILE_KEEP"])
+
+    response.headers[PROFILE_HEADER] = name
+    logger.info("Profiled %s %s to %s", request.method, request.path, name)
+    return response
+
+
+def _stop_profile(_exception):
+    # after_request hooks are skipped when an exception propagates, the
+    # profiler must not stay enabled in the thread of the next request
+    profiler = request.environ.pop(PROFILER, None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def _profiles(directory):
+    # The names start with a timestamp, so they sort oldest first
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith(".prof"))
+
+
+def _prune(directory, keep):
+    names = _profiles(directory)
+    for name in names[: max(0, len(names) - keep)]:
+        os.remove(os.path.join(directory, name))
+
+
+def init_profiling(app):
+    """
+    Registers the profiling hooks on the app
+    """
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_stop_profile)
+
+
+@click.command("profiles")
+@click.option("--limit", default=5, show_default=True, help="Newest profiles to show")
+@click.option(
+    "--top",
+    default=15,
+    show_default=True,
+    help="Functions by cumulative time per profile, 0 lists the profiles only",
+)
+@with_appcontext
+def profiles_command(limit, top):
+    """
+    Lists the newest request profiles and their slowest functions.
+    """
+    directory = profile_path(current_app)
+    names = _profiles(directory)[-limit:]
+    if not names:
+        click.echo(f"No profiles in {directory}")
+        return
+
+    for name in reversed(names):
+        stream = io.StringIO()
+        stats = pstats.Stats(os.path.join(directory, name), stream=stream)
+        click.echo(f"{name}  {stats.total_tt * 1000:.1f} ms  {stats.total_calls} calls")
+        if top:
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+            click.echo(stream.getvalue())
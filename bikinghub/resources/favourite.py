@@ -1,19 +1,41 @@
-import json
+import logging
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import ValidationError, validate
+from jsonschema import ValidationError
 from werkzeug.exceptions import UnsupportedMediaType
-from bikinghub.models import Favourite
+from sqlalchemy import select
+from bikinghub.models import Favourite, Location
 from bikinghub.constants import (
     PAGE_SIZE,
     CACHE_TIME,
     LINK_RELATIONS_URL,
     FAVOURITE_PROFILE,
-    MASON_CONTENT,
     NAMESPACE,
 )
 from bikinghub import db, cache
-from ..utils import create_error_response, require_authentication, page_key, BodyBuilder
+from ..compression import page_cache_keys
+from ..log import sampled
+from ..encoding import json_response
+from ..utils import (
+    create_error_response,
+    require_authentication,
+    page_key,
+    get_validator,
+    validate_batch,
+    batch_error,
+    batch_response,
+    BodyBuilder,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Inspiration from course material
+def _clear_cache(user):
+    request_path = url_for("api.favouritecollection", user=user)
+    for page in range(0, PAGE_SIZE):
+        cache_key = request_path + f"[user_{user}_page_{page}]"
+        cache.delete_many(*page_cache_keys(cache_key))
 
 
 class FavouriteCollection(Resource):
@@ -21,24 +43,18 @@ class FavouriteCollection(Resource):
     Resource for handling a collection of user's favourite locations
     """
 
-    # Inspiration from course material
-    def _clear_cache(self, user):
-        request_path = url_for("api.favouritecollection", user=user)
-        for page in range(0, PAGE_SIZE):
-            cache_key = request_path + f"[user_{user}_page_{page}]"
-            cache.delete(cache_key)
-
     # Lists all the user's favourites
     # Cache from course material
     @cache.cached(
-        timeout=CACHE_TIME, make_cache_key=page_key, response_filter=lambda r: True
+        timeout=CACHE_TIME,
+        make_cache_key=page_key,
+        response_filter=lambda r: True,
+        response_hit_indication=True,
     )
     def get(self, user):
         """
         List all favourite locations for user
         """
-        print("Cache miss favourite")
-
         page = int(request.args.get("page", 0))  # Get the page number
 
         remaining = (
@@ -48,29 +64,29 @@ class FavouriteCollection(Resource):
         body = BodyBuilder()
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)  # Add namespace
         body.add_control(
-            "self", url_for("api.favouritecollection", user=user)
+            "self", BodyBuilder.href("api.favouritecollection", user=user.name)
         )  # Add self control
         body.add_control_favourite_add(user)  # Add control to add a favourite
-        body.add_control("user", url_for("api.useritem", user=user))
+        body.add_control_favourite_batch(user)  # Add control to add many favourites
+        body.add_control("user", BodyBuilder.href("api.useritem", user=user.name))
         body["items"] = []
         for fav in remaining.limit(PAGE_SIZE):
-            print(f"Favourite: {fav}")
+            sampled(logger, "Favourite %s of user %s", fav.id, user.id)
             item = BodyBuilder(
                 title=fav.title, id=fav.id, location_id=fav.location_id
             )  # Create a new item
             item.add_control(
-                "self", url_for("api.favouriteitem", user=user, favourite=fav)
+                "self",
+                BodyBuilder.href("api.favouriteitem", user=user.name, favourite=fav.id),
             )
             item.add_control("profile", FAVOURITE_PROFILE)  # Add profile control
             body["items"].append(item)
 
-        response = Response(
-            json.dumps(body), 200, mimetype=MASON_CONTENT
-        )  # Create response
+        response = json_response(body, 200)  # Create response
 
         # Cache the response if it's a full page
         if len(body["items"]) == PAGE_SIZE:
-            cache.set(page_key(), response, timeout=None)
+            cache.set(page_key(user=user), response, timeout=None)
 
         return response
 
@@ -79,7 +95,7 @@ class FavouriteCollection(Resource):
         Create a new favourite location for user
         """
         try:
-            validate(request.json, Favourite.json_schema())
+            get_validator(Favourite).validate(request.json)
         except ValidationError as e:
             return create_error_response(400, str(e))
         # Not needed if request.json raises 415 error correctly
@@ -92,7 +108,7 @@ class FavouriteCollection(Resource):
         db.session.add(favourite)
         db.session.commit()
 
-        self._clear_cache(user)  # Clear the cache
+        _clear_cache(user)  # Clear the cache
 
         return Response(
             status=201,
@@ -102,23 +118,68 @@ class FavouriteCollection(Resource):
         )
 
 
+class FavouriteBatch(Resource):
+    """
+    Resource for adding many favourite locations of a user in one request
+    """
+
+    def post(self, user):
+        """
+        Create favourite locations for user from an array of favourites. The
+        valid items are created in one transaction, the result of each item
+        is returned in the order of the request.
+        """
+        docs = request.json
+        results = validate_batch(Favourite, docs)
+        if not isinstance(results, list):
+            return results
+
+        # Check that the locations exist with one query
+        location_ids = {doc["location_id"] for doc, r in zip(docs, results) if not r}
+        existing = set(
+            db.session.scalars(select(Location.id).where(Location.id.in_(location_ids)))
+        )
+
+        created = []
+        for index, doc in enumerate(docs):
+            if results[index] is not None:
+                continue
+            if doc["location_id"] not in existing:
+                results[index] = batch_error(404, "Location not found")
+                continue
+            favourite = Favourite()
+            favourite.deserialize(doc)
+            favourite.user = user
+            db.session.add(favourite)
+            created.append((index, favourite))
+
+        if created:
+            db.session.flush()  # Assigns the ids without a query per item
+            for index, favourite in created:
+                item = BodyBuilder(status=201, id=favourite.id)
+                item.add_control(
+                    "self",
+                    BodyBuilder.href(
+                        "api.favouriteitem", user=user.name, favourite=favourite.id
+                    ),
+                )
+                results[index] = item
+            db.session.commit()
+            _clear_cache(user)  # Clear the cache once for the batch
+
+        return batch_response(results)
+
+
 class FavouriteItem(Resource):
     """
     Resource for handling a single user's favourite location
     """
 
-    # Inspiration from course material
-    def _clear_cache(self, user):
-        request_path = url_for("api.favouritecollection", user=user)
-        for page in range(0, PAGE_SIZE):
-            cache_key = request_path + f"[user_{user}_page_{page}]"
-            cache.delete(cache_key)
-
     def get(self, user, favourite):
         """
         Get user's favourite location
         """
-        if favourite.id not in [fav.id for fav in user.favourites]:
+        if favourite.user_id != user.id:
             return create_error_response(404, "Favourite not found")
         body = BodyBuilder()
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)  # Add namespace
@@ -145,17 +206,17 @@ class FavouriteItem(Resource):
         )  # Add control to get all favourites
 
         body["item"] = favourite.serialize()
-        return Response(json.dumps(body), status=200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     def put(self, user, favourite):
         """
         Update a user's favourite location by overwriting the entire resource
         """
-        if favourite.id not in [fav.id for fav in user.favourites]:
+        if favourite.user_id != user.id:
             return create_error_response(404, "Favourite not found")
 
         try:
-            validate(request.json, Favourite.json_schema())
+            get_validator(Favourite).validate(request.json)
         except ValidationError as e:
             return create_error_response(400, str(e))
         except UnsupportedMediaType as e:
@@ -165,7 +226,7 @@ class FavouriteItem(Resource):
         favourite.deserialize(request.json)
         db.session.commit()
 
-        self._clear_cache(user)  # Clear the cache
+        _clear_cache(user)  # Clear the cache
 
         return Response(status=204)
 
@@ -174,11 +235,11 @@ class FavouriteItem(Resource):
         """
         Delete a user's favourite location
         """
-        if favourite.id not in [fav.id for fav in user.favourites]:
+        if favourite.user_id != user.id:
             return create_error_response(404, "Favourite not found")
         db.session.delete(favourite)
         db.session.commit()
 
-        self._clear_cache(user)  # Clear the cache
+        _clear_cache(user)  # Clear the cache
 
         return Response(status=204)
@@ -1,25 +1,42 @@
-import json
+import logging
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import ValidationError, validate
+from jsonschema import ValidationError
 from werkzeug.exceptions import UnsupportedMediaType
 from bikinghub import db, cache
 from bikinghub.models import Location
 from bikinghub.constants import (
     LINK_RELATIONS_URL,
     LOCATION_PROFILE,
-    MASON_CONTENT,
+    JSON_CONTENT,
     NAMESPACE,
     PAGE_SIZE,
     CACHE_TIME,
 )
+from ..compression import page_cache_keys
+from ..encoding import json_response
 from ..utils import (
     create_error_response,
-    find_within_distance,
+    find_nearby_locations,
     require_admin,
     page_key_location,
+    get_validator,
+    validate_batch,
+    batch_error,
+    batch_response,
     BodyBuilder,
 )
+from ..importer import GridIndex
+
+logger = logging.getLogger(__name__)
+
+
+# Inspiration from course material
+def _clear_cache():
+    request_path = url_for("api.locationcollection")
+    for page in range(0, PAGE_SIZE):
+        cache_key = request_path + f"[page_{page}]"
+        cache.delete_many(*page_cache_keys(cache_key))
 
 
 class LocationCollection(Resource):
@@ -27,30 +44,25 @@ class LocationCollection(Resource):
     Collection of all locations
     """
 
-    # Inspiration from course material
-    def _clear_cache(self):
-        request_path = url_for("api.locationcollection")
-        for page in range(0, PAGE_SIZE):
-            cache_key = request_path + f"[page_{page}]"
-            cache.delete(cache_key)
-
     # Lists all the user's favourites
     # Cache from course material
     @cache.cached(
         timeout=CACHE_TIME,
         make_cache_key=page_key_location,
         response_filter=lambda r: True,
+        response_hit_indication=True,
     )
     def get(self):
         """
         List all locations
         """
-        print("Cache miss location")
-
         body = BodyBuilder()
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)  # Add namespace
-        body.add_control("self", url_for("api.locationcollection"))  # Add self control
+        body.add_control(
+            "self", BodyBuilder.href("api.locationcollection")
+        )  # Add self control
         body.add_control_add_location()  # Add control to add a location
+        body.add_control_location_batch()  # Add control to add many locations
         body["items"] = []
         body.add_control_users_all()  # Add control to get all users
 
@@ -64,24 +76,22 @@ class LocationCollection(Resource):
             )
 
             item.add_control(
-                "self", url_for("api.locationitem", location=location)
+                "self", BodyBuilder.href("api.locationitem", location=location.id)
             )  # Add self control
             item.add_control("profile", LOCATION_PROFILE)  # Add profile control
             item.add_control_read_weather(location)  # Add control to read weather
             body["items"].append(item)
 
-        return Response(json.dumps(body), status=200, mimetype="application/json")
+        return json_response(body, 200, mimetype=JSON_CONTENT)
 
     def post(self):
         """
         Create a new location
         """
-        print("LocationCollection.post()")
-        print(f"request.json: {request.json}")
         try:
-            validate(request.json, Location.json_schema())
+            get_validator(Location).validate(request.json)
         except ValidationError as e:
-            print(f"LocationCollection.post() ValidationError: {e}")
+            logger.debug("Invalid location: %s", e.message)
             return create_error_response(400, str(e))
         # Not needed if request.json raises 415 error correctly
         # except UnsupportedMediaType as e:
@@ -91,8 +101,7 @@ class LocationCollection(Resource):
         lon = request.json.get("longitude")  # Get longitude from request
 
         # query for locations within 0.05km of lat, lon
-        all_locations = Location.query.all()
-        if find_within_distance(lat, lon, 0.05, all_locations):
+        if find_nearby_locations(lat, lon, 0.05):
             return Response("Location already exists", status=409)
 
         location = Location()
@@ -100,7 +109,7 @@ class LocationCollection(Resource):
         db.session.add(location)
         db.session.commit()
 
-        self._clear_cache()  # Clear the cache
+        _clear_cache()  # Clear the cache
 
         return Response(
             status=201,
@@ -108,18 +117,57 @@ class LocationCollection(Resource):
         )
 
 
+class LocationBatch(Resource):
+    """
+    Adds many locations in one request
+    """
+
+    def post(self):
+        """
+        Create locations from an array of locations. The valid items that are
+        not within 0.05km of an existing location or of an earlier item are
+        created in one transaction, the result of each item is returned in
+        the order of the request.
+        """
+        docs = request.json
+        results = validate_batch(Location, docs)
+        if not isinstance(results, list):
+            return results
+
+        batch_index = GridIndex(0.05)
+        created = []
+        for index, doc in enumerate(docs):
+            if results[index] is not None:
+                continue
+            lat, lon = doc["latitude"], doc["longitude"]
+            if batch_index.near(lat, lon) or find_nearby_locations(lat, lon, 0.05):
+                results[index] = batch_error(409, "Location already exists")
+                continue
+            batch_index.add(lat, lon)
+            location = Location()
+            location.deserialize(doc)
+            db.session.add(location)
+            created.append((index, location))
+
+        if created:
+            db.session.flush()  # Assigns the ids without a query per item
+            for index, location in created:
+                item = BodyBuilder(status=201, id=location.id)
+                item.add_control(
+                    "self", BodyBuilder.href("api.locationitem", location=location.id)
+                )
+                results[index] = item
+            db.session.commit()
+            _clear_cache()  # Clear the cache once for the batch
+
+        return batch_response(results)
+
+
 class LocationItem(Resource):
     """
     Represents a single location
     """
 
-    # Inspiration from course material
-    def _clear_cache(self):
-        request_path = url_for("api.locationcollection")
-        for page in range(0, PAGE_SIZE):
-            cache_key = request_path + f"[page_{page}]"
-            cache.delete(cache_key)
-
     def get(self, location):
         """
         GET method for the location item
@@ -142,14 +190,14 @@ class LocationItem(Resource):
         body.add_control_read_weather(location)
 
         body["item"] = location.serialize()
-        return Response(json.dumps(body), 200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     def put(self, location):
         """
         Update a location by overwriting the entire resource
         """
         try:
-            validate(request.json, Location.json_schema())
+            get_validator(Location).validate(request.json)
         except ValidationError as e:
             return create_error_response(400, str(e))
         except UnsupportedMediaType as e:
@@ -158,7 +206,7 @@ class LocationItem(Resource):
         location.deserialize(request.json)
         db.session.commit()
 
-        self._clear_cache()  # Clear the cache
+        _clear_cache()  # Clear the cache
 
         return Response(status=204)
 
@@ -167,10 +215,10 @@ class LocationItem(Resource):
         """
         Delete a location, requires admin authentication
         """
-        print(f"LocationItem.delete() location: {location}")
+        logger.info("Deleting location %s", location.id)
         db.session.delete(location)
         db.session.commit()
 
-        self._clear_cache()  # Clear the cache
+        _clear_cache()  # Clear the cache
 
         return Response(status=204)
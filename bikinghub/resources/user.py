@@ -1,23 +1,26 @@
-import json
+import logging
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import ValidationError, validate
+from jsonschema import ValidationError
 from werkzeug.exceptions import UnsupportedMediaType
 from bikinghub import db
 from bikinghub.models import User
 from bikinghub.constants import (
     LINK_RELATIONS_URL,
     USER_PROFILE,
-    MASON_CONTENT,
     NAMESPACE,
 )
+from ..encoding import json_response
 from ..utils import (
     require_admin,
     require_authentication,
     BodyBuilder,
     create_error_response,
+    get_validator,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class UserCollection(Resource):
     """
@@ -33,27 +36,28 @@ class UserCollection(Resource):
         """
         body = BodyBuilder()
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)  # Add namespace
-        body.add_control("self", url_for("api.usercollection"))  # Add self control
+        body.add_control(
+            "self", BodyBuilder.href("api.usercollection")
+        )  # Add self control
         body.add_control_user_add()  # Add control to add a user
         body["items"] = []
         for user in User.query.all():
             item = BodyBuilder()
             item.add_control(
-                "self", url_for("api.useritem", user=user)
+                "self", BodyBuilder.href("api.useritem", user=user.name)
             )  # Add self control
             item.add_control("profile", USER_PROFILE)  # Add profile control
             body["items"].append(item)
-        return Response(json.dumps(body), 200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     def post(self):
         """
         POST method for the user collection. Adds a new user.
         """
-        print(f"Request: {request.json}")
-        print(f"Request Headers: {request.headers}")
         try:
-            validate(request.json, User.json_schema())
+            get_validator(User).validate(request.json)
         except ValidationError as e:
+            logger.debug("Invalid user: %s", e.message)
             return create_error_response(400, "Invalid input", str(e))
         # Not needed if request.json raises 415 error correctly
         # except UnsupportedMediaType as e:
@@ -68,6 +72,7 @@ class UserCollection(Resource):
 
         db.session.add(user)
         db.session.commit()
+        logger.info("Created user %s", user.id)
 
         return Response(
             status=201,
@@ -93,7 +98,7 @@ class UserItem(Resource):
         body.add_control_locations_all()  # Add control to get all locations
 
         body["item"] = user.serialize()
-        return Response(json.dumps(body), 200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     @require_authentication
     def put(self, user):
@@ -101,7 +106,7 @@ class UserItem(Resource):
         PUT method for the user item. Updates the resource. Requires api authentication.
         """
         try:
-            validate(request.json, User.json_schema())
+            get_validator(User).validate(request.json)
         except ValidationError as e:
             return create_error_response(400, "Invalid input", str(e))
         # Not needed if request.json raises 415 error correctly
@@ -1,15 +1,15 @@
-import json
 from datetime import datetime
-from flask import Response, url_for
+from flask import url_for
 from flask_restful import Resource
 from sqlalchemy import func
-from bikinghub.models import WeatherData, Location
+from bikinghub.models import WeatherData
 from bikinghub.constants import (
     LINK_RELATIONS_URL,
     WEATHER_PROFILE,
-    MASON_CONTENT,
     NAMESPACE,
 )
+from ..encoding import json_response
+from ..instrumentation import UpstreamError
 from ..utils import create_weather_data, BodyBuilder, create_error_response
 
 
@@ -39,20 +39,16 @@ class WeatherCollection(Resource):
                 cloud_cover=weather.cloud_cover,
                 weather_description=weather.weather_description,
                 location_id=weather.location_id,
-                weather_time=(
-                    weather.weather_time.isoformat()
-                    if isinstance(weather.weather_time, datetime)
-                    else weather.weather_time
-                ),
+                weather_time=weather.weather_time,
             )
-            location = Location.query.filter_by(id=weather.location_id).first()
             item.add_control(
-                "self", url_for("api.locationitem", location=location) + "weather/"
+                "self",
+                BodyBuilder.href("api.weatheritem", location=weather.location_id),
             )  # Add self control
             item.add_control("profile", WEATHER_PROFILE)  # Add profile control
             body["items"].append(item)
 
-        return Response(json.dumps(body), status=200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     # def post(self, location):
     #    """
@@ -96,7 +92,10 @@ class WeatherItem(Resource):
             .first()
         )
         if not weather_obj or weather_obj.weather_time < datetime.now():
-            weather_obj = create_weather_data(location)
+            try:
+                weather_obj = create_weather_data(location)
+            except UpstreamError as e:
+                return create_error_response(502, "Weather service unavailable", str(e))
 
         body = BodyBuilder()
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)  # Add namespace
@@ -112,7 +111,7 @@ class WeatherItem(Resource):
         )  # Add location control
         body["items"] = weather_obj.serialize()
 
-        return Response(json.dumps(body), status=200, mimetype=MASON_CONTENT)
+        return json_response(body, 200)
 
     # def put(self, location, weather):
     #    """
@@ -0,0 +1,47 @@
+"""
+This module contains the session class of the app that routes reads to a
+read-only engine.
+
+When SQLALCHEMY_READ_URI is configured, init_database creates a read
+engine for it. SELECTs made while handling GET and HEAD requests then go to
+that engine. Everything else uses the primary engine: writes, other HTTP
+methods, and work outside a request such as the CLI commands. Once the
+session has flushed changes it stays on the primary for the rest of its
+lifetime, so a request that writes and then reads sees its own writes.
+"""
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+READ_ENGINE = "bikinghub_read_engine"
+READ_METHODS = ("GET", "HEAD")
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the reads of GET requests to the replica engine
+    """
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            return current_app.extensions[READ_ENGINE]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self._wrote = True
+        super().flush(objects)
+
+    def _use_replica(self, clause):
+        return (
+            not self._wrote
+            and not self._flushing
+            and getattr(clause, "is_select", False)
+            and has_request_context()
+            and READ_ENGINE in current_app.extensions
+            and request.method in READ_METHODS
+        )
@@ -0,0 +1,191 @@
+"""
+This module generates synthetic data at production scale for performance work.
+- REGIONS: Bounding boxes of Finnish cities and their share of the locations
+- generate: Inserts users, api keys, locations, favourites and weather data
+
+Everything is drawn from a random.Random seeded with the given seed, so the
+same scale and seed produce the same rows (the weather times are relative to
+the current hour). Rows are inserted with bulk INSERTs with explicit ids
+following the existing rows, so no object is loaded back from the database.
+"""
+
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from bikinghub import db, bcrypt
+from bikinghub.models import User, AuthenticationKey, Location, Favourite, WeatherData
+
+# (name, south, west, north, east, weight)
+REGIONS = [
+    ("helsinki", 60.13, 24.78, 60.30, 25.25, 30),
+    ("tampere", 61.43, 23.62, 61.54, 23.95, 12),
+    ("turku", 60.39, 22.16, 60.50, 22.37, 10),
+    ("oulu", 64.95, 25.35, 65.10, 25.60, 10),
+    ("jyvaskyla", 62.20, 25.66, 62.28, 25.83, 6),
+    ("kuopio", 62.85, 27.58, 62.93, 27.74, 5),
+    ("rovaniemi", 66.46, 25.64, 66.53, 25.82, 3),
+    ("finland", 59.80, 20.60, 69.90, 31.50, 24),
+]
+
+DESCRIPTIONS = ["Clear", "Partly cloudy", "Cloudy", "Light rain", "Rain", "Snow"]
+CLOUD_COVERS = ["clear", "few", "scattered", "broken", "overcast"]
+
+PASSWORD = "password"
+BATCH_SIZE = 5000
+
+
+def _bulk_insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start : start + BATCH_SIZE])
+
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def _users(rng, count, reuse_hash):
+    first = _next_id(User)
+    if reuse_hash:
+        shared_hash = bcrypt.generate_password_hash(PASSWORD).decode("utf-8")
+    users, keys = [], []
+    for user_id in range(first, first + count):
+        if reuse_hash:
+            password = shared_hash
+        else:
+            password = bcrypt.generate_password_hash(f"{PASSWORD}{user_id}")
+            password = password.decode("utf-8")
+        users.append({"id": user_id, "name": f"user{user_id}", "password": password})
+        keys.append(
+            {
+                "key": f"{rng.getrandbits(256):064x}",
+                "user_id": user_id,
+                "admin": user_id == first,
+            }
+        )
+    _bulk_insert(User, users)
+    _bulk_insert(AuthenticationKey, keys)
+    return [user["id"] for user in users]
+
+
+def _locations(rng, count):
+    first = _next_id(Location)
+    weights = [region[-1] for region in REGIONS]
+    rows = []
+    for location_id in range(first, first + count):
+        name, south, west, north, east, _ = rng.choices(REGIONS, weights)[0]
+        rows.append(
+            {
+                "id": location_id,
+                "uuid": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "name": f"{name}-{location_id}",
+                "latitude": rng.uniform(south, north),
+                "longitude": rng.uniform(west, east),
+            }
+        )
+    _bulk_insert(Location, rows)
+    return rows
+
+
+def _favourites(rng, user_ids, location_ids, per_user):
+    # Popular locations are the favourites of many users, the weight of the
+    # location at rank r is 1 / r ** 1.1 (Zipf-like)
+    popularity = location_ids[:]
+    rng.shuffle(popularity)
+    cum_weights = []
+    total = 0
+    for rank in range(1, len(popularity) + 1):
+        total += 1 / rank**1.1
+        cum_weights.append(total)
+
+    rows = []
+    for user_id in user_ids:
+        # Most users have a few favourites, some have many
+        count = min(int(rng.expovariate(1 / per_user)), len(popularity))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.add(rng.choices(popularity, cum_weights=cum_weights)[0])
+        for location_id in sorted(chosen):
+            rows.append(
+                {
+                    "title": f"favourite{location_id}",
+                    "description": "Synthetic favourite",
+                    "user_id": user_id,
+                    "location_id": location_id,
+                }
+            )
+    _bulk_insert(Favourite, rows)
+    return len(rows)
+
+
+def _weather(rng, locations, hours):
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    rows = []
+    for location in locations:
+        # Colder in the north, warmest in the afternoon
+        base = 12 - (location["latitude"] - 60) * 1.2
+        for hour in range(hours):
+            time = start + timedelta(hours=hour)
+            temperature = (
+                base
+                + 5 * math.sin((time.hour - 9) / 24 * 2 * math.pi)
+                + rng.gauss(0, 1.5)
+            )
+            wind_speed = abs(rng.gauss(4, 2))
+            rain = max(0.0, rng.gauss(-0.5, 1))
+            rows.append(
+                {
+                    "rain": round(rain, 1),
+                    "humidity": rng.randint(40, 100),
+                    "wind_speed": round(wind_speed, 1),
+                    "wind_direction": rng.randrange(0, 360, 10),
+                    "temperature": round(temperature, 1),
+                    "temperature_feel": round(temperature - wind_speed / 2),
+                    "cloud_cover": rng.choice(CLOUD_COVERS),
+                    "weather_description": rng.choice(DESCRIPTIONS),
+                    "weather_time": time,
+                    "location_id": location["id"],
+                }
+            )
+        if len(rows) >= BATCH_SIZE:
+            _bulk_insert(WeatherData, rows)
+            rows = []
+    _bulk_insert(WeatherData, rows)
+    return len(locations) * hours
+
+
+def generate(
+    scale,
+    seed=0,
+    reuse_hash=True,
+    locations=None,
+    favourites_per_user=5,
+    weather_hours=7 * 24,
+):
+    """
+    Inserts scale users with an api key each, locations spread over the
+    Finnish cities in REGIONS (scale // 10 by default), favourites with a
+    skewed distribution over the locations and weather_hours of hourly
+    weather per location. With reuse_hash every user gets the same bcrypt
+    hash of PASSWORD instead of hashing a password per user, which takes
+    most of the time otherwise. Returns the number of inserted rows of each
+    table.
+    """
+    rng = random.Random(seed)
+    locations = max(1, scale // 10) if locations is None else locations
+
+    user_ids = _users(rng, scale, reuse_hash)
+    location_rows = _locations(rng, locations)
+    location_ids = [location["id"] for location in location_rows]
+    favourites = _favourites(rng, user_ids, location_ids, favourites_per_user)
+    weather = _weather(rng, location_rows, weather_hours)
+    db.session.commit()
+
+    return {
+        "users": len(user_ids),
+        "authentication_keys": len(user_ids),
+        "locations": len(location_ids),
+        "favourites": favourites,
+        "weather_data": weather,
+    }
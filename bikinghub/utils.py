@@ -4,30 +4,40 @@ This module contains utility functions for the Bikinghub API
 - require_authentication: Decorator to check if the request is made by an authenticated user
 - haversine: Calculate the great circle distance in kilometers between two points
 - find_within_distance: Find all the objects within a certain distance from a point
+- find_nearby_locations: Find the locations within a certain distance from a point
 - create_weather_data: Create weather data for a location
+- url_template: URL pattern of an endpoint, resolved once per app
+- get_validator: Compiled json schema validator of a model
+- validate_batch: Validates the items of a batch request
+- batch_response: Mason response with the results of a batch request
 """
 
+import logging
 import os
-import json
 import secrets
 import math
 from functools import wraps
 from dataclasses import dataclass
 from datetime import datetime
 from dotenv import load_dotenv, find_dotenv
-import requests
+from jsonschema import ValidationError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 from werkzeug.exceptions import Forbidden
-from flask import request, url_for, Response
+from flask import request, url_for, current_app, g
 from bikinghub import db
+from bikinghub.encoding import json_response
+from bikinghub.instrumentation import upstream_get, UpstreamError
 from bikinghub.models import AuthenticationKey, WeatherData, User, Location, Favourite
 from bikinghub.constants import (
-    MML_URL,
-    FMI_FORECAST_URL,
     NAMESPACE,
     ERROR_PROFILE,
-    MASON_CONTENT,
+    LINK_RELATIONS_URL,
+    BATCH_SIZE,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def create_error_response(status_code, title, message=None):
     """
@@ -41,7 +51,103 @@ def create_error_response(status_code, title, message=None):
     body = MasonBuilder(resource_url=resource_url)
     body.add_error(title, message)
     body.add_control("profile", href=ERROR_PROFILE)
-    return Response(json.dumps(body), status_code, mimetype=MASON_CONTENT)
+    return json_response(body, status_code)
+
+
+class SchemaValidator:
+    """
+    Compiled validator of a json schema. The draft is picked from the schema
+    like jsonschema.validate does.
+    """
+
+    def __init__(self, schema):
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        self._validator = cls(schema)
+
+    def validate(self, instance):
+        """
+        Raises the jsonschema.ValidationError that best describes why the
+        instance is invalid, the same error jsonschema.validate raises.
+        The compiled validator's own validate raises the first error it finds.
+        """
+        error = best_match(self._validator.iter_errors(instance))
+        if error is not None:
+            raise error
+
+
+_validators = {}
+
+
+def get_validator(model):
+    """
+    Returns a validator for the model's json schema. The schema is checked and
+    the validator compiled on the first call only, later calls for the same
+    model return the same validator.
+
+    The validator's validate method raises jsonschema.ValidationError just
+    like jsonschema.validate does.
+    """
+    validator = _validators.get(model)
+    if validator is None:
+        validator = _validators[model] = SchemaValidator(model.json_schema())
+    return validator
+
+
+def batch_schema(model):
+    """
+    Returns the json schema of a batch request, an array of the model's
+    objects
+    """
+    return {"type": "array", "maxItems": BATCH_SIZE, "items": model.json_schema()}
+
+
+def batch_error(status_code, title, message=None):
+    """
+    Returns the Mason result of a failed item of a batch request
+    """
+    item = MasonBuilder(status=status_code)
+    item.add_error(title, message)
+    return item
+
+
+def validate_batch(model, docs):
+    """
+    Validates each item of a batch request with the model's compiled
+    validator. Returns a list with None for the valid items and an error
+    result for the invalid ones, or an error response if the request is not
+    an array of at most BATCH_SIZE items.
+    """
+    if not isinstance(docs, list):
+        return create_error_response(400, "Invalid input", "Expected an array")
+    if len(docs) > BATCH_SIZE:
+        return create_error_response(
+            400, "Invalid input", f"At most {BATCH_SIZE} items in a batch"
+        )
+
+    validator = get_validator(model)
+    results = []
+    for doc in docs:
+        try:
+            validator.validate(doc)
+        except ValidationError as e:
+            results.append(batch_error(400, "Invalid input", e.message))
+        else:
+            results.append(None)
+    return results
+
+
+def batch_response(results):
+    """
+    Returns the results of a batch request in the order of the request's
+    items. The status is 201 if every item was created, otherwise 207 and
+    the status of each item tells which ones failed.
+    """
+    body = BodyBuilder()
+    body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
+    body["items"] = results
+    created = all(result["status"] == 201 for result in results)
+    return json_response(body, 201 if created else 207)
 
 
 class MasonBuilder(dict):
@@ -111,16 +217,74 @@ class MasonBuilder(dict):
         self["@controls"][ctrl_name]["href"] = href
 
 
+class _UrlPlaceholder:
+    """
+    Stands in for a model instance while an URL template is resolved. The URL
+    converters only read the id or the name of the object, so both return the
+    same marker which is then turned into a format field.
+    """
+
+    def __init__(self, arg):
+        self.id = self.name = f"__{arg}__"
+
+
+def url_template(endpoint):
+    """
+    Returns the URL of an endpoint as a format string, for example
+    "/api/users/{user}/favourites/{favourite}/". The pattern is resolved with
+    url_for only once per app, after that building an URL is a str.format call.
+    """
+    templates = current_app.extensions.setdefault("bikinghub_url_templates", {})
+    template = templates.get(endpoint)
+    if template is None:
+        rule = next(current_app.url_map.iter_rules(endpoint))
+        placeholders = {arg: _UrlPlaceholder(arg) for arg in rule.arguments}
+        template = url_for(endpoint, **placeholders)
+        template = template.replace("{", "{{").replace("}", "}}")
+        for arg, placeholder in placeholders.items():
+            template = template.replace(placeholder.id, "{" + arg + "}")
+        templates[endpoint] = template
+    return template
+
+
 class BodyBuilder(MasonBuilder):
 
+    @staticmethod
+    def href(endpoint, **values):
+        """
+        Builds the URL of an endpoint from its cached template. The values are
+        what the URL converters would produce, i.e. the user's name or the id
+        of a location or a favourite.
+        """
+        return url_template(endpoint).format(**values)
+
+    def add_static_control(self, ctrl_name, endpoint, model=None, **kwargs):
+        """
+        Adds a control that is the same for every request. The control is
+        built once per app and shared between responses, so it must not be
+        modified after it has been added. If a model is given its json schema
+        is included in the control.
+        """
+        controls = current_app.extensions.setdefault("bikinghub_static_controls", {})
+        ctrl = controls.get(ctrl_name)
+        if ctrl is None:
+            if model is not None:
+                kwargs["encoding"] = "json"
+                kwargs["schema"] = model.json_schema()
+            ctrl = controls[ctrl_name] = dict(kwargs, href=url_template(endpoint))
+
+        if "@controls" not in self:
+            self["@controls"] = {}
+        self["@controls"][ctrl_name] = ctrl
+
     # region User
     def add_control_users_all(self):
         """
         Adds a control to the object for getting all users
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:users-all",
-            href=url_for("api.usercollection"),
+            "api.usercollection",
             method="GET",
             title="Get all users",
         )
@@ -129,13 +293,12 @@ class BodyBuilder(MasonBuilder):
         """
         Adds a control to the object for adding a new user
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:user-add",
-            href=url_for("api.usercollection"),
+            "api.usercollection",
+            model=User,
             method="POST",
             title="Add a new user",
-            encoding="json",
-            schema=User.json_schema(),
         )
 
     def add_control_user_delete(self, user):
@@ -144,7 +307,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:user-delete",
-            href=url_for("api.useritem", user=user),
+            href=self.href("api.useritem", user=user.name),
             method="DELETE",
             title="Delete a user",
         )
@@ -155,7 +318,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:user-edit",
-            href=url_for("api.useritem", user=user),
+            href=self.href("api.useritem", user=user.name),
             method="PUT",
             title="Edit a user",
             encoding="json",
@@ -166,13 +329,12 @@ class BodyBuilder(MasonBuilder):
         """
         Adds a control to the object for logging in a user
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:user-login",
-            href=url_for("api.login"),
+            "api.login",
+            model=User,
             method="POST",
             title="Login a user",
-            encoding="json",
-            schema=User.json_schema(),
         )
 
     # endregion
@@ -182,9 +344,9 @@ class BodyBuilder(MasonBuilder):
         """
         Adds a control to the object for getting all locations
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:locations-all",
-            href=url_for("api.locationcollection"),
+            "api.locationcollection",
             method="GET",
             title="Get all locations",
         )
@@ -193,13 +355,25 @@ class BodyBuilder(MasonBuilder):
         """
         Adds a control to the object for adding a new location
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:location-add",
-            href=url_for("api.locationcollection"),
+            "api.locationcollection",
+            model=Location,
             method="POST",
             title="Add a new location",
+        )
+
+    def add_control_location_batch(self):
+        """
+        Adds a control to the object for adding many locations at once
+        """
+        self.add_static_control(
+            f"{NAMESPACE}:location-batch",
+            "api.locationbatch",
+            method="POST",
+            title="Add many locations",
             encoding="json",
-            schema=Location.json_schema(),
+            schema=batch_schema(Location),
         )
 
     def add_control_location_delete(self, location):
@@ -208,7 +382,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:location-delete",
-            href=url_for("api.locationitem", location=location),
+            href=self.href("api.locationitem", location=location.id),
             method="DELETE",
             title="Delete a location",
         )
@@ -219,7 +393,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:location-edit",
-            href=url_for("api.locationitem", location=location),
+            href=self.href("api.locationitem", location=location.id),
             method="PUT",
             title="Edit a location",
             encoding="json",
@@ -233,9 +407,9 @@ class BodyBuilder(MasonBuilder):
         """
         Adds a control to the object for getting all weather data
         """
-        self.add_control(
+        self.add_static_control(
             f"{NAMESPACE}:weather-all",
-            href=url_for("api.weathercollection"),
+            "api.weathercollection",
             method="GET",
             title="Get all weather data",
         )
@@ -246,7 +420,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:weather-location",
-            href=url_for("api.weatheritem", location=location),
+            href=self.href("api.weatheritem", location=location.id),
             method="GET",
             title="Get weather data for a location",
         )
@@ -290,7 +464,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:favourites-all",
-            href=url_for("api.favouritecollection", user=user),
+            href=self.href("api.favouritecollection", user=user.name),
             method="GET",
             title="Get all favourite locations",
         )
@@ -301,20 +475,34 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:favourite-add",
-            href=url_for("api.favouritecollection", user=user),
+            href=self.href("api.favouritecollection", user=user.name),
             method="POST",
             title="Add a new favourite location",
             encoding="json",
             schema=Favourite.json_schema(),
         )
 
+    def add_control_favourite_batch(self, user):
+        """
+        Adds a control to the object for adding many favourite locations at
+        once
+        """
+        self.add_control(
+            f"{NAMESPACE}:favourite-batch",
+            href=self.href("api.favouritebatch", user=user.name),
+            method="POST",
+            title="Add many favourite locations",
+            encoding="json",
+            schema=batch_schema(Favourite),
+        )
+
     def add_control_favourite_delete(self, user, favourite):
         """
         Adds a control to the object for deleting a favourite location
         """
         self.add_control(
             f"{NAMESPACE}:favourite-delete",
-            href=url_for("api.favouriteitem", user=user, favourite=favourite),
+            href=self.href("api.favouriteitem", user=user.name, favourite=favourite.id),
             method="DELETE",
             title="Delete a favourite location",
         )
@@ -325,7 +513,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:favourite-edit",
-            href=url_for("api.favouriteitem", user=user, favourite=favourite),
+            href=self.href("api.favouriteitem", user=user.name, favourite=favourite.id),
             method="PUT",
             title="Edit a favourite location",
             encoding="json",
@@ -338,7 +526,7 @@ class BodyBuilder(MasonBuilder):
         """
         self.add_control(
             f"{NAMESPACE}:favourite-location",
-            href=url_for("api.favouriteitem", user=user, favourite=favourite),
+            href=self.href("api.favouriteitem", user=user.name, favourite=favourite.id),
             method="GET",
             title="Get weather data for a location",
         )
@@ -354,18 +542,20 @@ def require_admin(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        print("ADMIN CHECK")
         api_key = request.headers.get("Bikinghub-Api-Key", "").strip()
-        print(f"API KEY: {api_key}")
         if not api_key or len(api_key) == 0:
+            logger.info(
+                "Admin check without api key: %s %s", request.method, request.path
+            )
             raise Forbidden
         key_hash = AuthenticationKey.key_hash(api_key)
         db_key = AuthenticationKey.query.filter_by(admin=True, key=api_key).first()
         if not db_key:
+            logger.info("Admin check failed: %s %s", request.method, request.path)
             raise Forbidden
         db_hash = AuthenticationKey.key_hash(db_key.key)
         if secrets.compare_digest(key_hash, db_hash):
-            print("ADMIN")
+            logger.debug("Admin key %s: %s %s", db_key.id, request.method, request.path)
             return func(*args, **kwargs)
 
     return wrapper
@@ -431,11 +621,27 @@ def find_within_distance(lat, lon, distance, all_locations):
     return close_objects
 
 
+def find_nearby_locations(lat, lon, distance):
+    """
+    Find the locations within a certain distance (km) from a point. The
+    bounding box around the point is searched using the latitude/longitude
+    index and only the locations inside it are checked with haversine.
+    """
+    dlat = math.degrees(distance / 6371)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-9)
+    candidates = Location.query.filter(
+        Location.latitude.between(lat - dlat, lat + dlat),
+        Location.longitude.between(lon - dlon, lon + dlon),
+    )
+    return find_within_distance(lat, lon, distance, candidates)
+
+
 def create_weather_data(location):
     """
     Fetches weather data from an external API using the latitude and longitude of the provided location.
     It then parses the fetched data, creates a new WeatherData object for each forecast in the data, and stores these objects in the database.
     The function returns the first WeatherData object created.
+    Raises UpstreamError if the weather can't be fetched.
 
     Returns:
     WeatherData: The first WeatherData object created from the fetched weather data.
@@ -481,7 +687,7 @@ def create_weather_data(location):
 
         weathers.append(weather)
 
-    print(f"weather: [{weathers[0]}]")
+    logger.debug("Stored %d forecasts for location %s", len(weathers), location.id)
 
     return weathers[0]
 
@@ -492,7 +698,7 @@ def fetch_weather_data(lat, lon):
     """
     # print(f"fetch_weather_data: lat: {lat}, lon: {lon}")
     location = query_mml_open_data_coordinates(lat, lon)
-    print(f"location: {location}")
+    logger.debug("Reverse geocoded %s, %s: %s", lat, lon, location)
     forecasts = query_fmi_forecast(location["district"], location["municipality"])
     # print(f"forecasts: {forecasts}")
 
@@ -524,15 +730,21 @@ def query_fmi_forecast(district, municipality):
     Query the FMI API for weather forecast
     """
     # ?place=kaijonharju&area=oulu
-    fmi_query = f"{FMI_FORECAST_URL}?place={district}&area={municipality}"
+    fmi_url = current_app.config["FMI_FORECAST_URL"]
+    fmi_query = f"{fmi_url}?place={district}&area={municipality}"
     # print(f"fmi_query: {fmi_query}")
-    response = requests.get(fmi_query, timeout=5)
-    json_resp = response.json()
-    # print(f"json_resp: {json_resp}")
-
-    forecast_values = json_resp["forecastValues"]
-    symbol_descriptions = json_resp["symbolDescriptions"]
-    day_length = json_resp["dayLengthValues"][0]
+    response = upstream_get(
+        "fmi", fmi_query, timeout=current_app.config["UPSTREAM_TIMEOUT"]
+    )
+    try:
+        json_resp = response.json()
+        # print(f"json_resp: {json_resp}")
+
+        forecast_values = json_resp["forecastValues"]
+        symbol_descriptions = json_resp["symbolDescriptions"]
+        day_length = json_resp["dayLengthValues"][0]
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise UpstreamError("fmi", f"malformed forecast: {e!r}") from e
     # print(f"forecast_values: {forecast_values}")
     # print(f"symbol_descriptions: {symbol_descriptions}")
     # print(f"day_length: {day_length}")
@@ -551,14 +763,16 @@ def query_mml_open_data_coordinates(lat, lon):
     Requires MML_API_KEY to be set in constants.py
     """
 
+    mml_url = current_app.config["MML_URL"]
+    timeout = current_app.config["UPSTREAM_TIMEOUT"]
     pelias_query = (
-        MML_URL
+        mml_url
         + f"/geocoding/v2/pelias/reverse?&lang=fi&sources=addresses&point.lon={lon}&point.lat={lat}"
         + f"&api-key={SECRETS.MML_API_KEY}"
     )
 
     # print(f"pelias_query: {pelias_query}")
-    response = requests.get(pelias_query, timeout=5)
+    response = upstream_get("mml", pelias_query, timeout=timeout)
     # print(f"response: {response.json()}")
     json_resp = response.json()
     post_number = ""
@@ -589,13 +803,13 @@ def query_mml_open_data_coordinates(lat, lon):
     # +placeType=3010105,3020105&bbox=25.4777,65.0169,25.4877,65.0269"
 
     place_name_query = (
-        f"{MML_URL}"
+        f"{mml_url}"
         + "/geographic-names/features/v1/collections/places/items"
         + f"?placeType=3010105,3020105&bbox={bbox}"
         + f"&api-key={SECRETS.MML_API_KEY}"
     )
     # print(f"place_name_query: {place_name_query}")
-    place_name_response = requests.get(place_name_query, timeout=5)
+    place_name_response = upstream_get("mml", place_name_query, timeout=timeout)
     place_name_json = place_name_response.json()
     # print(f"place_name_json: {place_name_json}")
     district = "vallila"
@@ -616,7 +830,6 @@ def query_mml_open_data_coordinates(lat, lon):
         "postnumber": post_number.lower(),
         "district": district.lower(),
     }
-    print(f"mml_data: {return_str}")
     return return_str
 
 
@@ -628,7 +841,8 @@ def page_key(*args, **kwargs):
     user = kwargs.get("user")
     page = request.args.get("page", 0)
     request_path = url_for("api.favouritecollection", user=user)
-    return request_path + f"[user_{user}_page_{page}]"
+    g.page_cache_key = request_path + f"[user_{user}_page_{page}]"
+    return g.page_cache_key
 
 
 # From course material
@@ -638,7 +852,8 @@ def page_key_location(*args, **kwargs):
     """
     page = request.args.get("page", 0)
     request_path = url_for("api.locationcollection")
-    return request_path + f"[page_{page}]"
+    g.page_cache_key = request_path + f"[page_{page}]"
+    return g.page_cache_key
 
 
 @dataclass(frozen=True)
@@ -649,4 +864,4 @@ class SECRETS:
     AUX_SERVICE_URL = os.environ.get("AUX_SERV_URL", "").strip("/")
 
     # print(f"MML_API_KEY: {MML_API_KEY}")
-    print(f"AUX_SERVICE_URL: {AUX_SERVICE_URL}")
+    logger.debug("AUX_SERVICE_URL: %s", AUX_SERVICE_URL)
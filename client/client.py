@@ -11,8 +11,10 @@ The client uses the asciified API to display ASCII art.
 import json
 import urllib
 import random
-import time
 import os
+import queue
+import struct
+import threading
 from getpass import getpass
 import requests
 import simpleaudio as sa
@@ -22,6 +24,9 @@ NAMESPACE = "bikinghub"
 RED = "\033[91m"
 GREEN = "\033[92m"
 RESET = "\033[0m"
+# Seconds to wait for the auxiliary service to generate the audio
+AUDIO_TIMEOUT = 20
+WAV_HEADER_SIZE = 44
 
 
 class BikingHubClient:
@@ -248,27 +253,99 @@ class BikingHubClient:
         except KeyboardInterrupt:
             return None
 
-    def play_audio(self, url):
+    def stream_audio(self, url):
         """
-        Play audio from the API.
+        Stream audio from the auxiliary service and play it while it's being
+        generated, starting with the first chunk. Returns False if no audio
+        was played, e.g. the service didn't answer with audio or couldn't be
+        reached.
 
         Parameters:
         url (str): The URL to get the audio from
         """
+        chunks = queue.Queue()
+        player = None
+
+        def play(sample_rate):
+            chunk = chunks.get()
+            while chunk is not None:
+                # Join the chunks that arrived during the last playback
+                end = False
+                while not chunks.empty():
+                    more = chunks.get()
+                    if more is None:
+                        end = True
+                        break
+                    chunk += more
+                sa.play_buffer(chunk, 1, 2, sample_rate).wait_done()
+                chunk = None if end else chunks.get()
+
         try:
-            i = 0
-            while i < 20:
-                print(".", end="")
-                time.sleep(1)
-                resp = self.session.get(url)
-                if resp.status_code == 200:
-                    print("Got audio")
-                    # Save the audio file
-                    os.makedirs("tmp", exist_ok=True)
-                    with open("tmp/file.wav", "wb") as audio:
-                        audio.write(resp.content)
-                    break
-                i += 1
+            with self.session.get(
+                url,
+                headers={"Accept": "audio/wav"},
+                stream=True,
+                timeout=AUDIO_TIMEOUT,
+            ) as resp:
+                content_type = resp.headers.get("Content-Type", "")
+                if resp.status_code != 200 or not content_type.startswith("audio/"):
+                    return False
+
+                buffer = b""
+                for data in resp.iter_content(chunk_size=None):
+                    buffer += data
+                    if player is None:
+                        if len(buffer) < WAV_HEADER_SIZE:
+                            continue
+                        sample_rate = struct.unpack_from("<I", buffer, 24)[0]
+                        buffer = buffer[WAV_HEADER_SIZE:]
+                        player = threading.Thread(target=play, args=(sample_rate,))
+                        player.start()
+                        print("Playing audio")
+                    # Whole 16-bit samples only
+                    size = len(buffer) - len(buffer) % 2
+                    if size:
+                        chunks.put(buffer[:size])
+                        buffer = buffer[size:]
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to play audio: {e}")
+        finally:
+            chunks.put(None)
+            if player is not None:
+                player.join()
+        return player is not None
+
+    def play_audio(self, url, job_url=None):
+        """
+        Play audio from the API. If the audio is still being generated, waits
+        for its job to finish with one long-polling request.
+
+        Parameters:
+        url (str): The URL to get the audio from
+        job_url (str): The URL of the job generating the audio
+        """
+        try:
+            if job_url:
+                print("Waiting for audio")
+                job = self.session.get(
+                    job_url,
+                    params={"wait": AUDIO_TIMEOUT},
+                    timeout=AUDIO_TIMEOUT + 5,
+                ).json()
+                if job.get("status") != "done":
+                    print(f"Audio not ready: {job.get('error') or job.get('status')}")
+                    return
+
+            # simpleaudio plays WAV only
+            resp = self.session.get(url, headers={"Accept": "audio/wav"})
+            if resp.status_code != 200:
+                print("Audio not found")
+                return
+            print("Got audio")
+            # Save the audio file
+            os.makedirs("tmp", exist_ok=True)
+            with open("tmp/file.wav", "wb") as audio:
+                audio.write(resp.content)
 
             print("Playing audio")
             wave_obj = sa.WaveObject.from_wave_file("tmp/file.wav")
@@ -394,11 +471,15 @@ class BikingHubClient:
             if read_obj.get("href") is None or read_obj.get("method") is None:
                 print("No weather data available")
                 return
+            if self.stream_audio(read_obj["href"]):
+                print(f"Weather data read {GREEN} successfully{RESET}\n")
+                return
+            # The service doesn't stream, wait for the generated file
             wread_resp = self.session.get(read_obj["href"])
             download_url = wread_resp.json().get("href")
             print(f"Download url: {download_url}")
-            self.play_audio(download_url)
-            if wread_resp.status_code == 202:
+            self.play_audio(download_url, wread_resp.json().get("job"))
+            if wread_resp.status_code in (200, 202):
                 print(f"Weather data read {GREEN} successfully{RESET}\n")
                 return
             else:
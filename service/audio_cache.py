@@ -0,0 +1,169 @@
+"""
+This module contains the content-addressed cache of the generated audio.
+- AudioCache: Maps (model, text) to a file in the static directory
+
+The file name is a hash of the model and the normalized text, so the same
+sentence is synthesized once and every later request gets the existing file.
+The files are evicted least recently used first when the WAV files grow
+over TTS_CACHE_MAX_MB. The transcoded variants of a file (see formats.py)
+have the same name with another extension and are evicted with it.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+MAX_BYTES = int(float(os.environ.get("TTS_CACHE_MAX_MB", 500)) * 2**20)
+EXTENSION = ".wav"
+
+
+def normalize_text(text):
+    """
+    Returns the text in NFC form with its whitespace collapsed, the texts
+    that only differ by these are spoken the same
+
+    Parameters:
+    text (str): The text to normalize
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class AudioCache:
+    """
+    Index of the audio files in a directory, least recently used first.
+    The files are written to a temporary name and renamed by store, so a
+    file in the index is always complete.
+    """
+
+    def __init__(self, directory="static", max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._files = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+
+    @staticmethod
+    def filename(model, text):
+        """
+        Returns the file name of the audio of the text spoken by the model
+
+        Parameters:
+        model (str): The name of the TTS model
+        text (str): The text to speak
+        """
+        digest = hashlib.sha256(
+            f"{model}\0{normalize_text(text)}".encode("utf-8")
+        ).hexdigest()
+        return digest[:32] + EXTENSION
+
+    def path(self, filename):
+        """
+        Returns the path of a cached file
+        """
+        return os.path.join(self.directory, filename)
+
+    def temporary_path(self, filename):
+        """
+        Returns the path the audio is written to before store
+        """
+        return os.path.join(self.directory, filename + ".part")
+
+    def lookup(self, filename):
+        """
+        Returns True if the file is ready and marks it recently used.
+        Otherwise returns False and counts a miss.
+        """
+        with self._lock:
+            if filename in self._files and os.path.exists(self.path(filename)):
+                self._files.move_to_end(filename)
+                self.hits += 1
+                hit = True
+            else:
+                self._files.pop(filename, None)
+                self.misses += 1
+                hit = False
+        if hit:
+            # The mtime keeps the order over restarts
+            os.utime(self.path(filename))
+        return hit
+
+    def reserve(self, filename):
+        """
+        Marks the file as being generated. Returns False if it already is,
+        the caller then doesn't need to queue it again.
+        """
+        with self._lock:
+            if filename in self._pending:
+                return False
+            self._pending.add(filename)
+            return True
+
+    def release(self, filename):
+        """
+        Unmarks a file whose generation failed
+        """
+        with self._lock:
+            self._pending.discard(filename)
+
+    def store(self, filename):
+        """
+        Moves the generated file from its temporary path into the cache and
+        evicts the least recently used files over max_bytes
+        """
+        os.replace(self.temporary_path(filename), self.path(filename))
+        size = os.path.getsize(self.path(filename))
+        with self._lock:
+            self._pending.discard(filename)
+            self._files[filename] = size
+            self._files.move_to_end(filename)
+            evicted = []
+            total = sum(self._files.values())
+            while total > self.max_bytes and len(self._files) > 1:
+                name, size = self._files.popitem(last=False)
+                total -= size
+                evicted.append(name)
+            self.evictions += len(evicted)
+        for name in evicted:
+            self._remove(name)
+
+    def _remove(self, filename):
+        stem = os.path.splitext(filename)[0] + "."
+        for name in os.listdir(self.directory):
+            # A .part file belongs to a new generation of the text
+            if name.startswith(stem) and not name.endswith(".part"):
+                try:
+                    os.remove(self.path(name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """
+        Returns the counters and the size of the cache
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "files": len(self._files),
+                "pending": len(self._pending),
+                "bytes": sum(self._files.values()),
+                "max_bytes": self.max_bytes,
+            }
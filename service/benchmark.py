@@ -0,0 +1,115 @@
+"""
+Measures the CPU throughput of the synthesis, one text at a time and in
+batches (see synthesis.synthesize_batch). The default model is the small
+single speaker VITS, which synthesizes batches in one forward pass. Models
+without batch support are measured too, their batches run one by one.
+
+Usage: python benchmark.py [--model tts_models/en/ljspeech/vits]
+           [--texts 32] [--batch-sizes 1,4,8] [--threads 4]
+           [--output tts-benchmark.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import wave
+
+# The benchmark measures the CPU even if a GPU is available
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+# pylint: disable=wrong-import-position
+import torch
+from synthesis import registry, synthesize_batch
+
+SENTENCES = [
+    "The temperature is 12.5 degrees.",
+    "Wind speed: 4.2 meters per second, from the south west.",
+    "Light rain is expected in the afternoon.",
+    "Humidity: 81 percent.",
+    "The road surface is dry.",
+    "Visibility is good, cloud cover: 40 percent.",
+    "It will feel like 9 degrees at 18.",
+    "No snow today.",
+]
+
+
+def _audio_seconds(filepaths):
+    seconds = 0.0
+    for filepath in filepaths:
+        with wave.open(filepath, "rb") as wav:
+            seconds += wav.getnframes() / wav.getframerate()
+    return seconds
+
+
+def _measure(model, texts, batch_size, directory):
+    filepaths = [
+        os.path.join(directory, f"{batch_size}-{i}.wav") for i in range(len(texts))
+    ]
+    failed = 0
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        errors, _ = synthesize_batch(
+            texts[i : i + batch_size], filepaths[i : i + batch_size], model
+        )
+        failed += sum(error is not None for error in errors)
+    elapsed = time.perf_counter() - start
+    audio = _audio_seconds(
+        [filepath for filepath in filepaths if os.path.exists(filepath)]
+    )
+    return {
+        "texts": len(texts),
+        "failed": failed,
+        "seconds": elapsed,
+        "texts_per_second": len(texts) / elapsed,
+        "audio_seconds": audio,
+        "real_time_factor": elapsed / audio if audio else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="tts_models/en/ljspeech/vits")
+    parser.add_argument("--texts", type=int, default=32)
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    texts = [SENTENCES[i % len(SENTENCES)] for i in range(args.texts)]
+    registry.warm_up([args.model])
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+            result = _measure(args.model, texts, batch_size, directory)
+            results[str(batch_size)] = result
+            print(
+                f"batch {batch_size:3}  {result['texts_per_second']:7.2f} texts/s  "
+                f"real-time factor {result['real_time_factor'] or 0:6.3f}"
+                + (f"  {result['failed']} failed" if result["failed"] else "")
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            json.dump(
+                {
+                    "meta": {
+                        "model": args.model,
+                        "threads": args.threads,
+                        "python": sys.version.split()[0],
+                        "torch": torch.__version__,
+                    },
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
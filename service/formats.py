@@ -0,0 +1,124 @@
+"""
+This module contains the audio formats the generated files are served in.
+- available: The media types that can be served, in order of preference
+- negotiate: Picks the format of a request from its Accept header
+- variant: Returns the file of a WAV in a format, transcoding it once
+
+The files are generated as WAV. Ogg/Opus and MP3 are a fraction of its size
+and are transcoded with ffmpeg (TTS_FFMPEG, default ffmpeg from the PATH)
+if it has the encoder. The transcoded file is stored next to the WAV with
+its own extension, and evicted with it by the audio cache.
+"""
+
+import functools
+import os
+import shutil
+import subprocess
+import threading
+
+WAV = "audio/wav"
+FFMPEG = shutil.which(os.environ.get("TTS_FFMPEG", "ffmpeg"))
+TRANSCODE_TIMEOUT = 60
+
+# Media type: (extension, ffmpeg output format, encoder, encoder options),
+# in the order they are preferred when the request accepts several
+FORMATS = {
+    "audio/ogg": (".ogg", "ogg", "libopus", ["-b:a", "32k"]),
+    "audio/mpeg": (".mp3", "mp3", "libmp3lame", ["-q:a", "5"]),
+    WAV: (".wav", None, None, []),
+}
+
+# A file is transcoded by one thread at a time, the paths share these locks
+_locks = [threading.Lock() for _ in range(16)]
+
+
+@functools.lru_cache(maxsize=1)
+def _encoders():
+    if FFMPEG is None:
+        return frozenset()
+    try:
+        output = subprocess.run(
+            [FFMPEG, "-hide_banner", "-encoders"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=10,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return frozenset()
+    return frozenset(
+        line.split()[1] for line in output.splitlines() if len(line.split()) > 1
+    )
+
+
+def available():
+    """
+    Returns the media types that can be served, in order of preference
+    """
+    encoders = _encoders()
+    return [
+        mimetype
+        for mimetype, (_, _, encoder, _) in FORMATS.items()
+        if encoder is None or encoder in encoders
+    ]
+
+
+def negotiate(accept_mimetypes):
+    """
+    Returns the media type to serve for the Accept header. A compressed
+    format is only served if the request lists its media type explicitly
+    with at least the quality WAV has. Wildcards, a missing Accept header or
+    none of the formats get WAV, so the clients that don't know about the
+    formats keep getting what they always got.
+
+    Parameters:
+    accept_mimetypes (MIMEAccept): The Accept header of the request
+    """
+    listed = {}
+    for value, quality in accept_mimetypes:
+        listed[value.lower()] = max(quality, listed.get(value.lower(), 0))
+    wav_quality = accept_mimetypes[WAV]
+    best, best_quality = WAV, 0
+    for mimetype in available():
+        quality = listed.get(mimetype, 0)
+        if mimetype != WAV and quality > best_quality and quality >= wav_quality:
+            best, best_quality = mimetype, quality
+    return best
+
+
+def variant(wav_path, mimetype):
+    """
+    Returns the path and the media type of the WAV file in the requested
+    media type, transcoding it on the first request. Returns the WAV if the
+    transcoding fails.
+
+    Parameters:
+    wav_path (str): The path of the generated WAV file
+    mimetype (str): One of the available media types
+    """
+    extension, output_format, encoder, options = FORMATS[mimetype]
+    if encoder is None:
+        return wav_path, WAV
+
+    path = os.path.splitext(wav_path)[0] + extension
+    with _locks[hash(path) % len(_locks)]:
+        if os.path.exists(path):
+            return path, mimetype
+        temporary_path = path + ".part"
+        try:
+            subprocess.run(
+                [FFMPEG, "-hide_banner", "-loglevel", "error", "-y"]
+                + ["-i", wav_path, "-c:a", encoder]
+                + options
+                + ["-f", output_format, temporary_path],
+                check=True,
+                capture_output=True,
+                timeout=TRANSCODE_TIMEOUT,
+            )
+            os.replace(temporary_path, path)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Transcoding {wav_path} to {mimetype} failed: {e}")
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return wav_path, WAV
+    return path, mimetype
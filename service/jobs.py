@@ -0,0 +1,114 @@
+"""
+This module tracks the audio generation requests as jobs.
+- Job: The status of one audio file being generated
+- JobRegistry: The jobs of the service by id
+
+A job is identified by the cache file name of its audio without the
+extension, so the requests for the same text share one job. The job's done
+event is set when the file is ready or the generation failed, which lets
+the /jobs/<id>/ route answer a waiting client the moment that happens.
+Finished jobs are forgotten after JOB_TTL seconds.
+"""
+
+import os
+import threading
+import time
+
+JOB_TTL = int(os.environ.get("TTS_JOB_TTL", 600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """
+    The status of one audio file being generated
+    """
+
+    def __init__(self, job_id, filename):
+        self.id = job_id
+        self.filename = filename
+        self.status = QUEUED
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def serialize(self):
+        """
+        Returns the job as a dictionary
+        """
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobRegistry:
+    """
+    The jobs of the service by id
+    """
+
+    def __init__(self, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def job_id(filename):
+        """
+        Returns the id of the job that generates the file
+        """
+        return os.path.splitext(filename)[0]
+
+    def create(self, filename):
+        """
+        Returns a new queued job for the file, replacing a finished one
+        """
+        job = Job(self.job_id(filename), filename)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job or None if it's unknown or forgotten
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def start(self, filename):
+        """
+        Marks the job of the file as running
+        """
+        job = self.get(self.job_id(filename))
+        if job is not None:
+            job.status = RUNNING
+
+    def finish(self, filename, error=None):
+        """
+        Marks the job of the file as done, or failed if error is given, and
+        wakes up the clients waiting for it
+        """
+        job = self.get(self.job_id(filename))
+        if job is None:
+            return
+        job.status = DONE if error is None else FAILED
+        job.error = None if error is None else str(error)
+        job.finished = time.time()
+        job.done.set()
+
+    def _prune(self):
+        expired = time.time() - self.ttl
+        for job_id in [
+            job.id
+            for job in self._jobs.values()
+            if job.finished is not None and job.finished < expired
+        ]:
+            del self._jobs[job_id]
@@ -0,0 +1,304 @@
+"""
+This module runs the speech synthesis in a pool of worker processes.
+- SynthesisPool: Bounded queue of synthesis requests and the workers that
+  process them
+
+The synthesis is CPU-bound Python, so the threads of one process would take
+turns on the GIL. The pool starts TTS_WORKERS processes, each with its own
+resident models (see synthesis.py) and an equal share of the CPU threads.
+With TTS_WORKERS = 0 the synthesis runs in a thread of the service process,
+which is the better choice with a GPU.
+
+At most TTS_QUEUE_SIZE requests wait in the queue. When it's full, submit
+returns False and the service answers 503 with a Retry-After estimated from
+the queue depth and the recent synthesis times.
+
+Each worker thread collects the requests that arrive within TTS_BATCH_WAIT_MS
+milliseconds of the first one, up to TTS_BATCH_SIZE, and gives them to a
+worker process at once. Models that support it synthesize them in one batch,
+the others one by one (see synthesis.synthesize_batch).
+
+If a worker process dies, e.g. when it runs out of memory, the executor
+can't be used anymore. The requests it was running fail, a new executor is
+started for the next ones and the restart is counted in the status.
+
+Streamed requests skip the queue, their sentences are given to the workers
+directly so the first one is ready as soon as possible. At most TTS_STREAMS
+streams are synthesized at a time.
+"""
+
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import synthesis
+
+WORKERS = int(os.environ.get("TTS_WORKERS", 1))
+QUEUE_SIZE = int(os.environ.get("TTS_QUEUE_SIZE", 32))
+STREAMS = int(os.environ.get("TTS_STREAMS", 4))
+BATCH_SIZE = int(os.environ.get("TTS_BATCH_SIZE", 8))
+BATCH_WAIT = float(os.environ.get("TTS_BATCH_WAIT_MS", 10)) / 1000
+# Number of recent requests the wait and synthesis times are averaged over
+WINDOW = 100
+
+
+class SynthesisPool:
+    """
+    Queue of (text, filepath, model) requests processed by worker processes.
+    on_start(filename) is called in a thread of the service when a worker
+    takes a request and on_done(filename, error) when it has been processed,
+    error is None if it succeeded.
+    """
+
+    def __init__(
+        self,
+        on_done,
+        on_start=None,
+        workers=WORKERS,
+        queue_size=QUEUE_SIZE,
+        streams=STREAMS,
+        batch_size=BATCH_SIZE,
+        batch_wait=BATCH_WAIT,
+    ):
+        self.on_done = on_done
+        self.on_start = on_start
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.executor = None
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy = 0
+        self.streams = 0
+        self.max_streams = streams
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.batches = 0
+        self.restarts = 0
+        self.worker_reports = {}
+        self._waits = deque(maxlen=WINDOW)
+        self._durations = deque(maxlen=WINDOW)
+        self._lock = threading.Lock()
+        # Without worker processes the resident model is used by one thread
+        # at a time
+        self._inline = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker processes and the threads that feed them
+        """
+        if self.workers:
+            self.executor = self._new_executor()
+        else:
+            # Holds the model lock like the synthesis, see _run
+            threading.Thread(
+                target=self._run, args=(synthesis.registry.warm_up,), daemon=True
+            ).start()
+        for _ in range(max(1, self.workers)):
+            threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _new_executor(self):
+        # Forking a process that has loaded torch is not safe
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=synthesis.init_worker,
+            initargs=(max(1, (os.cpu_count() or 1) // self.workers),),
+        )
+
+    def _restart(self, broken):
+        # Several threads see the same broken executor, the first one
+        # replaces it
+        with self._lock:
+            if self.executor is not broken:
+                return
+            self.executor = self._new_executor()
+            self.restarts += 1
+        print("A worker process died, restarted the workers")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, text, filename, filepath, model=synthesis.DEFAULT_MODEL):
+        """
+        Queues a request. Returns False if the queue is full.
+
+        Parameters:
+        text (str): The text to generate audio for
+        filename (str): The name passed to on_done
+        filepath (str): The path to save the audio to
+        model (str): The TTS model to use
+        """
+        try:
+            self.queue.put_nowait((time.monotonic(), text, filename, filepath, model))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def _collect(self):
+        # Blocks for the first request, then takes the ones that arrive
+        # within batch_wait of it
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(
+                    self.queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self.queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            start = time.monotonic()
+            with self._lock:
+                self._waits.extend(start - item[0] for item in batch)
+                self.busy += len(batch)
+                self.batches += 1
+            if self.on_start is not None:
+                for item in batch:
+                    self.on_start(item[2])
+
+            models = {}
+            for item in batch:
+                models.setdefault(item[4], []).append(item)
+            for model, items in models.items():
+                group_start = time.monotonic()
+                try:
+                    errors, report = self._run(
+                        synthesis.synthesize_batch,
+                        [item[1] for item in items],
+                        [item[3] for item in items],
+                        model,
+                    )
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    errors, report = [e] * len(items), None
+                self._finish(items, errors, report, time.monotonic() - group_start)
+
+    def _finish(self, items, errors, report, seconds):
+        with self._lock:
+            self.busy -= len(items)
+            self._durations.extend([seconds / len(items)] * len(items))
+            self.failed += sum(error is not None for error in errors)
+            self.processed += sum(error is None for error in errors)
+            if report is not None:
+                self.worker_reports[report["pid"]] = report
+        for item, error in zip(items, errors):
+            self.on_done(item[2], error)
+            self.queue.task_done()
+
+    def _run(self, function, *args):
+        executor = self.executor
+        if executor is None:
+            with self._inline:
+                return function(*args)
+        try:
+            return executor.submit(function, *args).result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def open_stream(self):
+        """
+        Reserves a place for a stream. Returns False if TTS_STREAMS streams
+        are already being synthesized, close_stream frees the place.
+        """
+        with self._lock:
+            if self.streams >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        """
+        Frees the place of a finished stream
+        """
+        with self._lock:
+            self.streams -= 1
+
+    def stream(self, sentences, model=synthesis.DEFAULT_MODEL):
+        """
+        Yields the (sample rate, PCM) of each sentence in order. With worker
+        processes all sentences are submitted at once, so the later ones are
+        synthesized while the first ones are sent.
+
+        Parameters:
+        sentences (list): The sentences to synthesize
+        model (str): The TTS model to use
+        """
+        executor = self.executor
+        if executor is None:
+            for sentence in sentences:
+                yield self._run(synthesis.synthesize_pcm, sentence, model)
+            return
+
+        futures = []
+        try:
+            for sentence in sentences:
+                futures.append(
+                    executor.submit(synthesis.synthesize_pcm, sentence, model)
+                )
+            for future in futures:
+                yield future.result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+        finally:
+            # The client went away or a sentence failed
+            for future in futures:
+                future.cancel()
+
+    def memory_reports(self):
+        """
+        Returns the last memory report of each worker process
+        """
+        with self._lock:
+            return list(self.worker_reports.values())
+
+    def retry_after(self):
+        """
+        Returns the seconds until a place in the queue is likely to be free
+        """
+        with self._lock:
+            duration = _mean(self._durations) or 1.0
+        depth = self.queue.qsize() + 1
+        return max(1, math.ceil(depth * duration / max(1, self.workers)))
+
+    def status(self):
+        """
+        Returns the queue depth, the wait and synthesis times and the counters
+        """
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "streams": self.streams,
+                "max_streams": self.max_streams,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "batches": self.batches,
+                "batch_size": self.batch_size,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+                "wait_seconds_mean": _mean(waits),
+                "wait_seconds_max": max(waits, default=None),
+                "synthesis_seconds_mean": _mean(self._durations),
+            }
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
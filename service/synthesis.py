@@ -0,0 +1,347 @@
+"""
+This module loads the TTS models and synthesizes speech with them.
+- ModelRegistry: Loads each requested model once and keeps it resident
+- registry: The registry of this process
+- synthesize_to_file: Synthesizes text to a WAV file with a resident model
+- synthesize_pcm: Synthesizes text to 16-bit PCM for streaming
+- split_sentences: Splits text into the parts that are streamed one by one
+- wav_header, write_wav: The WAV container of the PCM audio
+- synthesize_batch: Synthesizes several texts at once where the model
+  supports it
+- init_worker: Initializes a worker process
+
+Loading a model reads its weights from disk, which takes seconds while the
+synthesis of a sentence takes a fraction of that. The registry loads a model
+on its first use and reuses it afterwards. At most TTS_MAX_MODELS models are
+kept in memory, the least recently used one is unloaded first.
+
+Importing this module doesn't load anything. torch and TTS are imported by
+the functions that synthesize, which run in the worker processes, so the
+service process only loads them with TTS_WORKERS = 0. The models are loaded
+by ModelRegistry.get and ModelRegistry.warm_up.
+"""
+
+import gc
+import os
+import re
+import struct
+import threading
+import time
+import wave
+from collections import OrderedDict
+from functools import lru_cache
+
+DEFAULT_MODEL = "tts_models/en/ljspeech/tacotron2-DDC"
+# Models loaded at startup, comma separated
+WARM_UP_MODELS = [
+    name.strip()
+    for name in os.environ.get("TTS_MODELS", DEFAULT_MODEL).split(",")
+    if name.strip()
+]
+MAX_MODELS = int(os.environ.get("TTS_MAX_MODELS", 2))
+WARM_UP_TEXT = "Warming up."
+# Longest part of a sentence that is synthesized at once when streaming
+SENTENCE_CHARS = int(os.environ.get("TTS_SENTENCE_CHARS", 200))
+# Data size of a WAV header whose length is not known yet
+STREAM_SIZE = 0xFFFFFFFF
+
+
+@lru_cache(maxsize=1)
+def device():
+    """
+    Returns the torch device the models run on, the GPU if there is one
+    """
+    import torch
+
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class ModelRegistry:
+    """
+    Loads TTS models on their first use and keeps up to max_models of them
+    in memory, least recently used first out.
+    """
+
+    def __init__(self, max_models=MAX_MODELS):
+        self.max_models = max(1, max_models)
+        self._models = OrderedDict()
+        self._load_seconds = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, model=DEFAULT_MODEL):
+        """
+        Returns the resident instance of the model, loading it if needed
+
+        Parameters:
+        model (str): The name of the TTS model
+        """
+        with self._lock:
+            tts = self._models.get(model)
+            if tts is not None:
+                self._models.move_to_end(model)
+                return tts
+
+            from TTS.api import TTS
+
+            start = time.perf_counter()
+            tts = TTS(model_name=model, progress_bar=False).to(device())
+            self._load_seconds[model] = time.perf_counter() - start
+            self.loads += 1
+            self._models[model] = tts
+            print(f"Loaded {model} in {self._load_seconds[model]:.1f} s")
+
+            while len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                self._load_seconds.pop(evicted, None)
+                self.evictions += 1
+                print(f"Unloaded {evicted}")
+            return tts
+
+    def unload(self):
+        """
+        Unloads all models and releases their memory
+        """
+        with self._lock:
+            self._models.clear()
+            self._load_seconds.clear()
+        gc.collect()
+        if self.loads and device().type == "cuda":
+            import torch
+
+            torch.cuda.empty_cache()
+
+    def warm_up(self, models=None):
+        """
+        Loads the models and runs one synthesis with each, so the first
+        request doesn't pay for the loading and the first-call setup
+
+        Parameters:
+        models (list): The model names (default: TTS_MODELS)
+        """
+        for model in WARM_UP_MODELS if models is None else models:
+            try:
+                self.get(model).tts(text=WARM_UP_TEXT, split_sentences=False)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Warm-up of {model} failed: {e}")
+        print(self.memory_report())
+
+    def memory_report(self):
+        """
+        Returns the resident models with their parameter memory and load
+        times, and the memory use of the process
+        """
+        import psutil
+
+        with self._lock:
+            models = [
+                {
+                    "name": name,
+                    "parameters_mb": _parameter_bytes(tts) / 2**20,
+                    "load_seconds": self._load_seconds.get(name),
+                }
+                for name, tts in self._models.items()
+            ]
+        report = {
+            "pid": os.getpid(),
+            "device": str(device()),
+            "max_models": self.max_models,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "models": models,
+            "process_rss_mb": psutil.Process().memory_info().rss / 2**20,
+        }
+        if device().type == "cuda":
+            import torch
+
+            report["cuda_allocated_mb"] = torch.cuda.memory_allocated() / 2**20
+        return report
+
+
+def _parameter_bytes(tts):
+    return sum(p.numel() * p.element_size() for p in tts.parameters())
+
+
+registry = ModelRegistry()
+
+
+def synthesize_to_file(text, filepath, model=DEFAULT_MODEL):
+    """
+    Synthesizes the text with a resident model and saves it as WAV
+
+    Parameters:
+    text (str): The text to generate audio for
+    filepath (str): The path to save the audio to
+    model (str): The TTS model to use (default: tacotron2-DDC)
+    """
+    registry.get(model).tts_to_file(
+        text=text, file_path=filepath, split_sentences=False
+    )
+    return filepath
+
+
+def synthesize_pcm(text, model=DEFAULT_MODEL):
+    """
+    Synthesizes the text with a resident model and returns the sample rate
+    and the audio as mono 16-bit little-endian PCM
+
+    Parameters:
+    text (str): The text to generate audio for
+    model (str): The TTS model to use (default: tacotron2-DDC)
+    """
+    import numpy as np
+
+    tts = registry.get(model)
+    samples = np.asarray(tts.tts(text=text, split_sentences=False), dtype=np.float32)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    return tts.synthesizer.output_sample_rate, pcm
+
+
+def split_sentences(text, max_chars=SENTENCE_CHARS):
+    """
+    Splits the text into its sentences, in order. A sentence longer than
+    max_chars is split further at its commas, so the comma separated weather
+    description isn't synthesized in one piece.
+
+    Parameters:
+    text (str): The text to split
+    max_chars (int): The longest part that isn't split at commas
+    """
+    parts = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        part = ""
+        for clause in re.split(r"(?<=,)\s+", sentence):
+            if part and len(part) + 1 + len(clause) > max_chars:
+                parts.append(part)
+                part = clause
+            else:
+                part = f"{part} {clause}" if part else clause
+        if part:
+            parts.append(part)
+    return parts
+
+
+def wav_header(sample_rate, data_size=STREAM_SIZE):
+    """
+    Returns the header of a mono 16-bit PCM WAV file. A stream whose length
+    isn't known uses the largest size, which players read until the end.
+
+    Parameters:
+    sample_rate (int): The sample rate of the audio
+    data_size (int): The size of the PCM data in bytes
+    """
+    riff_size = STREAM_SIZE if data_size == STREAM_SIZE else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        sample_rate,
+        sample_rate * 2,
+        2,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def write_wav(filepath, sample_rate, pcm_chunks):
+    """
+    Writes mono 16-bit PCM chunks to a WAV file
+
+    Parameters:
+    filepath (str): The path to save the audio to
+    sample_rate (int): The sample rate of the audio
+    pcm_chunks (list): The PCM data in order
+    """
+    with wave.open(filepath, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        for chunk in pcm_chunks:
+            wav.writeframes(chunk)
+    return filepath
+
+
+def init_worker(threads):
+    """
+    Initializes a worker process: limits the CPU threads of torch so the
+    workers don't compete for the cores, and warms up the models
+
+    Parameters:
+    threads (int): The number of CPU threads of this worker
+    """
+    import torch
+
+    torch.set_num_threads(threads)
+    registry.warm_up()
+
+
+def _batch_model(tts):
+    # Single speaker VITS synthesizes padded batches in one forward pass
+    # without a separate vocoder. Tacotron2's decoder stops on the stop token
+    # of a single sequence, so it synthesizes one text at a time.
+    from TTS.tts.models.vits import Vits
+
+    model = tts.synthesizer.tts_model
+    if (
+        isinstance(model, Vits)
+        and tts.synthesizer.vocoder_model is None
+        and not tts.is_multi_speaker
+        and not tts.is_multi_lingual
+    ):
+        return model
+    return None
+
+
+def _infer_batch(model, texts):
+    import torch
+
+    token_ids = [model.tokenizer.text_to_ids(text) for text in texts]
+    lengths = torch.tensor([len(ids) for ids in token_ids], device=device())
+    x = torch.zeros(len(texts), int(lengths.max()), dtype=torch.long, device=device())
+    for row, ids in enumerate(token_ids):
+        x[row, : len(ids)] = torch.tensor(ids, dtype=torch.long, device=device())
+    with torch.no_grad():
+        outputs = model.inference(x, aux_input={"x_lengths": lengths})
+    # The outputs are padded to the longest one, y_mask has the frames of each
+    samples = outputs["y_mask"].sum(dim=(1, 2)).long() * model.config.audio.hop_length
+    waveforms = outputs["model_outputs"].squeeze(1).cpu().numpy()
+    return [waveforms[row, : int(samples[row])] for row in range(len(texts))]
+
+
+def synthesize_batch(texts, filepaths, model=DEFAULT_MODEL):
+    """
+    Synthesizes the texts to the filepaths. Models that support it
+    synthesize all texts in one batch, the others and a failed batch one
+    text at a time. Returns the error message of each text, None if it
+    succeeded, and the memory report of the process, which the service
+    shows at /models/.
+
+    Parameters:
+    texts (list): The texts to generate audio for
+    filepaths (list): The paths to save the audio to, one per text
+    model (str): The TTS model to use (default: tacotron2-DDC)
+    """
+    tts = registry.get(model)
+    errors = [None] * len(texts)
+    batch_model = _batch_model(tts)
+    if batch_model is not None and len(texts) > 1:
+        try:
+            for wav, filepath in zip(_infer_batch(batch_model, texts), filepaths):
+                tts.synthesizer.save_wav(wav, filepath)
+            return errors, registry.memory_report()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Batch of {len(texts)} failed, synthesizing one by one: {e}")
+
+    for i, (text, filepath) in enumerate(zip(texts, filepaths)):
+        try:
+            synthesize_to_file(text, filepath, model)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            errors[i] = str(e)
+    return errors, registry.memory_report()
@@ -2,77 +2,98 @@
 This module creates a Flask server to generate voice from text using TTS.
 """
 
-from queue import Queue
-from threading import Thread
 from datetime import datetime
 import os
-import uuid
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from flask import Flask, request, jsonify, send_from_directory, url_for, Response
-import torch
-from TTS.api import TTS
+from werkzeug.security import safe_join
+import formats
+from audio_cache import AudioCache, EXTENSION
+from jobs import JobRegistry
+from pool import SynthesisPool
+from synthesis import DEFAULT_MODEL, split_sentences, wav_header, write_wav
+from weather_cache import WeatherCache
 
 BIKINGHUB_API = "http://localhost:5000/api"
+# Longest time a /jobs/<id>/ request waits for the job, in seconds
+MAX_WAIT = 30
+# Longest time the status of a job is streamed as server-sent events
+STREAM_MAX_SECONDS = int(os.environ.get("TTS_JOB_STREAM_SECONDS", 600))
+# Seconds to wait for the bikinghub API
+API_TIMEOUT = 10
+# The name of a generated file is the hash of its text, so it never changes
+DOWNLOAD_MAX_AGE = 86400
 
 app = Flask(__name__)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Create a queue to handle multiple requests
-queue = Queue()
+audio_cache = AudioCache("static")
+jobs = JobRegistry()
+weather_cache = WeatherCache()
 
-
-def worker():
-    """
-    Worker function to process the queue and generate audio for each item.
-    """
-    while True:
-        item = queue.get()
-        if item is None:
-            break
-        text, filename = item
-        generate_voice_with_tts(text, filename)
-        queue.task_done()
-
-
-# Start the worker thread
-Thread(target=worker, daemon=True).start()
+# One session for all requests to the bikinghub API, so the connections are
+# reused instead of opened for every request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_maxsize=10))
+session.mount("https://", HTTPAdapter(pool_maxsize=10))
 
 
-def generate_voice_with_tts(
-    text, filename, model="tts_models/en/ljspeech/tacotron2-DDC"
-):
+def finish_voice(filename, error):
     """
-    Generate voice with TTS model and save it to a file.
+    Moves a generated file into the audio cache, or releases it if the
+    generation failed.
 
     Parameters:
-    text (str): The text to generate audio for
-    filename (str): The filename to save the audio to
-    model (str): The TTS model to use (default: tacotron2-DDC)
+    filename (str): The filename of the audio
+    error (Exception): The error of the generation, None if it succeeded
     """
+    if error is None:
+        audio_cache.store(filename)
+    else:
+        print(f"Generating {filename} failed: {error}")
+        audio_cache.release(filename)
+    jobs.finish(filename, error)
 
-    if not os.path.exists("static"):
-        os.makedirs("static")
-
-    tts = TTS(model_name=model, progress_bar=False).to(device)
-    filepath = os.path.join("static", filename)
 
-    tts.tts_to_file(text=text, file_path=filepath, split_sentences=False)
-    return filepath
+# Create a bounded queue and the workers to handle multiple requests
+pool = SynthesisPool(finish_voice, on_start=jobs.start)
+# The worker processes import this module as __mp_main__ when the service is
+# started with "python tts_service.py", they must not start a pool of their own
+if __name__ != "__mp_main__":
+    pool.start()
 
 
 def get_weather_from_api(location_id):
     """
-    Fetches weather description from the bikinghub service.
+    Fetches weather description from the bikinghub service. The description
+    of the current hour is cached, and revalidated with its ETag if the
+    service sent one.
 
     Parameters:
     location_id (int): The location id to fetch weather description for
     """
+    formatted_weather = weather_cache.get(location_id)
+    if formatted_weather is not None:
+        return formatted_weather
+
     weather_endpoint = f"{BIKINGHUB_API}/locations/{location_id}/weather/"
-    sess = requests.Session()
+    headers = {}
+    etag = weather_cache.etag(location_id)
+    if etag:
+        headers["If-None-Match"] = etag
 
     try:
-        resp = sess.get(f"{weather_endpoint}")
+        resp = session.get(weather_endpoint, headers=headers, timeout=API_TIMEOUT)
+        if resp.status_code == 304:
+            formatted_weather = weather_cache.revalidate(location_id)
+            if formatted_weather is not None:
+                return formatted_weather
+            resp = session.get(weather_endpoint, timeout=API_TIMEOUT)
+        if resp.status_code != 200:
+            print(f"Weather of location {location_id}: {resp.status_code}")
+            return None
         json_resp = resp.json()
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
@@ -83,6 +104,7 @@ def get_weather_from_api(location_id):
 
     formatted_weather = format_weather(json_resp.get("items", {}))
     print(f"Formatted weather: {formatted_weather}")
+    weather_cache.put(location_id, formatted_weather, resp.headers.get("ETag"))
     return formatted_weather
 
 
@@ -128,31 +150,62 @@ def parse_datetime(datetime_str):
     Parameters:
     datetime_str (str): The datetime string to parse
     """
-    dt = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+    dt = datetime.fromisoformat(datetime_str)
     formatted_time = dt.strftime("%d %B %Y at %H")
     return formatted_time
 
 
-@app.route("/generate_voice/", methods=["POST"])
-async def generate_voice():
+def enqueue_voice(text, model=DEFAULT_MODEL):
     """
-    Route to generate voice from text.
-    Expects a JSON payload with a "text" key and POST method.
+    Returns the audio of the text from the cache with 200, or queues its
+    generation and returns 202. The href of the file is in both responses.
+    If the request prefers audio/wav, the audio is streamed instead.
+
+    Parameters:
+    text (str): The text to generate audio for
+    model (str): The TTS model to use (default: tacotron2-DDC)
     """
-    text = request.json.get("text")
-    if not text:
-        return jsonify({"error": "No text provided"}), 400
+    if (
+        request.accept_mimetypes.best_match(["application/json", "audio/wav"])
+        == "audio/wav"
+    ):
+        return stream_voice(text, model)
 
-    filename = f"{uuid.uuid4()}.wav"
+    filename = audio_cache.filename(model, text)
     file_url = url_for("download", filename=filename, _external=True)
-    # print(f"Adding: {text} | to with filename: {filename}")
-
-    queue.put((text, filename))
+    job_url = url_for("job_status", job_id=jobs.job_id(filename), _external=True)
+
+    if audio_cache.lookup(filename):
+        return Response(
+            json.dumps(
+                {
+                    "message": "Your audio file is ready.",
+                    "href": file_url,
+                    "job": job_url,
+                }
+            ),
+            status=200,
+            mimetype="application/json",
+        )
+
+    # A text that is already queued is not queued again
+    if audio_cache.reserve(filename):
+        jobs.create(filename)
+        if not pool.submit(text, filename, audio_cache.temporary_path(filename), model):
+            audio_cache.release(filename)
+            jobs.finish(filename, "The queue is full")
+            return Response(
+                json.dumps({"error": "The queue is full, try again later."}),
+                status=503,
+                headers={"Retry-After": str(pool.retry_after())},
+                mimetype="application/json",
+            )
     return Response(
         json.dumps(
             {
                 "message": "Your request has been added to the queue and will be processed soon.",
                 "href": file_url,
+                "job": job_url,
             },
         ),
         status=202,
@@ -160,6 +213,83 @@ async def generate_voice():
     )
 
 
+def stream_voice(text, model=DEFAULT_MODEL):
+    """
+    Returns the audio of the text as a chunked WAV response, sentence by
+    sentence as they are synthesized. The audio is also stored in the cache,
+    unless it's already being generated, and tracked as a job like a queued
+    request. A cached file is sent as it is.
+
+    Parameters:
+    text (str): The text to generate audio for
+    model (str): The TTS model to use (default: tacotron2-DDC)
+    """
+    filename = audio_cache.filename(model, text)
+    if audio_cache.lookup(filename):
+        return send_from_directory(
+            directory="static", path=filename, mimetype="audio/wav"
+        )
+
+    if not pool.open_stream():
+        return Response(
+            json.dumps({"error": "Too many streams, try again later."}),
+            status=503,
+            headers={"Retry-After": str(pool.retry_after())},
+            mimetype="application/json",
+        )
+    store = audio_cache.reserve(filename)
+    if store:
+        jobs.create(filename)
+        jobs.start(filename)
+    state = {"stored": False, "error": "The stream was closed"}
+
+    def chunks():
+        pcm_chunks = []
+        sample_rate = None
+        try:
+            for rate, pcm in pool.stream(split_sentences(text), model):
+                if sample_rate is None:
+                    sample_rate = rate
+                    yield wav_header(sample_rate)
+                if store:
+                    pcm_chunks.append(pcm)
+                yield pcm
+            if store and pcm_chunks:
+                write_wav(audio_cache.temporary_path(filename), sample_rate, pcm_chunks)
+                audio_cache.store(filename)
+                state["stored"] = True
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The status is already sent, the stream just ends
+            print(f"Streaming {filename} failed: {e}")
+            state["error"] = str(e)
+
+    def close():
+        # Called when the response is closed, also if the client went away
+        # before the stream started
+        if store:
+            if not state["stored"]:
+                audio_cache.release(filename)
+            jobs.finish(filename, None if state["stored"] else state["error"])
+        pool.close_stream()
+
+    response = Response(chunks(), mimetype="audio/wav")
+    response.call_on_close(close)
+    return response
+
+
+@app.route("/generate_voice/", methods=["POST"])
+async def generate_voice():
+    """
+    Route to generate voice from text.
+    Expects a JSON payload with a "text" key and POST method.
+    """
+    text = request.json.get("text")
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+
+    return enqueue_voice(text)
+
+
 @app.route("/weather_voice/<int:location_id>/", methods=["GET"])
 async def generate_voice_weather(location_id):
     """
@@ -173,21 +303,7 @@ async def generate_voice_weather(location_id):
     if not text:
         return jsonify({"error": "No text provided"}), 400
 
-    filename = f"{uuid.uuid4()}.wav"
-    file_url = url_for("download", filename=filename, _external=True)
-    # print(f"Adding: {text} | to with filename: {filename}")
-
-    queue.put((text, filename))
-    return Response(
-        json.dumps(
-            {
-                "message": "Your request has been added to the queue and will be processed soon.",
-                "href": file_url,
-            },
-        ),
-        status=202,
-        mimetype="application/json",
-    )
+    return enqueue_voice(text)
 
 
 @app.route("/download/<path:filename>/", methods=["GET"])
@@ -195,14 +311,108 @@ def download(filename):
     """
     Route to download the generated audio file.
     Expects a filename and GET method.
+    A generated WAV file is served in the format that matches the Accept
+    header: Ogg/Opus or MP3 if the client lists it, WAV otherwise. The file
+    is sent with conditional and range request support.
 
     Parameters:
     filename (str): The filename to download
     """
-    if not os.path.exists(os.path.join("static", filename)):
+    path = safe_join("static", filename)
+    if path is None or not os.path.exists(path):
         return jsonify({"error": "File not found or not yet ready"}), 404
 
-    return send_from_directory(directory="static", path=filename)
+    if not filename.endswith(EXTENSION):
+        return send_from_directory(directory="static", path=filename)
+
+    path, mimetype = formats.variant(
+        audio_cache.path(filename), formats.negotiate(request.accept_mimetypes)
+    )
+    response = send_from_directory(
+        directory="static",
+        path=os.path.basename(path),
+        mimetype=mimetype,
+        max_age=DOWNLOAD_MAX_AGE,
+    )
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/jobs/<job_id>/", methods=["GET"])
+def job_status(job_id):
+    """
+    Route to get the status of an audio generation job.
+    With ?wait=<seconds> the response is held until the job is done or
+    failed, for at most MAX_WAIT seconds. With Accept: text/event-stream the
+    status is sent as server-sent events, the last one when the job is done
+    or failed. If the job isn't finished within STREAM_MAX_SECONDS or is
+    forgotten, a timeout event with its last status ends the stream.
+
+    Parameters:
+    job_id (str): The id of the job
+    """
+    filename = job_id + EXTENSION
+    file_url = url_for("download", filename=filename, _external=True)
+    job = jobs.get(job_id)
+    if job is None:
+        # Forgotten jobs and cache hits only have the file
+        if not os.path.exists(audio_cache.path(filename)):
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"id": job_id, "status": "done", "href": file_url})
+
+    def payload():
+        return dict(job.serialize(), href=file_url)
+
+    if request.accept_mimetypes.best == "text/event-stream":
+
+        def events():
+            yield f"event: status\ndata: {json.dumps(payload())}\n\n"
+            deadline = time.monotonic() + STREAM_MAX_SECONDS
+            while not job.done.wait(max(0, min(MAX_WAIT, deadline - time.monotonic()))):
+                # A job that never finishes mustn't keep the thread forever
+                if time.monotonic() >= deadline or jobs.get(job.id) is not job:
+                    yield f"event: timeout\ndata: {json.dumps(payload())}\n\n"
+                    return
+                # Keeps proxies from closing the idle connection
+                yield ": waiting\n\n"
+            yield f"event: status\ndata: {json.dumps(payload())}\n\n"
+
+        return Response(
+            events(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    wait = request.args.get("wait", 0, type=float)
+    if wait > 0:
+        job.done.wait(min(wait, MAX_WAIT))
+    return jsonify(payload())
+
+
+@app.route("/cache/", methods=["GET"])
+def cache_stats():
+    """
+    Route to report the hits, misses and size of the audio and weather caches.
+    """
+    return jsonify(dict(audio_cache.stats(), weather=weather_cache.stats()))
+
+
+@app.route("/models/", methods=["GET"])
+def models():
+    """
+    Route to report the resident TTS models and the memory use of each
+    worker, as of the last request the worker processed.
+    """
+    return jsonify({"workers": pool.memory_reports()})
+
+
+@app.route("/status/", methods=["GET"])
+def status():
+    """
+    Route to report the queue depth, the wait and synthesis times and the
+    counters of the workers.
+    """
+    return jsonify(pool.status())
 
 
 if __name__ == "__main__":
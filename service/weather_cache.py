@@ -0,0 +1,112 @@
+"""
+This module contains the cache of the formatted weather texts.
+- WeatherCache: Maps a location to its weather text of the current hour
+
+The bikinghub API serves the forecast nearest to the current time, so the
+text of a location stays the same within an hour. An entry is fresh for
+TTS_WEATHER_TTL seconds but not past the end of its hour. A stale entry
+keeps the ETag of its response, if the API sent one, so it can be
+revalidated with a conditional request instead of fetched again.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+WEATHER_TTL = int(os.environ.get("TTS_WEATHER_TTL", 300))
+MAX_ENTRIES = 1024
+
+
+class _Entry:
+
+    def __init__(self, text, etag, hour, expires):
+        self.text = text
+        self.etag = etag
+        self.hour = hour
+        self.expires = expires
+
+
+def _hour(now):
+    return int(now // 3600)
+
+
+class WeatherCache:
+    """
+    Weather texts by location id, least recently used first out
+    """
+
+    def __init__(self, ttl=WEATHER_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires(self, now):
+        return min(now + self.ttl, (_hour(now) + 1) * 3600)
+
+    def get(self, location_id):
+        """
+        Returns the fresh text of the location or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(location_id)
+            if entry is not None and entry.hour == _hour(now) and now < entry.expires:
+                self._entries.move_to_end(location_id)
+                self.hits += 1
+                return entry.text
+            self.misses += 1
+            return None
+
+    def etag(self, location_id):
+        """
+        Returns the ETag of the location's stale entry or None
+        """
+        with self._lock:
+            entry = self._entries.get(location_id)
+            return entry.etag if entry is not None else None
+
+    def revalidate(self, location_id):
+        """
+        Marks the stale entry fresh again after the API answered 304 and
+        returns its text
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(location_id)
+            if entry is None:
+                return None
+            entry.hour = _hour(now)
+            entry.expires = self._expires(now)
+            self._entries.move_to_end(location_id)
+            self.revalidations += 1
+            return entry.text
+
+    def put(self, location_id, text, etag=None):
+        """
+        Stores the text of the location and the ETag of its response
+        """
+        now = time.time()
+        with self._lock:
+            self._entries[location_id] = _Entry(
+                text, etag, _hour(now), self._expires(now)
+            )
+            self._entries.move_to_end(location_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the counters and the size of the cache
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "entries": len(self._entries),
+            }
@@ -14,4 +14,7 @@ setup(
         "jsonschema",
         "requests",
     ],
+    extras_require={
+        "fast": ["orjson", "brotli"],
+    },
 )
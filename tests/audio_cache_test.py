@@ -0,0 +1,79 @@
+"""
+This module contains tests for the audio cache of the TTS service.
+"""
+
+import os
+from audio_cache import AudioCache
+import synthesis
+
+MODEL = "tts_models/en/ljspeech/vits"
+
+
+def _generate(cache, filename, data):
+    with open(cache.temporary_path(filename), "wb") as fp:
+        fp.write(data)
+    cache.store(filename)
+
+
+def test_audio_cache_filename():
+    """
+    Test that the texts that are spoken the same share a file and that the
+    models don't
+    """
+    name = AudioCache.filename(MODEL, "Café  is\n open. ")
+    assert name.endswith(".wav")
+    assert name == AudioCache.filename(MODEL, "Café is open.")
+    assert name != AudioCache.filename(MODEL, "Cafe is open.")
+    assert name != AudioCache.filename(synthesis.DEFAULT_MODEL, "Café is open.")
+
+
+def test_audio_cache_store(tmp_path):
+    """
+    Test that a file is generated once at a time and is in the cache after
+    it has been stored
+    """
+    cache = AudioCache(str(tmp_path), max_bytes=100)
+    name = AudioCache.filename(MODEL, "Hello.")
+    assert not cache.lookup(name)
+    assert cache.reserve(name)
+    assert not cache.reserve(name)
+    cache.release(name)
+    assert cache.reserve(name)
+
+    _generate(cache, name, b"x" * 10)
+    assert cache.lookup(name)
+    assert not os.path.exists(cache.temporary_path(name))
+    assert cache.reserve(name)
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["files"] == 1
+    assert stats["bytes"] == 10
+
+    # The files in the directory are indexed on startup
+    assert AudioCache(str(tmp_path)).lookup(name)
+
+
+def test_audio_cache_eviction(tmp_path):
+    """
+    Test that the least recently used file is evicted with its variants
+    """
+    cache = AudioCache(str(tmp_path), max_bytes=25)
+    first, second, third = (
+        AudioCache.filename(MODEL, text) for text in ("One.", "Two.", "Three.")
+    )
+    _generate(cache, first, b"x" * 10)
+    _generate(cache, second, b"x" * 10)
+    (tmp_path / second.replace(".wav", ".ogg")).write_bytes(b"x")
+    (tmp_path / second.replace(".wav", ".mp3")).write_bytes(b"x")
+    assert cache.lookup(first)
+
+    _generate(cache, third, b"x" * 10)
+    assert sorted(os.listdir(tmp_path)) == sorted([first, third])
+    assert not cache.lookup(second)
+    assert cache.stats()["evictions"] == 1
+
+    # The newest file is kept even if it's larger than the cache
+    big = AudioCache.filename(MODEL, "Four.")
+    _generate(cache, big, b"x" * 30)
+    assert os.listdir(tmp_path) == [big]
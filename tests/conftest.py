@@ -1,4 +1,5 @@
 import os
+import sys
 import tempfile
 from datetime import datetime
 import pytest
@@ -6,6 +7,9 @@ import uuid
 from bikinghub.models import User, Favourite, Location, WeatherData, AuthenticationKey
 from bikinghub import create_app, db
 
+# The TTS service modules are imported by plain name, as the service does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "service"))
+
 
 @pytest.fixture
 def client():
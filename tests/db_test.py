@@ -5,17 +5,21 @@ and validation of database models User, Favourite, Location, and WeatherData.
 
 import pytest
 import uuid
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError, StatementError
 from sqlalchemy.dialects.postgresql import UUID
 from conftest import populate_db
-from bikinghub import db
+from bikinghub import create_app, db
 from bikinghub.models import (
     User,
     Favourite,
     Location,
     WeatherData,
     AuthenticationKey,
+    TrafficData,
 )
+from bikinghub.migrations import backfill, current_version, upgrade, HEAD
+from bikinghub.synthetic import generate, PASSWORD
 
 # @event.listens_for(Engine, "connect")
 # def set_sqlite_pragma(dbapi_connection, connection_record):
@@ -208,3 +212,144 @@ def test_weather_data_columns(client):
         db.session.add(weather_data)
         with pytest.raises(StatementError):
             db.session.commit()
+
+
+def test_production_profile(tmp_path):
+    """
+    Test that the production database profile enables WAL mode and the
+    tuned PRAGMAs on every connection
+    """
+    db_fname = tmp_path / "production.db"
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}",
+            "DATABASE_PROFILE": "production",
+            "SQLITE_PRAGMAS": {"busy_timeout": 2000},
+        }
+    )
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 2000
+        assert db.engine.pool.size() == 8
+        db.engine.dispose()
+
+
+def test_read_replica(tmp_path):
+    """
+    Test that GET requests read from the replica while writes, other methods
+    and reads after a flush use the primary database
+    """
+    primary_fname = tmp_path / "primary.db"
+    replica_fname = tmp_path / "replica.db"
+    # Create the schema in the replica, its tables stay empty
+    create_app(
+        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{replica_fname}"}
+    )
+
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{primary_fname}",
+            "SQLALCHEMY_READ_URI": f"sqlite:///file:{replica_fname}?mode=ro&uri=true",
+            "CONVERTER_CACHE_TTL": 0,
+        }
+    )
+    with app.app_context():
+        populate_db(db)
+        db.session.remove()
+
+        with app.test_request_context("/api/locations/", method="GET"):
+            assert Location.query.count() == 0
+        db.session.remove()
+
+        with app.test_request_context("/api/locations/", method="POST"):
+            assert Location.query.count() == 4
+        db.session.remove()
+
+        with app.test_request_context("/api/locations/1/weather/", method="GET"):
+            db.session.add(Location(name="new", latitude=60, longitude=25))
+            db.session.flush()
+            assert Location.query.count() == 5
+            db.session.rollback()
+        db.session.remove()
+
+        # The replica is read-only and the app never writes to it
+        test_client = app.test_client()
+        assert test_client.get("/api/locations/1/").status_code == 404
+        assert (
+            test_client.put(
+                "/api/locations/1/",
+                json={"name": "renamed", "latitude": 65.0, "longitude": 25.4},
+            ).status_code
+            == 204
+        )
+
+        db.engine.dispose()
+        app.extensions["bikinghub_read_engine"].dispose()
+
+
+def test_schema_version(client):
+    """
+    Test that a new database is stamped with the latest schema version and
+    that startup leaves the schema to the migrations once a version is
+    recorded
+    """
+    with client.app_context():
+        assert current_version() == HEAD
+        TrafficData.__table__.drop(bind=db.engine)
+        config = {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": client.config["SQLALCHEMY_DATABASE_URI"],
+        }
+        create_app(config)
+        assert not inspect(db.engine).has_table("traffic_data")
+
+        # Upgrading an up to date database does nothing
+        assert upgrade() == []
+
+
+def test_backfill(client):
+    """
+    Test that backfill updates every matching row in batches
+    """
+    with client.app_context():
+        populate_db(db)
+        table = Location.__table__
+        updated = backfill(
+            table, {"name": "renamed"}, table.c.name != "renamed", batch_size=3
+        )
+        assert updated == 4
+        assert Location.query.filter_by(name="renamed").count() == 4
+
+
+def test_synthetic_data(client, tmp_path):
+    """
+    Test that the synthetic data is generated at the requested scale, is the
+    same for the same seed and that the users can log in
+    """
+    with client.app_context():
+        counts = generate(20, seed=1, weather_hours=24)
+        assert counts["users"] == User.query.count() == 20
+        assert counts["locations"] == Location.query.count() == 2
+        assert counts["weather_data"] == WeatherData.query.count() == 48
+        assert counts["favourites"] == Favourite.query.count()
+        assert AuthenticationKey.query.filter_by(admin=True).count() == 1
+        first = [(l.name, l.latitude) for l in Location.query.order_by(Location.id)]
+
+        resp = client.test_client().post(
+            "/api/login/", json={"name": "user20", "password": PASSWORD}
+        )
+        assert resp.status_code == 200
+
+    db_fname = tmp_path / "synthetic.db"
+    app = create_app(
+        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}"}
+    )
+    with app.app_context():
+        generate(20, seed=1, weather_hours=24)
+        second = [(l.name, l.latitude) for l in Location.query.order_by(Location.id)]
+        assert first == second
+        db.engine.dispose()
@@ -0,0 +1,64 @@
+"""
+This module contains tests for the JSON encoding of the responses.
+"""
+
+import importlib
+import json
+import sys
+from datetime import date, datetime
+import pytest
+from bikinghub import encoding
+from bikinghub.utils import MasonBuilder
+
+
+@pytest.fixture
+def fallback(monkeypatch):
+    """
+    Reloads the encoding module without orjson and restores it afterwards
+    """
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    yield importlib.reload(encoding)
+    monkeypatch.undo()
+    importlib.reload(encoding)
+
+
+def test_fallback_matches_fast_encoder(monkeypatch):
+    """
+    Test that the standard library fallback produces the same compact output
+    as the fast encoder, datetimes included
+    """
+    orjson = pytest.importorskip("orjson")
+    body = MasonBuilder(name="location1", latitude=65.05, weather_time=None)
+    body["weather_time"] = datetime(2024, 4, 1, 12, 0)
+    body.add_control("self", href="/api/locations/1/")
+
+    fast = orjson.dumps(body)
+
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    fallback_encoding = importlib.reload(encoding)
+    try:
+        assert fallback_encoding.ENCODER == "json"
+        assert fallback_encoding.dumps(body) == fast
+        assert json.loads(fast)["weather_time"] == "2024-04-01T12:00:00"
+    finally:
+        monkeypatch.undo()
+        importlib.reload(encoding)
+
+
+def test_fallback_output(fallback):
+    """
+    Test that the standard library fallback writes compact UTF-8 JSON with
+    the dates and datetimes as ISO 8601 strings
+    """
+    assert fallback.ENCODER == "json"
+    body = MasonBuilder(name="Äänekoski", latitude=62.6, rain=None, admin=False)
+    body["weather_time"] = datetime(2024, 4, 1, 12, 30, 5)
+    body["day"] = date(2024, 4, 1)
+    body["items"] = [1, 2.5]
+    assert fallback.dumps(body) == (
+        '{"name":"Äänekoski","latitude":62.6,"rain":null,"admin":false,'
+        '"weather_time":"2024-04-01T12:30:05","day":"2024-04-01","items":[1,2.5]}'
+    ).encode("utf-8")
+
+    with pytest.raises(TypeError):
+        fallback.dumps({"key": object()})
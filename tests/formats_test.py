@@ -0,0 +1,46 @@
+"""
+This module contains tests for the audio format negotiation of the TTS
+service.
+"""
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import formats
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("", formats.WAV),
+        ("*/*", formats.WAV),
+        ("audio/*", formats.WAV),
+        ("application/json", formats.WAV),
+        ("audio/wav", formats.WAV),
+        ("audio/ogg", "audio/ogg"),
+        ("audio/mpeg", "audio/mpeg"),
+        ("audio/mpeg, audio/ogg", "audio/ogg"),
+        ("audio/mpeg, audio/ogg;q=0.5", "audio/mpeg"),
+        ("audio/ogg, audio/wav", "audio/ogg"),
+        ("audio/ogg;q=0.5, audio/wav", formats.WAV),
+        ("audio/ogg;q=0.5, */*", formats.WAV),
+        ("audio/ogg, */*;q=0.1", "audio/ogg"),
+    ],
+)
+def test_negotiate(monkeypatch, accept, expected):
+    """
+    Test that a compressed format is only served if it's listed explicitly
+    """
+    monkeypatch.setattr(formats, "_encoders", lambda: {"libopus", "libmp3lame"})
+    accept_mimetypes = parse_accept_header(accept, MIMEAccept)
+    assert formats.negotiate(accept_mimetypes) == expected
+
+
+def test_negotiate_without_encoders(monkeypatch):
+    """
+    Test that WAV is served without ffmpeg
+    """
+    monkeypatch.setattr(formats, "_encoders", frozenset)
+    assert formats.available() == [formats.WAV]
+    accept_mimetypes = parse_accept_header("audio/ogg", MIMEAccept)
+    assert formats.negotiate(accept_mimetypes) == formats.WAV
@@ -0,0 +1,83 @@
+"""
+This module contains tests for the bulk location import.
+"""
+
+import json
+import pytest
+from conftest import populate_db
+from bikinghub import db
+from bikinghub import importer
+from bikinghub.importer import (
+    GridIndex,
+    import_locations,
+    import_locations_command,
+    read_csv,
+    read_geojson,
+)
+from bikinghub.models import Location
+
+
+def _feature(name, lat, lon):
+    return {
+        "type": "Feature",
+        "properties": {"name": name},
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+    }
+
+
+def test_grid_index():
+    """
+    Test that the grid index finds points within the distance only
+    """
+    index = GridIndex(0.05)
+    index.add(65.0, 25.4)
+    assert index.near(65.0002, 25.4004)
+    assert not index.near(65.001, 25.4)
+    # Points close to each other on both sides of a cell border
+    index.add(0.0, -0.0000001)
+    assert index.near(0.0, 0.0000001)
+    assert len(index) == 2
+
+
+def test_read_geojson(tmp_path, monkeypatch):
+    """
+    Test that the GeoJSON reader streams features across chunk borders
+    """
+    monkeypatch.setattr(importer, "CHUNK_SIZE", 16)
+    path = tmp_path / "stations.geojson"
+    features = [_feature(f"station{i}", 65 + i / 100, 25.4) for i in range(20)]
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    locations = list(read_geojson(path))
+    assert len(locations) == 20
+    assert locations[3] == {"name": "station3", "latitude": 65.03, "longitude": 25.4}
+
+
+@pytest.mark.usefixtures("client")
+def test_import_locations(client, tmp_path):
+    """
+    Test that the import skips duplicates and invalid rows, inserts the rest
+    and that a dry run inserts nothing
+    """
+    path = tmp_path / "stations.csv"
+    path.write_text(
+        "name,lat,lon\n"
+        "station1,65.1,25.1\n"
+        "station2,65.2,25.2\n"
+        "copy of station2,65.2001,25.2001\n"
+        "location1,65.05785284617326,25.468937083629477\n"
+        "broken,north,25.3\n"
+    )
+    with client.app_context():
+        populate_db(db)
+
+        stats = import_locations(read_csv(path), dry_run=True)
+        assert stats == {"read": 5, "inserted": 2, "duplicates": 2, "invalid": 1}
+        assert Location.query.count() == 4
+
+        result = client.test_cli_runner().invoke(
+            import_locations_command, [str(path), "--batch-size", "1"]
+        )
+        assert result.exit_code == 0, result.output
+        assert "2 inserted, 2 duplicates, 1 invalid" in result.output
+        assert Location.query.count() == 6
+        assert Location.query.filter_by(name="station2").first().latitude == 65.2
@@ -0,0 +1,108 @@
+"""
+This module contains tests for the Server-Timing headers and the /metrics
+endpoint.
+"""
+
+import pytest
+from flask import g
+from benchmarks.upstream import UpstreamServer
+from conftest import populate_db
+from bikinghub import create_app, db, cache
+
+
+def _server_timing(resp):
+    return dict(
+        entry.strip().split(";", 1)
+        for entry in resp.headers["Server-Timing"].split(",")
+    )
+
+
+@pytest.mark.usefixtures("client")
+def test_server_timing(client):
+    """
+    Test that requests report their query count, cache result and wall time
+    and that the counters are served at /metrics
+    """
+    with client.app_context():
+        populate_db(db)
+        cache.clear()
+        test_client = client.test_client()
+
+        resp = test_client.get("/api/locations/")
+        timing = _server_timing(resp)
+        assert timing["cache"] == "desc=miss"
+        assert timing["db"].startswith('desc="1 queries"')
+        assert "app" in timing
+        assert "hit_cache" not in resp.headers
+
+        resp = test_client.get("/api/locations/")
+        timing = _server_timing(resp)
+        assert timing["cache"] == "desc=hit"
+        assert timing["db"].startswith('desc="0 queries"')
+
+        resp = test_client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        text = resp.get_data(as_text=True)
+        assert (
+            'bikinghub_requests_total{endpoint="api.locationcollection",'
+            'method="GET",status="200"} 2'
+        ) in text
+        assert (
+            'bikinghub_cache_requests_total{endpoint="api.locationcollection",'
+            'result="hit"} 1'
+        ) in text
+        assert (
+            'bikinghub_request_duration_seconds_count{endpoint="api.locationcollection",'
+            'method="GET"} 2'
+        ) in text
+
+
+def test_upstream_timing(tmp_path):
+    """
+    Test that the time spent on FMI and MML is reported
+    """
+    db_fname = tmp_path / "instrumentation.db"
+    with UpstreamServer(latency=5) as server:
+        app = create_app(
+            {
+                "TESTING": True,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}",
+                **server.app_config(),
+            }
+        )
+        with app.app_context():
+            populate_db(db)
+            test_client = app.test_client()
+            resp = test_client.get("/api/locations/4/weather/")
+            assert _server_timing(resp)["upstream"].startswith('desc="3 requests"')
+            text = test_client.get("/metrics").get_data(as_text=True)
+            assert 'bikinghub_upstream_requests_total{upstream="mml"} 2' in text
+            assert 'bikinghub_upstream_requests_total{upstream="fmi"} 1' in text
+            db.engine.dispose()
+
+
+def test_instrumentation_disabled(tmp_path):
+    """
+    Test that INSTRUMENTATION = False removes the header and /metrics
+    """
+    db_fname = tmp_path / "instrumentation.db"
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}",
+            "INSTRUMENTATION": False,
+        }
+    )
+    test_client = app.test_client()
+    assert "Server-Timing" not in test_client.get("/api/").headers
+    assert test_client.get("/metrics").status_code == 404
+    with app.app_context():
+        db.create_all()
+        populate_db(db)
+        cache.clear()
+        for _ in range(2):
+            resp = test_client.get("/api/locations/")
+            assert resp.status_code == 200
+            assert "hit_cache" not in resp.headers
+        assert "flask_caching_hit_cache" not in g
@@ -0,0 +1,52 @@
+"""
+This module contains tests for the job registry of the TTS service.
+"""
+
+import threading
+from types import SimpleNamespace
+import jobs
+
+
+def _clock(monkeypatch, module, now):
+    clock = SimpleNamespace(now=now)
+    monkeypatch.setattr(module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_jobs(monkeypatch):
+    """
+    Test the status of a job, its done event and that finished jobs are
+    forgotten after the TTL
+    """
+    clock = _clock(monkeypatch, jobs, 1000.0)
+    registry = jobs.JobRegistry(ttl=10)
+    job = registry.create("abc.wav")
+    assert job.id == "abc"
+    assert registry.get("abc") is job
+    assert job.serialize()["status"] == jobs.QUEUED
+    registry.start("abc.wav")
+    assert job.status == jobs.RUNNING
+
+    threading.Timer(0.05, registry.finish, args=("abc.wav",)).start()
+    assert job.done.wait(5)
+    assert job.serialize()["status"] == jobs.DONE
+    assert job.finished == 1000.0
+
+    failed = registry.create("def.wav")
+    registry.finish("def.wav", RuntimeError("out of memory"))
+    assert failed.done.is_set()
+    assert failed.serialize()["status"] == jobs.FAILED
+    assert failed.serialize()["error"] == "out of memory"
+    # Unknown jobs are ignored
+    registry.start("unknown.wav")
+    registry.finish("unknown.wav")
+
+    queued = registry.create("ghi.wav")
+    clock.now = 1005.0
+    registry.create("jkl.wav")
+    assert registry.get("abc") is job
+    clock.now = 1011.0
+    registry.create("mno.wav")
+    assert registry.get("abc") is None
+    assert registry.get("def") is None
+    assert registry.get("ghi") is queued
@@ -0,0 +1,68 @@
+"""
+This module contains tests for the logging setup.
+"""
+
+import logging
+import pytest
+from conftest import populate_db
+from bikinghub import db, log
+from bikinghub.log import KeyValueFormatter, sampled
+
+ADMIN_KEY = "ptKGKz3qINsn-pTIw7nBcsKCsKPlrsEsCkxj38lDpH4"
+
+
+def test_key_value_formatter():
+    """
+    Test that records are formatted as key=value pairs with their extra
+    fields and that values with spaces are quoted
+    """
+    record = logging.makeLogRecord(
+        {
+            "name": "bikinghub.test",
+            "levelname": "INFO",
+            "msg": "Imported %d rows",
+            "args": (3,),
+            "source": "stations.csv",
+        }
+    )
+    line = KeyValueFormatter().format(record)
+    assert 'level=INFO logger=bikinghub.test msg="Imported 3 rows"' in line
+    assert line.endswith("source=stations.csv")
+
+
+def test_sampled(caplog, monkeypatch):
+    """
+    Test that sampled events are logged for the configured share of calls
+    and only if debug is enabled
+    """
+    logger = logging.getLogger("bikinghub.test")
+    caplog.set_level(logging.DEBUG, logger="bikinghub")
+    monkeypatch.setattr(log, "_sample_rate", 0.0)
+    sampled(logger, "item %s", 1)
+    assert not caplog.records
+
+    monkeypatch.setattr(log, "_sample_rate", 1.0)
+    sampled(logger, "item %s", 2)
+    assert [r.getMessage() for r in caplog.records] == ["item 2"]
+
+    caplog.set_level(logging.INFO, logger="bikinghub")
+    sampled(logger, "item %s", 3)
+    assert len(caplog.records) == 1
+
+
+@pytest.mark.usefixtures("client")
+def test_api_key_not_logged(client, caplog):
+    """
+    Test that admin checks are logged without the api key
+    """
+    with client.app_context():
+        populate_db(db)
+        caplog.set_level(logging.DEBUG, logger="bikinghub")
+        test_client = client.test_client()
+        test_client.get("/api/users/", headers={"Bikinghub-Api-Key": ADMIN_KEY})
+        test_client.get("/api/users/", headers={"Bikinghub-Api-Key": "wrong-key"})
+        messages = [record.getMessage() for record in caplog.records]
+        assert any("Admin key" in message for message in messages)
+        assert any("Admin check failed" in message for message in messages)
+        assert not any(ADMIN_KEY in message for message in messages)
+        assert not any("wrong-key" in message for message in messages)
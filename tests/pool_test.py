@@ -0,0 +1,116 @@
+"""
+This module contains tests for the synthesis pool of the TTS service that
+don't need the TTS models.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+import synthesis
+from pool import SynthesisPool
+
+MODEL = "tts_models/en/ljspeech/vits"
+
+
+def test_pool_queue_full():
+    """
+    Test that a full queue rejects requests and estimates the wait
+    """
+    pool = SynthesisPool(lambda filename, error: None, workers=0, queue_size=2)
+    assert pool.retry_after() == 1
+    assert pool.submit("One.", "a.wav", "static/a.wav")
+    assert pool.submit("Two.", "b.wav", "static/b.wav")
+    assert not pool.submit("Three.", "c.wav", "static/c.wav")
+    assert pool.status()["rejected"] == 1
+    assert pool.status()["queue_depth"] == 2
+    assert pool.retry_after() == 3
+
+    pool._durations.extend([2.0, 4.0])  # pylint: disable=protected-access
+    assert pool.retry_after() == 9
+
+
+def test_pool_collect():
+    """
+    Test that the queued requests are collected up to the batch size
+    """
+    pool = SynthesisPool(
+        lambda filename, error: None, workers=0, batch_size=3, batch_wait=0.01
+    )
+    for i in range(5):
+        pool.submit(f"Text {i}.", f"{i}.wav", f"static/{i}.wav")
+    # pylint: disable=protected-access
+    assert [item[2] for item in pool._collect()] == ["0.wav", "1.wav", "2.wav"]
+    assert [item[2] for item in pool._collect()] == ["3.wav", "4.wav"]
+
+
+def test_pool_batches(monkeypatch):
+    """
+    Test that a batch is synthesized in one call per model and that every
+    request is reported started and done
+    """
+    calls = []
+
+    def synthesize_batch(texts, filepaths, model):
+        calls.append((model, texts, filepaths))
+        errors = ["failed" if text == "Fail." else None for text in texts]
+        return errors, {"pid": os.getpid()}
+
+    monkeypatch.setattr(synthesis, "synthesize_batch", synthesize_batch)
+    monkeypatch.setattr(synthesis.registry, "warm_up", lambda: None)
+    started = []
+    done = {}
+    finished = threading.Event()
+
+    def on_done(filename, error):
+        done[filename] = error
+        if len(done) == 4:
+            finished.set()
+
+    pool = SynthesisPool(
+        on_done, on_start=started.append, workers=0, batch_size=8, batch_wait=0.5
+    )
+    pool.submit("One.", "a.wav", "static/a.wav", MODEL)
+    pool.submit("Two.", "b.wav", "static/b.wav", synthesis.DEFAULT_MODEL)
+    pool.submit("Fail.", "c.wav", "static/c.wav", MODEL)
+    pool.submit("Four.", "d.wav", "static/d.wav", MODEL)
+    pool.start()
+    assert finished.wait(5)
+
+    assert {model: (texts, filepaths) for model, texts, filepaths in calls} == {
+        MODEL: (
+            ["One.", "Fail.", "Four."],
+            ["static/a.wav", "static/c.wav", "static/d.wav"],
+        ),
+        synthesis.DEFAULT_MODEL: (["Two."], ["static/b.wav"]),
+    }
+    assert len(calls) == 2
+    assert sorted(started) == ["a.wav", "b.wav", "c.wav", "d.wav"]
+    assert done == {"a.wav": None, "b.wav": None, "c.wav": "failed", "d.wav": None}
+    status = pool.status()
+    assert status["batches"] == 1
+    assert status["processed"] == 3
+    assert status["failed"] == 1
+    assert status["busy"] == 0
+    assert pool.memory_reports() == [{"pid": os.getpid()}]
+
+
+def test_pool_restart(monkeypatch):
+    """
+    Test that a broken executor is replaced once
+    """
+    pool = SynthesisPool(lambda filename, error: None, workers=1)
+    monkeypatch.setattr(pool, "_new_executor", lambda: ProcessPoolExecutor(1))
+    pool.executor = broken = pool._new_executor()  # pylint: disable=protected-access
+    try:
+        with pytest.raises(BrokenProcessPool):
+            pool._run(os._exit, 1)  # pylint: disable=protected-access
+        assert pool.executor is not broken
+        assert pool.status()["restarts"] == 1
+        pool._restart(broken)  # pylint: disable=protected-access
+        assert pool.status()["restarts"] == 1
+        assert pool._run(time.time) > 0  # pylint: disable=protected-access
+    finally:
+        pool.executor.shutdown()
@@ -0,0 +1,85 @@
+"""
+This module contains tests for the request profiler.
+"""
+
+import os
+import sys
+import pytest
+from conftest import populate_db
+from bikinghub import db
+from bikinghub.profiling import profiles_command, profile_path
+
+ADMIN_KEY = "ptKGKz3qINsn-pTIw7nBcsKCsKPlrsEsCkxj38lDpH4"
+USER_KEY = "4N3hKWUlFGhBNUxps-jENUVNeqkbetMdr0Bi9qnCcm0"
+
+
+@pytest.mark.usefixtures("client")
+def test_profile_header(client, tmp_path):
+    """
+    Test that only admins can request a profile and that the profiles are
+    stored, pruned and summarized
+    """
+    client.config["PROFILE_DIR"] = str(tmp_path)
+    client.config["PROFILE_KEEP"] = 2
+    with client.app_context():
+        populate_db(db)
+        test_client = client.test_client()
+
+        resp = test_client.get("/api/locations/", headers={"Bikinghub-Profile": "1"})
+        assert "Bikinghub-Profile" not in resp.headers
+        resp = test_client.get(
+            "/api/locations/",
+            headers={"Bikinghub-Profile": "1", "Bikinghub-Api-Key": USER_KEY},
+        )
+        assert "Bikinghub-Profile" not in resp.headers
+        assert not os.listdir(tmp_path)
+
+        names = []
+        for _ in range(3):
+            resp = test_client.get(
+                "/api/locations/",
+                headers={"Bikinghub-Profile": "1", "Bikinghub-Api-Key": ADMIN_KEY},
+            )
+            assert resp.status_code == 200
+            names.append(resp.headers["Bikinghub-Profile"])
+        assert names[0].endswith("-GET-api_locationcollection.prof")
+        assert sorted(os.listdir(profile_path(client))) == names[1:]
+
+        result = client.test_cli_runner().invoke(profiles_command, ["--top", "5"])
+        assert result.exit_code == 0, result.output
+        assert names[2] in result.output
+        assert "cumulative" in result.output
+
+
+@pytest.mark.usefixtures("client")
+def test_profile_requests(client, tmp_path):
+    """
+    Test that PROFILE_REQUESTS profiles every request
+    """
+    client.config["PROFILE_DIR"] = str(tmp_path)
+    client.config["PROFILE_REQUESTS"] = True
+    resp = client.test_client().get("/api/")
+    assert resp.headers["Bikinghub-Profile"] in os.listdir(tmp_path)
+
+
+@pytest.mark.usefixtures("client")
+def test_profile_exception(client, tmp_path):
+    """
+    Test that the profiler is disabled when an exception propagates past the
+    after_request hooks
+    """
+    client.config["PROFILE_DIR"] = str(tmp_path)
+    client.config["PROFILE_REQUESTS"] = True
+
+    @client.route("/fail/")
+    def fail():
+        raise RuntimeError("fail")
+
+    with pytest.raises(RuntimeError):
+        client.test_client().get("/fail/")
+    assert sys.getprofile() is None
+    assert not os.listdir(tmp_path)
+
+    resp = client.test_client().get("/api/")
+    assert resp.headers["Bikinghub-Profile"] in os.listdir(tmp_path)
+    assert sys.getprofile() is None
@@ -0,0 +1,93 @@
+"""
+This module runs EXPLAIN QUERY PLAN on the hot queries of the API and fails
+if SQLite would answer any of them with a full table scan.
+"""
+
+import pytest
+from sqlalchemy import func, select, text
+from bikinghub import db
+from bikinghub.models import (
+    User,
+    Favourite,
+    Comment,
+    Location,
+    WeatherData,
+    TrafficData,
+    AuthenticationKey,
+)
+from bikinghub.migrations import schema_version, upgrade, current_version, HEAD
+
+HOT_QUERIES = {
+    # URL converters and authentication
+    "user by name": select(User).filter_by(name="user1"),
+    "location by id": select(Location).filter_by(id=1),
+    "favourite by id": select(Favourite).filter_by(id=1),
+    "admin key": select(AuthenticationKey).filter_by(admin=True, key="key"),
+    "api key": select(AuthenticationKey).filter_by(key="key"),
+    # Collections and items
+    "favourites page": select(Favourite)
+    .filter_by(user_id=1)
+    .order_by(Favourite.location_id)
+    .offset(50)
+    .limit(50),
+    "favourite of user": select(Favourite).filter_by(user_id=1, id=1),
+    "closest weather": select(WeatherData)
+    .filter_by(location_id=1)
+    .order_by(func.abs(WeatherData.weather_time - func.now()))
+    .limit(1),
+    "nearby locations": select(Location).filter(
+        Location.latitude.between(65.0, 65.1),
+        Location.longitude.between(25.4, 25.5),
+    ),
+    # Relationship loads and cascades on delete
+    "favourites of user": select(Favourite).filter_by(user_id=1),
+    "favourites of location": select(Favourite).filter_by(location_id=1),
+    "comments of user": select(Comment).filter_by(user_id=1),
+    "comments of location": select(Comment).filter_by(location_id=1),
+    "weather of location": select(WeatherData).filter_by(location_id=1),
+    "traffic of location": select(TrafficData).filter_by(location_id=1),
+    "api keys of user": select(AuthenticationKey).filter_by(user_id=1),
+}
+
+
+def _query_plan(statement):
+    sql = statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.usefixtures("client")
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_no_full_scan(client, name):
+    """
+    Test that the query searches an index instead of scanning a table
+    """
+    with client.app_context():
+        plan = _query_plan(HOT_QUERIES[name])
+        scans = [detail for detail in plan if detail.startswith("SCAN")]
+        assert not scans, f"{name}: {plan}"
+
+
+@pytest.mark.usefixtures("client")
+def test_upgrade_legacy_database(client):
+    """
+    Test that upgrading a database created before migrations without the
+    indexes adds them
+    """
+    with client.app_context():
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(bind=db.engine)
+        schema_version.drop(bind=db.engine)
+        assert _query_plan(HOT_QUERIES["favourites of location"])[0].startswith("SCAN")
+
+        db.session.rollback()
+
+        assert [migration.version for migration in upgrade()] == [2]
+        assert upgrade() == []
+        assert current_version() == HEAD
+        assert not _query_plan(HOT_QUERIES["favourites of location"])[0].startswith(
+            "SCAN"
+        )
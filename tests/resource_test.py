@@ -4,15 +4,18 @@ Test are besed on http://flask.pocoo.org/en/3.0.x/testing/
 and course materials are used for guidance.
 """
 
+import gzip
 import json
 import pytest
 from conftest import populate_db
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
-from bikinghub import db
+from bikinghub import db, cache
 from bikinghub.constants import MASON_CONTENT, JSON_CONTENT, LINK_RELATIONS_URL
-from jsonschema import validate
-from bikinghub.utils import SECRETS
+from flask import url_for
+from jsonschema import ValidationError, validate
+from bikinghub.models import User, Location, Favourite
+from bikinghub.utils import SECRETS, BodyBuilder, get_validator
 
 
 @event.listens_for(Engine, "connect")
@@ -447,6 +450,40 @@ class TestLocationCollection(object):
             assert resp.status_code == 405
 
 
+@pytest.mark.usefixtures("client")
+class TestLocationBatch:
+    """
+    This class contains tests for the LocationBatch resource.
+    """
+
+    URL = "/api/locations/batch/"
+
+    def test_post(self, client):
+        """
+        Test the POST method for the LocationBatch resource.
+        """
+        with client.app_context():
+            test_client = client.test_client()
+            populate_db(db)
+
+            data = json.loads(test_client.get("/api/locations/").data)
+            assert "bikinghub:location-batch" in data["@controls"]
+
+            existing = _get_location_json(2)
+            existing.update(latitude=65.05785284617326, longitude=25.468937083629477)
+            duplicate = _get_location_json(3)
+            duplicate["latitude"] += 0.0001
+            batch = [_get_location_json(1), existing, duplicate, {"name": "x"}]
+            resp = test_client.post(self.URL, json=batch)
+            assert resp.status_code == 207
+            items = json.loads(resp.data)["items"]
+            assert [item["status"] for item in items] == [201, 409, 409, 400]
+            assert Location.query.count() == 5
+
+            data = json.loads(test_client.get("/api/locations/").data)
+            assert len(data["items"]) == 5
+
+
 @pytest.mark.usefixtures("client")
 class TestLocationItem(object):
     """
@@ -724,6 +761,57 @@ class TestFavouriteCollection:
             assert resp.status_code == 405
 
 
+@pytest.mark.usefixtures("client")
+class TestFavouriteBatch:
+    """
+    This class contains tests for the FavouriteBatch resource.
+    """
+
+    COLLECTION_URL = "/api/users/user37722c77-8004-41d7-993f-ef4f24356ce3/favourites/"
+    URL = COLLECTION_URL + "batch/"
+
+    def test_post(self, client):
+        """
+        Test the POST method for the FavouriteBatch resource.
+        """
+        with client.app_context():
+            test_client = client.test_client()
+            populate_db(db)
+
+            # The collection links to the batch resource
+            data = json.loads(test_client.get(self.COLLECTION_URL).data)
+            batch = [_get_favourite_json(1), _get_favourite_json(2)]
+            check_control_post_method(
+                test_client, "bikinghub:favourite-batch", data, batch
+            )
+
+            invalid = _get_favourite_json(3)
+            invalid.pop("title")
+            missing_location = _get_favourite_json(4)
+            missing_location["location_id"] = 999
+            batch = [_get_favourite_json(3), invalid, missing_location]
+            resp = test_client.post(self.URL, json=batch)
+            assert resp.status_code == 207
+            assert resp.mimetype == MASON_CONTENT
+            items = json.loads(resp.data)["items"]
+            assert [item["status"] for item in items] == [201, 400, 404]
+            assert "@error" in items[1]
+            resp = test_client.get(items[0]["@controls"]["self"]["href"])
+            assert resp.status_code == 200
+
+            # The cache of the collection was cleared once for the batch
+            data = json.loads(test_client.get(self.COLLECTION_URL).data)
+            assert len(data["items"]) == 4
+
+            # Not an array
+            resp = test_client.post(self.URL, json=_get_favourite_json())
+            assert resp.status_code == 400
+
+            # Too many items
+            resp = test_client.post(self.URL, json=[_get_favourite_json()] * 101)
+            assert resp.status_code == 400
+
+
 @pytest.mark.usefixtures("client")
 class TestFavouriteItem:
     """
@@ -735,6 +823,61 @@ class TestFavouriteItem:
     INVALID_URL = "/api/users/user37722c77-8004-41d7-993f-ef4f24356ce3/favourites/2/"
     URL_INVALID_USER = "/api/users/user10/favourites/1/"
 
+    def test_converter_cache(self, client):
+        """
+        Test that a repeated request resolves the user and the favourite from
+        the converter cache without querying the database, and that the cache
+        doesn't hide a deleted favourite.
+        """
+        with client.app_context():
+            populate_db(db)
+            test_client = client.test_client()
+            assert test_client.get(self.URL).status_code == 200
+            db.session.remove()
+
+            statements = []
+
+            def count_statement(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                resp = test_client.get(self.URL)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+            assert resp.status_code == 200
+            assert statements == []
+
+            # Another user's favourite is not found
+            assert test_client.get(self.INVALID_URL).status_code == 404
+
+            resp = test_client.delete(self.URL, headers=_get_user_auth_headers())
+            assert resp.status_code == 204
+            assert test_client.get(self.URL).status_code == 404
+
+    def test_converter_cache_write(self, client):
+        """
+        Test that a write request doesn't use a cached favourite that was
+        deleted behind the cache, e.g. by another process
+        """
+        with client.app_context():
+            populate_db(db)
+            test_client = client.test_client()
+            assert test_client.get(self.URL).status_code == 200
+            favourite_id = int(self.URL.rstrip("/").rsplit("/", 1)[1])
+            db.session.execute(
+                Favourite.__table__.delete().where(Favourite.id == favourite_id)
+            )
+            db.session.commit()
+            db.session.remove()
+
+            resp = test_client.put(
+                self.URL, json=_get_favourite_json(), headers=_get_user_auth_headers()
+            )
+            assert resp.status_code == 404
+            resp = test_client.delete(self.URL, headers=_get_user_auth_headers())
+            assert resp.status_code == 404
+
     def test_get(self, client):
         """
         This function is a test function that takes a client as a parameter.
@@ -897,3 +1040,120 @@ class TestExtraURLs:
             # test with correct content type and valid user params
             resp = test_client.post(LOGIN_URL, json=valid)
             assert resp.status_code == 200
+
+
+@pytest.mark.usefixtures("client")
+class TestBodyBuilder:
+    """
+    This class contains tests for the control templates of the BodyBuilder.
+    """
+
+    def test_href(self, client):
+        """
+        Test that URLs built from templates match the ones built by url_for
+        """
+        with client.app_context():
+            populate_db(db)
+            user = User.query.first()
+            favourite = user.favourites[0]
+            with client.test_request_context("/api/"):
+                assert BodyBuilder.href(
+                    "api.favouriteitem", user=user.name, favourite=favourite.id
+                ) == url_for("api.favouriteitem", user=user, favourite=favourite)
+                assert BodyBuilder.href("api.locationcollection") == url_for(
+                    "api.locationcollection"
+                )
+
+                # Static controls are built once and shared between bodies
+                first, second = BodyBuilder(), BodyBuilder()
+                first.add_control_add_location()
+                second.add_control_add_location()
+                ctrl = first["@controls"]["bikinghub:location-add"]
+                assert ctrl is second["@controls"]["bikinghub:location-add"]
+                assert ctrl["schema"] == Location.json_schema()
+
+
+class TestValidator:
+    """
+    This class contains tests for the compiled json schema validators.
+    """
+
+    DOCS = [
+        {},
+        [],
+        {"name": 1},
+        {"name": 1, "password": 2},
+        {"name": "location", "latitude": "north", "longitude": None},
+        {"title": None, "description": 1, "location_id": "1"},
+    ]
+
+    @staticmethod
+    def _message(function, doc):
+        try:
+            function(doc)
+        except ValidationError as e:
+            return e.message
+        return None
+
+    def test_best_match(self):
+        """
+        Test that the validators raise the same error as jsonschema.validate
+        """
+        for model in (User, Location, Favourite):
+            for doc in self.DOCS:
+                expected = self._message(
+                    lambda doc, model=model: validate(doc, model.json_schema()), doc
+                )
+                assert self._message(get_validator(model).validate, doc) == expected
+
+
+@pytest.mark.usefixtures("client")
+class TestCompression:
+    """
+    This class contains tests for the response compression of the API.
+    """
+
+    URL = "/api/locations/"
+
+    def test_gzip(self, client):
+        """
+        Test that large responses are gzipped when the client accepts it and
+        that the compressed page is cached next to the page
+        """
+        with client.app_context():
+            cache.clear()
+            populate_db(db)
+            for i in range(20):
+                db.session.add(
+                    Location(name=f"location-gz{i}", latitude=60 + i, longitude=25)
+                )
+            db.session.commit()
+            test_client = client.test_client()
+
+            plain = test_client.get(self.URL)
+            assert "Content-Encoding" not in plain.headers
+            assert "Accept-Encoding" in plain.headers["Vary"]
+
+            resp = test_client.get(self.URL, headers={"Accept-Encoding": "gzip"})
+            assert resp.status_code == 200
+            assert resp.headers["Content-Encoding"] == "gzip"
+            assert gzip.decompress(resp.data) == plain.data
+            assert cache.get(self.URL + "[page_0][gzip]")[1] == resp.data
+
+            # A compressed page that doesn't match the page is replaced
+            cache.set(self.URL + "[page_0][gzip]", (b"stale", b"stale"))
+            cache.delete(self.URL + "[page_0]")
+            resp = test_client.get(self.URL, headers={"Accept-Encoding": "gzip"})
+            assert gzip.decompress(resp.data) == plain.data
+            assert cache.get(self.URL + "[page_0][gzip]")[1] == resp.data
+            resp = test_client.get(self.URL, headers={"Accept-Encoding": "gzip"})
+            assert gzip.decompress(resp.data) == plain.data
+
+            # Small responses are not compressed
+            resp = test_client.get("/api/", headers={"Accept-Encoding": "gzip"})
+            assert "Content-Encoding" not in resp.headers
+
+            # Adding a location invalidates the compressed page as well
+            resp = test_client.post(self.URL, json=_get_location_json())
+            assert resp.status_code == 201
+            assert cache.get(self.URL + "[page_0][gzip]") is None
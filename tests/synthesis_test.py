@@ -0,0 +1,46 @@
+"""
+This module contains tests for the helpers of the TTS service that split the
+text and stream the WAV audio.
+"""
+
+import io
+import wave
+import synthesis
+
+
+def test_split_sentences():
+    """
+    Test that the text is split into sentences and long sentences at commas
+    """
+    assert synthesis.split_sentences(" One. Two!  Three? Four ") == [
+        "One.",
+        "Two!",
+        "Three?",
+        "Four",
+    ]
+    text = "Wind 4 m/s, rain 2 mm, humidity 81 %, visibility good."
+    assert synthesis.split_sentences(text, max_chars=25) == [
+        "Wind 4 m/s, rain 2 mm,",
+        "humidity 81 %,",
+        "visibility good.",
+    ]
+    assert synthesis.split_sentences(text) == [text]
+    assert not synthesis.split_sentences("  ")
+
+
+def test_wav_header():
+    """
+    Test that the header describes mono 16-bit PCM of the given size
+    """
+    pcm = b"\x01\x00" * 100
+    header = synthesis.wav_header(22050, len(pcm))
+    assert len(header) == 44
+    with wave.open(io.BytesIO(header + pcm), "rb") as wav:
+        assert wav.getnchannels() == 1
+        assert wav.getsampwidth() == 2
+        assert wav.getframerate() == 22050
+        assert wav.getnframes() == 100
+
+    header = synthesis.wav_header(22050)
+    assert header[4:8] == b"\xff\xff\xff\xff"
+    assert header[40:44] == b"\xff\xff\xff\xff"
@@ -0,0 +1,63 @@
+"""
+This module tests the weather path against the stand-in FMI and MML server.
+"""
+
+import json
+from benchmarks.upstream import UpstreamServer
+from conftest import populate_db
+from bikinghub import create_app, db
+from bikinghub.models import WeatherData
+
+
+def _app(server, directory, **config):
+    db_fname = directory / "upstream.db"
+    return create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_fname}",
+            **server.app_config(),
+            **config,
+        }
+    )
+
+
+def test_weather_from_upstream(tmp_path):
+    """
+    Test that the weather is fetched from the configured upstream URLs
+    """
+    with UpstreamServer() as server:
+        app = _app(server, tmp_path)
+        with app.app_context():
+            populate_db(db)
+            resp = app.test_client().get("/api/locations/4/weather/")
+            assert resp.status_code == 200
+            body = json.loads(resp.data)
+            assert body["items"]["weather_description"] == "Selkeää"
+            assert WeatherData.query.filter_by(location_id=4).count() == 12
+            db.engine.dispose()
+        # Reverse geocoding, place name and forecast
+        assert server.stats == {"requests": 3, "errors": 0}
+
+
+def test_injected_errors(tmp_path):
+    """
+    Test that injected errors are answered with 502 and that the same seed
+    injects the same errors
+    """
+    with UpstreamServer(error_rate=1.0) as server:
+        app = _app(server, tmp_path)
+        with app.app_context():
+            populate_db(db)
+            resp = app.test_client().get("/api/locations/4/weather/")
+            assert resp.status_code == 502
+            body = json.loads(resp.data)
+            assert body["@error"]["@message"] == "Weather service unavailable"
+            assert "503" in body["@error"]["@messages"][0]
+            assert WeatherData.query.filter_by(location_id=4).count() == 0
+            db.engine.dispose()
+
+    first = UpstreamServer(error_rate=0.5, latency=1, jitter=5, seed=3)
+    second = UpstreamServer(error_rate=0.5, latency=1, jitter=5, seed=3)
+    assert [first.draw() for _ in range(20)] == [second.draw() for _ in range(20)]
+    first.server_close()
+    second.server_close()
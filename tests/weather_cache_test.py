@@ -0,0 +1,58 @@
+"""
+This module contains tests for the weather cache of the TTS service.
+"""
+
+from types import SimpleNamespace
+import weather_cache
+
+
+def _clock(monkeypatch, module, now):
+    clock = SimpleNamespace(now=now)
+    monkeypatch.setattr(module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_weather_cache_ttl(monkeypatch):
+    """
+    Test that an entry is fresh for the TTL and can be revalidated after it
+    """
+    clock = _clock(monkeypatch, weather_cache, 10 * 3600.0)
+    cache = weather_cache.WeatherCache(ttl=300)
+    assert cache.get(1) is None
+    cache.put(1, "Sunny", etag='"a"')
+    clock.now += 299
+    assert cache.get(1) == "Sunny"
+    clock.now += 2
+    assert cache.get(1) is None
+    assert cache.etag(1) == '"a"'
+    assert cache.etag(2) is None
+
+    assert cache.revalidate(1) == "Sunny"
+    assert cache.revalidate(2) is None
+    clock.now += 299
+    assert cache.get(1) == "Sunny"
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 2,
+        "revalidations": 1,
+        "entries": 1,
+    }
+
+
+def test_weather_cache_hour(monkeypatch):
+    """
+    Test that an entry is stale in the next hour even within the TTL
+    """
+    clock = _clock(monkeypatch, weather_cache, 11 * 3600.0 - 10)
+    cache = weather_cache.WeatherCache(ttl=300)
+    cache.put(1, "Cloudy")
+    clock.now += 9
+    assert cache.get(1) == "Cloudy"
+    clock.now += 2
+    assert cache.get(1) is None
+
+    cache = weather_cache.WeatherCache(ttl=300, max_entries=2)
+    for location_id in range(3):
+        cache.put(location_id, "Rain")
+    assert cache.get(0) is None
+    assert cache.get(2) == "Rain"